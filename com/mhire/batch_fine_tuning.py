@@ -0,0 +1,263 @@
+import argparse
+import gc
+import json
+import os
+import time
+import traceback
+from datetime import datetime
+
+import torch
+import yaml
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from com.mhire.utility.util import log, log_error, logger, gsutil_url_log
+from com.mhire.utility.log_util import LogUploader
+from com.mhire.utility.gcp_util import GCPUtil
+from com.mhire.utility.artifact_cache import ArtifactCache
+from com.mhire.utility.docker_util import DockerUtil
+from com.mhire.fine_tuning.fine_tuning import FineTuneModel
+from com.mhire.fine_tuning.quantize import quantize, default_quantization_level
+from com.mhire.fine_tuning.tokenization_cache import default_cache_dir
+from com.mhire.fine_tuning.checkpointing import default_checkpoint_root, to_cpu
+from com.mhire.fine_tuning.lora import LoraTrainingConfig, default_config_path
+from com.mhire.fine_tuning.telemetry import ProfilerConfig, default_telemetry_root, default_metrics_port
+
+default_batch_dir = "/llm-utility/batch"
+spec_extensions = (".json", ".jsonl", ".yaml", ".yml")
+required_fields = ("fine_tuning_id", "dataset_path")
+
+
+# Function to read job specs from a spec file, or from every spec file in a directory
+def load_job_specs(path):
+    if os.path.isdir(path):
+        spec_files = sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(spec_extensions))
+    else:
+        spec_files = [path]
+
+    jobs = []
+    for spec_file in spec_files:
+        with open(spec_file, "r", encoding="utf-8") as f:
+            if spec_file.endswith(".jsonl"):
+                jobs.extend(json.loads(line) for line in f if line.strip())
+            else:
+                # YAML also parses JSON, a file holds one job or a list of jobs
+                specs = yaml.safe_load(f) or []
+                jobs.extend(specs if isinstance(specs, list) else [specs])
+
+    seen = set()
+    for job in jobs:
+        missing = [field for field in required_fields if not job.get(field)]
+        if missing:
+            raise ValueError(f"Job spec {job} is missing {missing}")
+        if job["fine_tuning_id"] in seen:
+            raise ValueError(f"Duplicate fine_tuning_id {job['fine_tuning_id']} in {path}")
+        seen.add(job["fine_tuning_id"])
+    return jobs
+
+
+# Function to group jobs by base model, keeping queue order within and across groups
+def group_by_model(jobs, default_model_path=None):
+    groups = {}
+    for job in jobs:
+        model_path = job.get("model_path", default_model_path)
+        if not model_path:
+            raise ValueError(f"Job {job['fine_tuning_id']} has no model_path and no default was given")
+        groups.setdefault(model_path, []).append(job)
+    return groups
+
+
+class BatchRunner:
+    """Runs queued fine-tuning jobs in turn, loading each base model only once.
+
+    LoRA jobs train adapters on the shared base model and strip them afterwards;
+    full fine-tunes get the base weights restored from a host copy. Every job has
+    its own directory, log file and result.json, and finished jobs are skipped
+    when a batch is restarted.
+    """
+
+    def __init__(self, gcp_util, docker_util=None, work_dir=default_batch_dir, upload_logs=True):
+        self.gcp_util = gcp_util
+        self.docker_util = docker_util
+        self.work_dir = work_dir
+        self.upload_logs = upload_logs
+        self.fine_tuning = FineTuneModel()
+        self.profiler_config = ProfilerConfig.from_yaml()
+        self.results = []
+
+    # Function to get a local copy of a gs:// path, local paths are used as they are
+    def fetch(self, path, local_dir):
+        if not path.startswith("gs://"):
+            return path
+        os.makedirs(local_dir, exist_ok=True)
+        self.gcp_util.download_from_gcs(path, local_dir)
+        return os.path.join(local_dir, os.path.basename(path))
+
+    def load_base_model(self, model_dir):
+        log(f"Loading base model from {model_dir}")
+        start = time.time()
+        tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        model = AutoModelForCausalLM.from_pretrained(model_dir)
+        log(f"Base model loaded in {time.time() - start:.1f}s")
+        return model, tokenizer
+
+    def job_dir(self, job):
+        return os.path.join(self.work_dir, "jobs", job["fine_tuning_id"])
+
+    def is_done(self, job):
+        result_path = os.path.join(self.job_dir(job), "result.json")
+        if not os.path.isfile(result_path):
+            return False
+        with open(result_path, "r", encoding="utf-8") as f:
+            return json.load(f).get("status") == "done"
+
+    def run_job(self, job, model, tokenizer, model_dir):
+        """Fine-tunes one job on the loaded model, with its log redirected to the job dir."""
+        fine_tuning_id = job["fine_tuning_id"]
+        job_dir = self.job_dir(job)
+        os.makedirs(job_dir, exist_ok=True)
+        batch_log = logger.path
+        logger.redirect(os.path.join(job_dir, "logs.jsonl"))
+        # The batch log keeps its own uploader, this one ships only the job's log
+        uploader = None
+        if self.upload_logs:
+            uploader = LogUploader(logger, self.gcp_util.storage_client, f"{gsutil_url_log}{fine_tuning_id}.jsonl")
+            uploader.start()
+
+        result = {"fine_tuning_id": fine_tuning_id, "model_path": job.get("model_path"), "started": time.time()}
+        try:
+            log(f"Starting job {fine_tuning_id}")
+            dataset_local_path = self.fetch(job["dataset_path"], job_dir)
+            # A job may bring its own recipe, or set lora: false for a full fine-tune
+            lora_config = None
+            if job.get("lora", True):
+                lora_config = LoraTrainingConfig.from_yaml(job.get("config", default_config_path))
+
+            # Token-budget buckets need the tokenized lengths, so only stream when a job turns them off
+            max_batch_tokens = job.get("max_batch_tokens", 8192)
+            output_path = self.fine_tuning.fine_tune_model(
+                model_dir, dataset_local_path, streaming=not max_batch_tokens, cache_dir=default_cache_dir,
+                dynamic_padding=True, max_batch_tokens=max_batch_tokens, num_proc=os.cpu_count(),
+                checkpoint_dir=os.path.join(default_checkpoint_root, fine_tuning_id), lora_config=lora_config,
+                telemetry_dir=os.path.join(default_telemetry_root, fine_tuning_id), profiler_config=self.profiler_config,
+                metrics_port=default_metrics_port, model=model, tokenizer=tokenizer,
+                output_dir=os.path.join(job_dir, "finetuned"))
+            result["output_path"] = output_path
+
+            # Jobs that name an image are quantized and shipped like a single-job run
+            if job.get("docker_image"):
+                gguf_path = os.path.join(job_dir, "model_file.gguf")
+                quantize(output_path, gguf_path, level=job.get("quantization_level", default_quantization_level),
+                         calibration_jsonl=dataset_local_path)
+                self.docker_util.build_docker_image(job["docker_image"], gguf_path,
+                                                    context_dir=os.path.join(job_dir, "ollama_image"))
+                self.docker_util.push_docker_image(job["docker_image"])
+                result["docker_image"] = job["docker_image"]
+            result["status"] = "done"
+            log(f"Job {fine_tuning_id} finished")
+        except Exception as e:
+            log_error(f"Job {fine_tuning_id} failed: {traceback.format_exc()}")
+            result["status"] = "failed"
+            result["error"] = str(e)
+        finally:
+            result["duration_sec"] = round(time.time() - result["started"], 3)
+            with open(os.path.join(job_dir, "result.json"), "w", encoding="utf-8") as f:
+                json.dump(result, f, indent=2)
+            if uploader:
+                uploader.stop()
+            logger.redirect(batch_log)
+        return result
+
+    def run(self, jobs, default_model_path=None):
+        """Runs every job not finished before and returns the batch report."""
+        batch_start = time.time()
+        for group_index, (model_path, group) in enumerate(group_by_model(jobs, default_model_path).items()):
+            pending = [job for job in group if not self.is_done(job)]
+            if len(pending) < len(group):
+                log(f"Skipping {len(group) - len(pending)} finished jobs for {model_path}")
+            if not pending:
+                continue
+
+            model_dir = self.fetch(model_path, os.path.join(self.work_dir, "models", str(group_index)))
+            # A zip archive is extracted next to where it would have landed
+            if model_dir.endswith(".zip"):
+                model_dir = os.path.dirname(model_dir)
+            model, tokenizer = self.load_base_model(model_dir)
+            # Full fine-tunes overwrite the weights, keep a host copy to restore them from
+            base_state = None
+            if any(not job.get("lora", True) for job in pending):
+                base_state = to_cpu(model.state_dict())
+
+            for job in pending:
+                result = self.run_job(job, model, tokenizer, model_dir)
+                self.results.append(result)
+                if base_state is not None and not job.get("lora", True):
+                    model.load_state_dict(base_state)
+                elif result["status"] == "failed":
+                    # The job may have died with adapters still attached, start the next one clean
+                    del model
+                    gc.collect()
+                    model, _ = self.load_base_model(model_dir)
+                gc.collect()
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+                self.log_throughput(batch_start)
+
+            del model, tokenizer, base_state
+            gc.collect()
+
+        return self.report(batch_start)
+
+    def report(self, batch_start):
+        elapsed = time.time() - batch_start
+        done = [result for result in self.results if result["status"] == "done"]
+        return {
+            "created": datetime.now().isoformat(),
+            "elapsed_sec": round(elapsed, 3),
+            "jobs_run": len(self.results),
+            "jobs_done": len(done),
+            "jobs_failed": len(self.results) - len(done),
+            "jobs_per_hour": round(len(done) / (elapsed / 3600), 2) if elapsed > 0 else 0.0,
+            "results": self.results,
+        }
+
+    def log_throughput(self, batch_start):
+        report = self.report(batch_start)
+        log(f"Batch progress: {report['jobs_done']} done, {report['jobs_failed']} failed, "
+            f"{report['jobs_per_hour']} jobs/hour")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a queue of fine-tuning jobs, loading each base model once")
+    parser.add_argument("--jobs", required=True, help="job spec file (.json, .jsonl, .yaml) or a directory of them")
+    parser.add_argument("--model-path", default=None, help="base model for jobs that do not set model_path")
+    parser.add_argument("--work-dir", default=default_batch_dir)
+    parser.add_argument("--no-log-upload", action="store_true", help="keep job logs local only")
+    args = parser.parse_args()
+
+    gcp_util = GCPUtil(service_account_key_path="/tmp/service_account_key.json", artifact_cache=ArtifactCache())
+    jobs = load_job_specs(args.jobs)
+    docker_util = DockerUtil() if any(job.get("docker_image") for job in jobs) else None
+
+    batch_id = datetime.now().strftime("batch_%Y-%m-%d_%H-%M-%S")
+    os.makedirs(args.work_dir, exist_ok=True)
+    logger.redirect(os.path.join(args.work_dir, f"{batch_id}.jsonl"))
+    if not args.no_log_upload:
+        logger.start_upload(gcp_util.storage_client, f"{gsutil_url_log}{batch_id}.jsonl")
+
+    try:
+        log(f"Starting batch of {len(jobs)} jobs from {args.jobs}")
+        runner = BatchRunner(gcp_util, docker_util, work_dir=args.work_dir, upload_logs=not args.no_log_upload)
+        report = runner.run(jobs, args.model_path)
+        report_path = os.path.join(args.work_dir, f"{batch_id}_report.json")
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        log(f"Batch finished: {report['jobs_done']} of {report['jobs_run']} jobs done in {report['elapsed_sec']:.0f}s, "
+            f"{report['jobs_per_hour']} jobs/hour. Report written to {report_path}")
+    except Exception:
+        log_error(f"Batch failed: {traceback.format_exc()}")
+    finally:
+        logger.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import random
+import time
+
+import torch
+from torch.utils.data import DataLoader, Sampler
+from transformers import Trainer
+
+
+# Function to get the padded length of an example (prompt and labels share a row)
+def example_length(example):
+    return max(len(example['input_ids']), len(example['labels']))
+
+
+class DynamicPaddingCollator:
+    """Pads each batch only up to its own longest sequence."""
+
+    def __init__(self, pad_token_id, label_pad_token_id=-100, pad_to_multiple_of=None):
+        self.pad_token_id = pad_token_id
+        self.label_pad_token_id = label_pad_token_id
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, features):
+        max_length = max(example_length(example) for example in features)
+        if self.pad_to_multiple_of:
+            max_length = -(-max_length // self.pad_to_multiple_of) * self.pad_to_multiple_of
+
+        batch = {'input_ids': [], 'attention_mask': [], 'labels': []}
+        for example in features:
+            input_ids = list(example['input_ids'])
+            attention_mask = list(example.get('attention_mask', [1] * len(input_ids)))
+            labels = list(example['labels'])
+            batch['input_ids'].append(input_ids + [self.pad_token_id] * (max_length - len(input_ids)))
+            batch['attention_mask'].append(attention_mask + [0] * (max_length - len(attention_mask)))
+            # Padded label positions are ignored by the loss
+            batch['labels'].append(labels + [self.label_pad_token_id] * (max_length - len(labels)))
+        return {key: torch.tensor(values, dtype=torch.long) for key, values in batch.items()}
+
+
+class LengthBucketBatchSampler(Sampler):
+    """Groups similar-length examples into batches that fit a token budget."""
+
+    def __init__(self, lengths, max_batch_tokens, bucket_size=10000, shuffle=True, seed=0):
+        self.lengths = list(lengths)
+        self.max_batch_tokens = max_batch_tokens
+        self.bucket_size = bucket_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self._batches = None
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+        self._batches = None
+
+    def _build_batches(self):
+        indices = list(range(len(self.lengths)))
+        rng = random.Random(self.seed + self.epoch)
+        if self.shuffle:
+            rng.shuffle(indices)
+
+        # Sort inside large shuffled windows so batches stay random but tightly packed
+        batches = []
+        for start in range(0, len(indices), self.bucket_size):
+            bucket = sorted(indices[start:start + self.bucket_size], key=lambda i: self.lengths[i])
+            batch, batch_max = [], 0
+            for index in bucket:
+                length = self.lengths[index]
+                # Cost of a padded batch is its size times its longest row
+                if batch and max(batch_max, length) * (len(batch) + 1) > self.max_batch_tokens:
+                    batches.append(batch)
+                    batch, batch_max = [], 0
+                batch.append(index)
+                batch_max = max(batch_max, length)
+            if batch:
+                batches.append(batch)
+
+        if self.shuffle:
+            rng.shuffle(batches)
+        return batches
+
+    def __iter__(self):
+        if self._batches is None:
+            self._batches = self._build_batches()
+        batches, self._batches = self._batches, None
+        # Every pass reshuffles with the next epoch's seed, set_epoch() can still pin it on resume
+        self.epoch += 1
+        yield from batches
+
+    def __len__(self):
+        if self._batches is None:
+            self._batches = self._build_batches()
+        return len(self._batches)
+
+
+class DynamicBatchTrainer(Trainer):
+    """Trainer that supports token-budget batching and reports token throughput."""
+
+    def __init__(self, *args, batch_sampler=None, telemetry=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batch_sampler = batch_sampler
+        # Optional TrainingTelemetry, timed around every micro-batch
+        self.telemetry = telemetry
+        if telemetry is not None:
+            self.add_callback(telemetry)
+        self.num_tokens = 0
+        self.num_padded_tokens = 0
+        self._throughput_start = None
+        self._throughput_tokens = 0
+
+    def get_train_dataloader(self):
+        if self.batch_sampler is None:
+            return super().get_train_dataloader()
+        self.batch_sampler.set_epoch(int(self.state.epoch or 0))
+        dataloader = DataLoader(
+            self.train_dataset,
+            batch_sampler=self.batch_sampler,
+            collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+        )
+        return self.accelerator.prepare(dataloader)
+
+    def training_step(self, model, inputs, *args, **kwargs):
+        if self._throughput_start is None:
+            self._throughput_start = time.perf_counter()
+        attention_mask = inputs.get('attention_mask')
+        batch_tokens = 0
+        if attention_mask is not None:
+            batch_tokens = int(attention_mask.sum())
+            self.num_tokens += batch_tokens
+            self.num_padded_tokens += attention_mask.numel()
+        elif inputs.get('input_ids') is not None:
+            batch_tokens = inputs['input_ids'].numel()
+        if self.telemetry is None:
+            return super().training_step(model, inputs, *args, **kwargs)
+        self.telemetry.micro_step_begin(batch_tokens)
+        try:
+            return super().training_step(model, inputs, *args, **kwargs)
+        finally:
+            self.telemetry.micro_step_end()
+
+    def log(self, logs, *args, **kwargs):
+        if self._throughput_start is not None:
+            now = time.perf_counter()
+            elapsed = now - self._throughput_start
+            if elapsed > 0:
+                logs['tokens_per_sec'] = round((self.num_tokens - self._throughput_tokens) / elapsed, 2)
+            if self.num_padded_tokens:
+                logs['padding_ratio'] = round(1 - self.num_tokens / self.num_padded_tokens, 4)
+            self._throughput_start = now
+            self._throughput_tokens = self.num_tokens
+        super().log(logs, *args, **kwargs)
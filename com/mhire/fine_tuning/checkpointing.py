@@ -0,0 +1,163 @@
+import copy
+import logging
+import os
+import random
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from transformers import TrainerCallback
+from transformers.training_args import ParallelMode
+
+from com.mhire.utility.cache_util import cache_root, publish_dir
+
+logger = logging.getLogger(__name__)
+
+default_checkpoint_root = os.path.join(cache_root, "checkpoints")
+checkpoint_pattern = re.compile(r"^checkpoint-(\d+)$")
+
+
+# Function to copy every tensor in a (nested) state dict to host memory
+def to_cpu(state):
+    if isinstance(state, torch.Tensor):
+        return state.detach().to("cpu", copy=True)
+    if isinstance(state, dict):
+        return {key: to_cpu(value) for key, value in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(to_cpu(value) for value in state)
+    return copy.deepcopy(state)
+
+
+# Function to capture the RNG state in the layout Trainer._load_rng_state reads on resume
+def rng_state(args):
+    state = {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "cpu": torch.random.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        if args.parallel_mode == ParallelMode.DISTRIBUTED:
+            state["cuda"] = torch.cuda.random.get_rng_state_all()
+        else:
+            state["cuda"] = torch.cuda.random.get_rng_state()
+    return state
+
+
+# Function to tell a LoRA-wrapped model from a plain one, a base model keeps a stale
+# peft_config after its adapters are unloaded, so the attribute alone is not enough
+def is_peft_model(model):
+    try:
+        from peft import PeftModel
+    except ImportError:
+        return False
+    return isinstance(model, PeftModel)
+
+
+# Function to list finished checkpoints, oldest first
+def list_checkpoints(checkpoint_dir):
+    if not os.path.isdir(checkpoint_dir):
+        return []
+    steps = []
+    for name in os.listdir(checkpoint_dir):
+        match = checkpoint_pattern.match(name)
+        if match and os.path.isdir(os.path.join(checkpoint_dir, name)):
+            steps.append((int(match.group(1)), os.path.join(checkpoint_dir, name)))
+    return [path for _, path in sorted(steps)]
+
+
+# Function to get the newest finished checkpoint, or None
+def latest_checkpoint(checkpoint_dir):
+    checkpoints = list_checkpoints(checkpoint_dir)
+    return checkpoints[-1] if checkpoints else None
+
+
+# Function to drop a finished run's checkpoints, they are only resume points
+def remove_checkpoints(checkpoint_dir):
+    if os.path.isdir(checkpoint_dir):
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+        logger.info(f"Removed checkpoints in {checkpoint_dir}")
+
+
+class AsyncCheckpointCallback(TrainerCallback):
+    """Snapshots training state to host memory and writes checkpoints on a background thread.
+
+    Checkpoints use the Trainer's own layout, so trainer.train(resume_from_checkpoint=...)
+    can pick them up after a preemption. Each one holds the model (or adapter) weights,
+    optimizer, LR scheduler, RNG and trainer state. The dataloader position is not
+    saved: on resume the Trainer rebuilds it from global_step, re-seeding the sampler
+    for the epoch and skipping the batches already trained, so it is exact only for
+    samplers that are deterministic per epoch. A stream is re-read from the start up
+    to that point. In multi-process runs only rank zero writes, so other ranks resume
+    with fresh RNG state.
+    """
+
+    def __init__(self, checkpoint_dir, save_steps, keep_last=2, max_shard_size="5GB"):
+        self.checkpoint_dir = checkpoint_dir
+        self.save_steps = save_steps
+        self.keep_last = keep_last
+        self.max_shard_size = max_shard_size
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+
+    def on_step_end(self, args, state, control, model=None, optimizer=None, lr_scheduler=None, **kwargs):
+        if self.save_steps <= 0 or state.global_step % self.save_steps != 0:
+            return
+        # Only one write in flight, so at most one extra copy of the weights is held in memory
+        self.wait()
+        # LoRA models only need their adapter weights in a checkpoint
+        if is_peft_model(model):
+            from peft import get_peft_model_state_dict
+            model_state = get_peft_model_state_dict(model)
+        else:
+            model_state = model.state_dict()
+        snapshot = {
+            "model_state": to_cpu(model_state),
+            "optimizer_state": to_cpu(optimizer.state_dict()) if optimizer is not None else None,
+            "scheduler_state": copy.deepcopy(lr_scheduler.state_dict()) if lr_scheduler is not None else None,
+            "trainer_state": copy.deepcopy(state),
+            "rng_state": rng_state(args),
+        }
+        if state.is_world_process_zero:
+            self.pending = self.executor.submit(self._write, model, args, state.global_step, snapshot)
+
+    def on_train_end(self, args, state, control, **kwargs):
+        self.wait()
+
+    def wait(self):
+        """Blocks until the in-flight checkpoint write has finished."""
+        if self.pending is not None:
+            self.pending.result()
+            self.pending = None
+
+    def _write(self, model, args, step, snapshot):
+        final_dir = os.path.join(self.checkpoint_dir, f"checkpoint-{step}")
+        tmp_dir = f"{final_dir}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        # Sharded safetensors from the host snapshot, written exactly once
+        if is_peft_model(model):
+            model.save_pretrained(tmp_dir, state_dict=snapshot["model_state"], safe_serialization=True)
+        else:
+            model.save_pretrained(tmp_dir, state_dict=snapshot["model_state"], safe_serialization=True,
+                                  max_shard_size=self.max_shard_size)
+        if snapshot["optimizer_state"] is not None:
+            torch.save(snapshot["optimizer_state"], os.path.join(tmp_dir, "optimizer.pt"))
+        if snapshot["scheduler_state"] is not None:
+            torch.save(snapshot["scheduler_state"], os.path.join(tmp_dir, "scheduler.pt"))
+        rng_file = "rng_state.pth" if args.world_size <= 1 else f"rng_state_{args.process_index}.pth"
+        torch.save(snapshot["rng_state"], os.path.join(tmp_dir, rng_file))
+        snapshot["trainer_state"].save_to_json(os.path.join(tmp_dir, "trainer_state.json"))
+        torch.save(args, os.path.join(tmp_dir, "training_args.bin"))
+
+        # Publish atomically so a half-written checkpoint is never resumed from
+        publish_dir(tmp_dir, final_dir)
+        logger.info(f"Checkpoint written to {final_dir}")
+
+        # The newest checkpoint is the resume point, so it stays even with keep_last=0
+        for old_dir in list_checkpoints(self.checkpoint_dir)[:-max(self.keep_last, 1)]:
+            shutil.rmtree(old_dir, ignore_errors=True)
+            logger.info(f"Removed old checkpoint {old_dir}")
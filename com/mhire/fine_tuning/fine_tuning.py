@@ -1,11 +1,17 @@
-import json
 import os
 import traceback
 import logging
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from transformers import AutoTokenizer, AutoModelForCausalLM, Trainer, TrainingArguments
+from transformers import AutoTokenizer, AutoModelForCausalLM, TrainingArguments
 from com.mhire.utility.util import log_error
+from com.mhire.fine_tuning.streaming_dataset import StreamingJsonlDataset, iter_jsonl
+from com.mhire.fine_tuning.tokenization_cache import TokenizationCache
+from com.mhire.fine_tuning.parallel_tokenizer import ParallelTokenizer, default_chunk_size
+from com.mhire.fine_tuning.batching import DynamicBatchTrainer, DynamicPaddingCollator, LengthBucketBatchSampler, example_length
+from com.mhire.fine_tuning.checkpointing import AsyncCheckpointCallback, latest_checkpoint, remove_checkpoints
+from com.mhire.fine_tuning.telemetry import TrainingTelemetry
 # Configure the logger
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', handlers=[logging.StreamHandler()])
 logger = logging.getLogger(__name__)
@@ -13,7 +19,8 @@ logger = logging.getLogger(__name__)
 
 class FineTuneModel():
     def __init__(self):
-        pass
+        # Tokenization cache still being filled in the background while training streams
+        self.background_cache = None
     # Function to load or download the model
     def load_local_model(self, local_model_path):
         model, tokenizer = '', ''
@@ -25,20 +32,50 @@ class FineTuneModel():
         return model, tokenizer
 
     # Function to prepare the dataset
-    def tokenize_dataset(self,tokenizer, jsonl_file_path):
-    
-        def read_jsonl(file_path):
-            with open(file_path, "r", encoding="utf-8") as f:
-                return [json.loads(line) for line in f]
+    def tokenize_dataset(self,tokenizer, jsonl_file_path, streaming=False, cache_dir=None, padding="max_length",
+                         num_proc=1, chunk_size=default_chunk_size, parallel_tokenizer=None):
+        # parallel_tokenizer is a started ParallelTokenizer whose workers the caller forked up front
 
-        dataset = read_jsonl(jsonl_file_path)
+        # A cache hit wins over streaming: the token shards are already on disk and can be bucketed
+        if cache_dir:
+            cache = TokenizationCache(cache_dir)
+            key = cache.cache_key(tokenizer, jsonl_file_path, padding)
+            dataset = cache.load(key)
+            if dataset is not None:
+                if streaming:
+                    logger.warning("Tokenization cache hit, ignoring streaming=True and reading the cached shards")
+                return dataset
+            if not streaming:
+                return cache.build(key, tokenizer, jsonl_file_path, padding=padding, num_proc=num_proc,
+                                   chunk_size=chunk_size, parallel_tokenizer=parallel_tokenizer)
+            # On a miss train from the file right away and fill the cache for the next run meanwhile
+            logger.info(f"Tokenization cache miss, streaming {jsonl_file_path} while the cache is built")
+            self.background_cache = cache
+            cache.build_in_background(key, tokenizer, jsonl_file_path, padding=padding, num_proc=num_proc,
+                                      chunk_size=chunk_size, parallel_tokenizer=parallel_tokenizer)
+            return StreamingJsonlDataset(tokenizer, jsonl_file_path, padding=padding)
+
+        # Stream and tokenize the file lazily instead of loading it in memory
+        if streaming:
+            if num_proc > 1:
+                logger.warning(f"Streaming tokenizes in the data loader, ignoring num_proc={num_proc}")
+            return StreamingJsonlDataset(tokenizer, jsonl_file_path, padding=padding)
+
+        # Tokenize chunks of the file in a process pool with batched tokenizer calls
+        if num_proc > 1:
+            parallel_tokenizer = parallel_tokenizer or ParallelTokenizer(tokenizer, num_proc=num_proc, chunk_size=chunk_size,
+                                                                         padding=padding)
+            return parallel_tokenizer.tokenize(jsonl_file_path)
+
+        # Same reader as streaming and parallel tokenization, so blank lines are skipped in every mode
+        dataset = list(iter_jsonl(jsonl_file_path))
 
         # Tokenize data
         def tokenize_function(examples):
             # Tokenize the input text (prompt)
-            inputs = tokenizer(examples['prompt'], padding="max_length", truncation=True)
+            inputs = tokenizer(examples['prompt'], padding=padding, truncation=True)
             # Tokenize the label (completion)
-            labels = tokenizer(examples['completion'], padding="max_length", truncation=True)
+            labels = tokenizer(examples['completion'], padding=padding, truncation=True)
 
             # Use input_ids as labels
             inputs['labels'] = labels['input_ids'].copy()
@@ -49,43 +86,147 @@ class FineTuneModel():
         return tokenized_dataset
 
     # Main function to fine-tune the model
-    def fine_tune_model(self, model_local_path,  dataset_path):
-        model, tokenizer = self.load_local_model(local_model_path=model_local_path)
-        dataset = self.tokenize_dataset(tokenizer, dataset_path)
+    def fine_tune_model(self, model_local_path,  dataset_path, streaming=False, cache_dir=None,
+                        dynamic_padding=False, max_batch_tokens=None, per_device_train_batch_size=1,
+                        num_proc=1, chunk_size=default_chunk_size,
+                        checkpoint_dir=None, save_steps=500, keep_checkpoints=2, lora_config=None,
+                        telemetry_dir=None, profiler_config=None, metrics_port=None,
+                        model=None, tokenizer=None, output_dir=None):
+        # A preloaded model and tokenizer can be passed to reuse one base model across jobs;
+        # LoRA adapters are removed again afterwards so the caller gets the base model back
+        # Dynamic padding leaves rows unpadded and pads each batch in the collator
+        padding = False if dynamic_padding else "max_length"
+        # Token-budget buckets need per-example lengths, which a stream cannot give
+        if streaming and dynamic_padding and max_batch_tokens:
+            logger.warning("max_batch_tokens needs a map-style dataset, tokenizing up front instead of streaming")
+            streaming = False
+
+        # Tokenize on a background thread while the model weights load
+        preloaded = model is not None
+        tokenizer = tokenizer or AutoTokenizer.from_pretrained(model_local_path)
+        # Fork the tokenizer workers now, before the model load and training start threads of their own
+        parallel_tokenizer = None
+        if num_proc > 1 and not (streaming and not cache_dir):
+            parallel_tokenizer = ParallelTokenizer(tokenizer, num_proc=num_proc, chunk_size=chunk_size,
+                                                   padding=padding).start()
+        try:
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                dataset_future = executor.submit(self.tokenize_dataset, tokenizer, dataset_path, streaming=streaming,
+                                                 cache_dir=cache_dir, padding=padding, num_proc=num_proc,
+                                                 chunk_size=chunk_size, parallel_tokenizer=parallel_tokenizer)
+                if not preloaded:
+                    logger.info(f"Loading model from {model_local_path}")
+                    model = AutoModelForCausalLM.from_pretrained(model_local_path)
+                dataset = dataset_future.result()
+        except Exception:
+            if parallel_tokenizer:
+                parallel_tokenizer.close()
+            raise
+        # The workers stay up only while a background cache build still uses them
+        if parallel_tokenizer and not self.background_cache:
+            parallel_tokenizer.close()
+
+        # Train LoRA adapters only when a recipe is given, otherwise all parameters
+        recipe_arguments = {}
+        if lora_config:
+            model = lora_config.apply(model)
+            recipe_arguments = lora_config.training_arguments()
+        num_train_epochs = recipe_arguments.pop('num_train_epochs', 1)
+        gradient_accumulation_steps = recipe_arguments.get('gradient_accumulation_steps', 1)
+
+        data_collator, batch_sampler = None, None
+        if dynamic_padding:
+            pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+            data_collator = DynamicPaddingCollator(pad_token_id)
+            # Token-budget buckets need per-example lengths, so only map-style datasets qualify
+            if max_batch_tokens and not isinstance(dataset, StreamingJsonlDataset):
+                lengths = dataset.lengths() if hasattr(dataset, "lengths") else [example_length(example) for example in dataset]
+                batch_sampler = LengthBucketBatchSampler(lengths, max_batch_tokens)
+                logger.info(f"Bucketing {len(lengths)} examples into {len(batch_sampler)} batches of up to {max_batch_tokens} tokens")
+
+        # An IterableDataset has no length the Trainer can use, so give it the step count
+        max_steps = -1
+        if isinstance(dataset, StreamingJsonlDataset):
+            max_steps = dataset.num_steps(per_device_train_batch_size * gradient_accumulation_steps, num_train_epochs)
+            logger.info(f"Streaming dataset from {dataset_path} for {max_steps} steps")
 
         timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        output_model_path = f"{model_local_path}/finetuned_{timestamp}/"
+        output_model_path = output_dir or f"{model_local_path}/finetuned_{timestamp}/"
         logger.info(f"After Training model will be saved at {output_model_path}")
         training_args = TrainingArguments(
             output_dir=output_model_path,
             #overwrite_output_dir=True,
-            per_device_train_batch_size=1,
-            num_train_epochs=1,
+            per_device_train_batch_size=per_device_train_batch_size,
+            num_train_epochs=num_train_epochs,
+            max_steps=max_steps,
             logging_dir='./logs',
             logging_steps=1,
-            #save_steps=10_000,
-            #save_total_limit = 2
+            # Intermediate checkpoints go through the background writer instead
+            save_strategy="no",
+            **recipe_arguments,
         )
-        
-        trainer = Trainer(
+
+        # Checkpoints are written off the training loop and pruned to the newest few
+        callbacks, resume_from_checkpoint = [], None
+        if checkpoint_dir:
+            callbacks.append(AsyncCheckpointCallback(checkpoint_dir, save_steps, keep_last=keep_checkpoints))
+            resume_from_checkpoint = latest_checkpoint(checkpoint_dir)
+            if resume_from_checkpoint:
+                logger.info(f"Resuming training from {resume_from_checkpoint}")
+
+        # Step timing, throughput and memory, plus the torch profiler when config.yaml enables it
+        telemetry = None
+        if telemetry_dir:
+            telemetry = TrainingTelemetry(telemetry_dir, profiler_config=profiler_config, metrics_port=metrics_port)
+
+        trainer = DynamicBatchTrainer(
             model=model,
             args=training_args,
             train_dataset=dataset,
+            data_collator=data_collator,
+            batch_sampler=batch_sampler,
+            callbacks=callbacks,
+            telemetry=telemetry,
         )
 
+        succeeded = False
         try:
             os.makedirs(output_model_path, exist_ok=True)
             logger.info(f"Training started")
-            trainer.train()
+            trainer.train(resume_from_checkpoint=resume_from_checkpoint)
             logger.info(f"Dir {output_model_path} created")
-            model.save_pretrained(output_model_path)
-            logger.info(f"Model saved after fine tuning")
-            trainer.save_model(output_model_path)
-            logger.info(f"Training saved")
-            tokenizer.save_pretrained(output_model_path)
-            logger.info(f"Tokenizer saved to {output_model_path}")
-            
+            if lora_config:
+                # Adapter checkpoint plus a merged model for quantization and serving
+                lora_config.export(model, tokenizer, output_model_path, keep_base_model=preloaded)
+                logger.info(f"LoRA model exported to {output_model_path}")
+            else:
+                # One sharded safetensors write of the final weights
+                trainer.save_model(output_model_path)
+                logger.info(f"Model saved after fine tuning")
+                tokenizer.save_pretrained(output_model_path)
+                logger.info(f"Tokenizer saved to {output_model_path}")
+            # The model is exported, so this run's resume points would only fill the cache disk
+            if checkpoint_dir:
+                remove_checkpoints(checkpoint_dir)
+            succeeded = True
+
         except Exception as e:
             logger.info(traceback.format_exc())
             log_error(f"Training failed: {str(e)}")
+            # Callers must not mistake a failed run for a finished model
+            raise
+        finally:
+            # Frees the metrics port and closes the profiler even when training raised
+            if telemetry:
+                telemetry.close()
+            # Let the cache build finish so the next run hits it, a failed run just stops it
+            if self.background_cache:
+                self.background_cache.finish_background_build(cancel=not succeeded)
+                self.background_cache = None
+            if parallel_tokenizer:
+                parallel_tokenizer.close()
+            if preloaded and lora_config:
+                lora_config.remove(model)
+
+        return output_model_path
 
@@ -0,0 +1,136 @@
+import logging
+import os
+
+import torch
+import yaml
+from peft import LoraConfig, get_peft_model
+from peft.tuners.lora import LoraLayer
+
+logger = logging.getLogger(__name__)
+
+# config.yaml at the repository root
+default_config_path = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "config.yaml"))
+mlp_modules = ['gate_proj', 'up_proj', 'down_proj']
+
+
+class LoraTrainingConfig:
+    """LoRA recipe read from the torchtune-style config.yaml."""
+
+    def __init__(self, config):
+        model_config = config.get('model', {})
+        optimizer_config = config.get('optimizer', {})
+        scheduler_config = config.get('lr_scheduler', {})
+
+        self.rank = int(model_config.get('lora_rank', 8))
+        self.alpha = float(model_config.get('lora_alpha', 16))
+        self.dropout = float(model_config.get('lora_dropout', 0.0))
+        self.target_modules = list(model_config.get('lora_attn_modules', ['q_proj', 'v_proj']))
+        if model_config.get('apply_lora_to_mlp'):
+            self.target_modules += mlp_modules
+        if model_config.get('apply_lora_to_output'):
+            self.target_modules.append('lm_head')
+
+        self.learning_rate = float(optimizer_config.get('lr', 3e-4))
+        self.weight_decay = float(optimizer_config.get('weight_decay', 0.0))
+        self.warmup_steps = int(scheduler_config.get('num_warmup_steps', 0))
+        self.epochs = int(config.get('epochs', 1))
+        self.gradient_accumulation_steps = int(config.get('gradient_accumulation_steps', 1))
+        self.activation_checkpointing = bool(config.get('enable_activation_checkpointing', False))
+        self.dtype = config.get('dtype', 'fp32')
+        self.save_adapter_weights_only = bool(config.get('save_adapter_weights_only', False))
+
+    @classmethod
+    def from_yaml(cls, config_path=default_config_path):
+        with open(config_path, "r", encoding="utf-8") as f:
+            return cls(yaml.safe_load(f) or {})
+
+    def training_arguments(self):
+        """TrainingArguments overrides for this recipe."""
+        # bf16 only where the hardware supports it, so the same recipe runs on CPU
+        use_bf16 = self.dtype == 'bf16' and torch.cuda.is_available() and torch.cuda.is_bf16_supported()
+        return {
+            'learning_rate': self.learning_rate,
+            'weight_decay': self.weight_decay,
+            'warmup_steps': self.warmup_steps,
+            'lr_scheduler_type': 'cosine',
+            'num_train_epochs': self.epochs,
+            'gradient_accumulation_steps': self.gradient_accumulation_steps,
+            'gradient_checkpointing': self.activation_checkpointing,
+            'bf16': use_bf16,
+        }
+
+    def apply(self, model):
+        """Wraps model with LoRA adapters so only adapter weights train."""
+        # Only keep target modules the architecture actually has
+        module_names = {name.split('.')[-1] for name, _ in model.named_modules()}
+        target_modules = [module for module in self.target_modules if module in module_names]
+        if not target_modules:
+            raise ValueError(f"None of the LoRA target modules {self.target_modules} exist in the model")
+
+        if self.activation_checkpointing:
+            # Frozen embeddings would otherwise cut the graph through checkpointed blocks
+            model.enable_input_require_grads()
+
+        lora_config = LoraConfig(
+            r=self.rank,
+            lora_alpha=self.alpha,
+            lora_dropout=self.dropout,
+            target_modules=target_modules,
+            task_type="CAUSAL_LM",
+        )
+        model = get_peft_model(model, lora_config)
+        trainable, total = model.get_nb_trainable_parameters()
+        logger.info(f"LoRA on {target_modules}: {trainable} of {total} parameters trainable")
+        return model
+
+    def remove(self, model):
+        """Strips the adapters from a model wrapped by apply() and returns the untouched base model."""
+        base_model = model.unload()
+        # unload() leaves the adapter config behind, a later full fine-tune must not see it
+        if hasattr(base_model, "peft_config"):
+            del base_model.peft_config
+        # The Trainer turned checkpointing on for the recipe, the next job may not want it
+        if self.activation_checkpointing:
+            base_model.disable_input_require_grads()
+            base_model.gradient_checkpointing_disable()
+        return base_model
+
+    def merged_state_dict(self, model):
+        """Base weights with the adapter deltas added, leaving the wrapped model unchanged."""
+        base_model = model.get_base_model()
+        deltas = {}
+        with torch.no_grad():
+            for name, module in base_model.named_modules():
+                if isinstance(module, LoraLayer):
+                    key = f"{name}.weight"
+                    for adapter in module.active_adapters:
+                        delta = module.get_delta_weight(adapter)
+                        deltas[key] = deltas[key] + delta if key in deltas else delta
+            state_dict = {}
+            for key, value in base_model.state_dict().items():
+                if ".lora_" in key:
+                    continue
+                key = key.replace(".base_layer.", ".")
+                if key in deltas:
+                    value = value + deltas[key].to(value.dtype)
+                state_dict[key] = value
+        return state_dict
+
+    def export(self, model, tokenizer, output_model_path, keep_base_model=False):
+        """Saves the adapter, and unless adapter-only, the merged full model for export.
+
+        With keep_base_model the merge is computed out of place, so the base weights
+        can be reused for the next adapter.
+        """
+        adapter_path = os.path.join(output_model_path, "adapter")
+        model.save_pretrained(adapter_path)
+        logger.info(f"Adapter saved to {adapter_path}")
+        if not self.save_adapter_weights_only:
+            if keep_base_model:
+                model.get_base_model().save_pretrained(output_model_path, state_dict=self.merged_state_dict(model),
+                                                       safe_serialization=True)
+            else:
+                merged = model.merge_and_unload()
+                merged.save_pretrained(output_model_path, safe_serialization=True)
+            logger.info(f"Merged model saved to {output_model_path}")
+        tokenizer.save_pretrained(output_model_path)
@@ -0,0 +1,153 @@
+import json
+import logging
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from com.mhire.fine_tuning.streaming_dataset import tokenize_records
+
+logger = logging.getLogger(__name__)
+
+default_chunk_size = 16 * 1024 * 1024
+
+# Tokenizer and settings installed once per worker process
+_worker_tokenizer = None
+_worker_padding = None
+_worker_batch_size = None
+
+
+# Function to split a jsonl file into byte ranges that end on line boundaries
+def split_jsonl(file_path, chunk_size=default_chunk_size):
+    file_size = os.path.getsize(file_path)
+    chunks = []
+    with open(file_path, "rb") as f:
+        start = 0
+        while start < file_size:
+            f.seek(min(start + chunk_size, file_size))
+            f.readline()
+            end = min(f.tell(), file_size)
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+
+# Function to read the records of one byte range
+def read_jsonl_range(file_path, start, end):
+    records = []
+    with open(file_path, "rb") as f:
+        f.seek(start)
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            if line.strip():
+                records.append(json.loads(line.decode("utf-8")))
+    return records
+
+
+def _init_worker(tokenizer, padding, batch_size):
+    global _worker_tokenizer, _worker_padding, _worker_batch_size
+    # Each process is already one of many, so keep the Rust tokenizer single-threaded
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    _worker_tokenizer = tokenizer
+    _worker_padding = padding
+    _worker_batch_size = batch_size
+
+
+def _tokenize_chunk(file_path, start, end):
+    records = read_jsonl_range(file_path, start, end)
+    tokenized = []
+    for i in range(0, len(records), _worker_batch_size):
+        tokenized.extend(tokenize_records(_worker_tokenizer, records[i:i + _worker_batch_size], padding=_worker_padding))
+    return tokenized
+
+
+class ParallelTokenizer:
+    """Tokenizes a jsonl file chunk by chunk in a process pool, preserving record order.
+
+    Call start() on the thread that sets up training, before the model loads: the workers
+    are forked then, and later calls from any thread, like a background cache build, reuse
+    them. Forking once torch, CUDA or the Rust tokenizer run threads can deadlock the children.
+    """
+
+    def __init__(self, tokenizer, num_proc=None, chunk_size=default_chunk_size, batch_size=1000, padding="max_length"):
+        self.tokenizer = tokenizer
+        self.num_proc = num_proc or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.padding = padding
+        self.executor = None
+
+    def _new_executor(self):
+        # Forked workers inherit the loaded modules, spawned ones would re-import com.mhire
+        # from /llm-utility, which clear_storage() has already wiped by the time we get here
+        start_method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+        return ProcessPoolExecutor(
+            max_workers=self.num_proc,
+            mp_context=multiprocessing.get_context(start_method),
+            initializer=_init_worker,
+            initargs=(self.tokenizer, self.padding, self.batch_size),
+        )
+
+    def start(self):
+        """Creates the worker processes now, so they are not forked from a busy process later."""
+        if self.executor is None and self.num_proc > 1:
+            self.executor = self._new_executor()
+            # A fork pool launches every worker on its first task
+            self.executor.submit(os.getpid).result()
+        return self
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def iter_tokenized(self, jsonl_file_path):
+        """Yields tokenized examples in file order while keeping only a few chunks in flight."""
+        chunks = split_jsonl(jsonl_file_path, self.chunk_size)
+        logger.info(f"Tokenizing {jsonl_file_path} in {len(chunks)} chunks with {self.num_proc} workers")
+
+        # Fall back to the serial path when there is nothing to parallelize
+        if self.executor is None and (self.num_proc <= 1 or len(chunks) <= 1):
+            for start, end in chunks:
+                records = read_jsonl_range(jsonl_file_path, start, end)
+                for i in range(0, len(records), self.batch_size):
+                    yield from tokenize_records(self.tokenizer, records[i:i + self.batch_size], padding=self.padding)
+            return
+
+        if self.executor is not None:
+            yield from self._iter_pool(self.executor, jsonl_file_path, chunks)
+            return
+        with self._new_executor() as executor:
+            yield from self._iter_pool(executor, jsonl_file_path, chunks)
+
+    def _iter_pool(self, executor, jsonl_file_path, chunks):
+        max_pending = self.num_proc * 2
+        pending = deque()
+        chunk_iter = iter(chunks)
+        for start, end in chunk_iter:
+            pending.append(executor.submit(_tokenize_chunk, jsonl_file_path, start, end))
+            if len(pending) >= max_pending:
+                break
+        try:
+            while pending:
+                # Results are consumed in submission order, so output matches the serial path
+                result = pending.popleft().result()
+                for start, end in chunk_iter:
+                    pending.append(executor.submit(_tokenize_chunk, jsonl_file_path, start, end))
+                    break
+                yield from result
+        finally:
+            # A consumer that stops early, like a cancelled cache build, leaves a shared pool idle
+            for future in pending:
+                future.cancel()
+
+    def tokenize(self, jsonl_file_path):
+        return list(self.iter_tokenized(jsonl_file_path))
@@ -1,31 +1,107 @@
-from transformers import AutoModelForCausalLM, AutoTokenizer
-from optimum.gptq import GPTQQuantizer, load_quantized_model
-import torch
-from accelerate import init_empty_weights
-
-def quantize():
-    # Load model and tokenizer
-    model_name = f"/llm/fine_tuned_model_files"
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
-    model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch.float16)
-
-    # Initialize the GPTQ quantizer
-    quantizer = GPTQQuantizer(
-        bits=4,
-        dataset="c4",
-        block_name_to_quantize="model.decoder.layers",
-        model_seqlen=2048
-    )
-
-    # Quantize the model
-    quantized_model = quantizer.quantize_model(model, tokenizer)
-
-    # Save the quantized model
-    save_folder = "/llm/model_file.gguf"
-    quantizer.save(model, save_folder)
-
-    # Load the quantized model
-    with init_empty_weights():
-        empty_model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch.float16)
-    empty_model.tie_weights()
-    quantized_model = load_quantized_model(empty_model, save_folder=save_folder, device_map="auto")
+import json
+import os
+import subprocess
+import sys
+
+from com.mhire.utility.util import log, log_error
+
+# llama.cpp checkout with llama-quantize and llama-imatrix built under build/bin
+llama_cpp_dir = os.environ.get("LLAMA_CPP_DIR", "/opt/llama.cpp")
+quantization_levels = ("Q4_K_M", "Q5_K_M", "Q8_0")
+default_quantization_level = "Q4_K_M"
+
+
+# Function to run a llama.cpp tool, streaming its output into the job log
+def run_tool(command):
+    log(f"Running: {' '.join(command)}")
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    for line in process.stdout:
+        line = line.rstrip()
+        if line:
+            log(line)
+    if process.wait() != 0:
+        raise RuntimeError(f"{os.path.basename(command[0])} exited with code {process.returncode}")
+
+
+# Function to key a prompt/completion record by its text, ignoring how the json was formatted
+def record_text(record):
+    return record.get('prompt', ''), record.get('completion', '')
+
+
+# Function to read the record texts of a jsonl file
+def read_record_texts(jsonl_file_path):
+    with open(jsonl_file_path, "r", encoding="utf-8") as f:
+        return {record_text(json.loads(line)) for line in f if line.strip()}
+
+
+# Function to write calibration text from the local training jsonl, skipping any
+# held-out evaluation records so perplexity is never measured on calibration data
+def write_calibration_text(jsonl_file_path, output_path, max_records=512, exclude_jsonl=None):
+    excluded = read_record_texts(exclude_jsonl) if exclude_jsonl else set()
+    count = 0
+    with open(jsonl_file_path, "r", encoding="utf-8") as src, open(output_path, "w", encoding="utf-8") as dst:
+        for line in src:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record_text(record) in excluded:
+                continue
+            dst.write(f"{record.get('prompt', '')}\n{record.get('completion', '')}\n\n")
+            count += 1
+            if count >= max_records:
+                break
+    return count
+
+
+def quantize(model_dir, output_path, level=default_quantization_level, calibration_jsonl=None, keep_intermediate=False,
+             reuse_intermediate=False, heldout_jsonl=None):
+    """Converts a Hugging Face model dir to a GGUF file at the given quantization level.
+
+    convert_hf_to_gguf.py reads safetensors lazily and llama-quantize works one tensor
+    at a time, so peak memory stays near one layer rather than the whole fp16 model.
+    Records in heldout_jsonl are left out of the imatrix calibration text.
+    """
+    if level not in quantization_levels:
+        raise ValueError(f"Unsupported quantization level {level}, expected one of {quantization_levels}")
+
+    work_dir = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(work_dir, exist_ok=True)
+    convert_script = os.path.join(llama_cpp_dir, "convert_hf_to_gguf.py")
+    bin_dir = os.path.join(llama_cpp_dir, "build", "bin")
+
+    try:
+        # Q8_0 is written directly by the converter, no second pass needed
+        if level == "Q8_0":
+            run_tool([sys.executable, convert_script, model_dir, "--outfile", output_path, "--outtype", "q8_0"])
+            log(f"Quantized model saved to {output_path}")
+            return output_path
+
+        f16_path = os.path.join(work_dir, "model_f16.gguf")
+        # Several levels from one model can share a single fp16 conversion
+        if not (reuse_intermediate and os.path.exists(f16_path)):
+            run_tool([sys.executable, convert_script, model_dir, "--outfile", f16_path, "--outtype", "f16"])
+
+        # Calibrate K-quants with an importance matrix computed on our own training data
+        quantize_command = [os.path.join(bin_dir, "llama-quantize")]
+        imatrix_path, calibration_path = None, None
+        if calibration_jsonl:
+            calibration_path = os.path.join(work_dir, "calibration.txt")
+            imatrix_path = os.path.join(work_dir, "imatrix.dat")
+            if reuse_intermediate and os.path.exists(imatrix_path):
+                quantize_command += ["--imatrix", imatrix_path]
+            elif write_calibration_text(calibration_jsonl, calibration_path, exclude_jsonl=heldout_jsonl) > 0:
+                run_tool([os.path.join(bin_dir, "llama-imatrix"), "-m", f16_path, "-f", calibration_path,
+                          "-o", imatrix_path])
+                quantize_command += ["--imatrix", imatrix_path]
+
+        run_tool(quantize_command + [f16_path, output_path, level])
+        log(f"Quantized model saved to {output_path}")
+
+        if not keep_intermediate:
+            for path in (f16_path, imatrix_path, calibration_path):
+                if path and os.path.exists(path):
+                    os.remove(path)
+        return output_path
+    except Exception as e:
+        log_error(f"Quantization to {level} failed: {str(e)}")
+        raise
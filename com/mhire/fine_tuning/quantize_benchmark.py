@@ -0,0 +1,166 @@
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from com.mhire.fine_tuning.quantize import llama_cpp_dir, quantization_levels, quantize, write_calibration_text
+from com.mhire.utility.util import log, log_error
+
+bin_dir = os.path.join(llama_cpp_dir, "build", "bin")
+load_time_pattern = re.compile(r"load time\s*=\s*([\d.]+)\s*ms")
+perplexity_pattern = re.compile(r"Final estimate:\s*PPL\s*=\s*([\d.]+)")
+
+
+# Function to run a tool to completion, returning its output, wall time and peak RSS
+def run_measured(command):
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    output = process.stdout.read()
+    # wait4 reports the rusage of this child alone, unlike RUSAGE_CHILDREN
+    _, status, rusage = os.wait4(process.pid, 0)
+    # Same convention as Popen.returncode, a negative code is the signal that killed it
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    elapsed = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError(f"{os.path.basename(command[0])} exited with code {process.returncode}: {output[-2000:]}")
+    # ru_maxrss is in kilobytes on Linux
+    return output, elapsed, rusage.ru_maxrss * 1024
+
+
+# Function to find the JSON array of result objects in tool output that also carries log lines
+def parse_json_array(output):
+    decoder = json.JSONDecoder()
+    start = output.find("[")
+    while start != -1:
+        try:
+            value, _ = decoder.raw_decode(output, start)
+            # Log lines carry bracketed fragments such as "[1]" that also decode as arrays
+            if isinstance(value, list) and value and all(isinstance(item, dict) for item in value):
+                return value
+        except ValueError:
+            pass
+        start = output.find("[", start + 1)
+    raise ValueError("No JSON array found in tool output")
+
+
+# Function to write held-out evaluation text, the records must not have been trained on
+def write_heldout_text(jsonl_file_path, output_path, num_records=200):
+    return write_calibration_text(jsonl_file_path, output_path, max_records=num_records)
+
+
+def benchmark_model(gguf_path, heldout_path, threads, prompt_tokens=64, gen_tokens=32, context_size=512):
+    """Measures size, load time, CPU throughput, peak RSS and perplexity of one GGUF file."""
+    result = {"path": gguf_path, "size_bytes": os.path.getsize(gguf_path)}
+
+    # -ngl 0 keeps every layer on the CPU, perplexity needs at least two windows of context_size tokens
+    output, _, rss = run_measured([os.path.join(bin_dir, "llama-perplexity"), "-m", gguf_path, "-f", heldout_path,
+                                   "-t", str(threads), "-ngl", "0", "-c", str(context_size)])
+    match = perplexity_pattern.search(output)
+    result["perplexity"] = float(match.group(1)) if match else None
+    match = load_time_pattern.search(output)
+    result["load_time_sec"] = float(match.group(1)) / 1000 if match else None
+    result["peak_rss_bytes"] = rss
+
+    output, _, bench_rss = run_measured([os.path.join(bin_dir, "llama-bench"), "-m", gguf_path, "-p", str(prompt_tokens),
+                                         "-n", str(gen_tokens), "-t", str(threads), "-ngl", "0", "-o", "json"])
+    for entry in parse_json_array(output):
+        if entry.get("n_prompt"):
+            result["prompt_tokens_per_sec"] = entry.get("avg_ts")
+        if entry.get("n_gen"):
+            result["gen_tokens_per_sec"] = entry.get("avg_ts")
+    result["peak_rss_bytes"] = max(rss, bench_rss)
+    return result
+
+
+def run_benchmark(model_dir, dataset_path, eval_dataset_path, output_dir, levels=quantization_levels, heldout_records=200,
+                  threads=None, context_size=512):
+    """Quantizes model_dir at every level and benchmarks each against the fp16 baseline.
+
+    dataset_path is the training jsonl the imatrix is calibrated on. Perplexity is measured
+    on eval_dataset_path, records held out from training, which calibration skips as well.
+    """
+    threads = threads or os.cpu_count() or 1
+    os.makedirs(output_dir, exist_ok=True)
+    heldout_path = os.path.join(output_dir, "heldout.txt")
+    write_heldout_text(eval_dataset_path, heldout_path, heldout_records)
+
+    report = {
+        "model_dir": model_dir,
+        "dataset": dataset_path,
+        "eval_dataset": eval_dataset_path,
+        "heldout_records": heldout_records,
+        "threads": threads,
+        "context_size": context_size,
+        "created": datetime.now().isoformat(),
+        "results": {},
+    }
+
+    for level in levels:
+        gguf_path = os.path.join(output_dir, f"model_{level}.gguf")
+        log(f"Benchmarking {level}")
+        start = time.perf_counter()
+        quantize(model_dir, gguf_path, level=level, calibration_jsonl=dataset_path, heldout_jsonl=eval_dataset_path,
+                 keep_intermediate=True, reuse_intermediate=True)
+        result = benchmark_model(gguf_path, heldout_path, threads, context_size=context_size)
+        result["quantize_time_sec"] = round(time.perf_counter() - start, 3)
+        report["results"][level] = result
+
+    # The fp16 conversion left behind by quantize() is the quality baseline
+    f16_path = os.path.join(output_dir, "model_f16.gguf")
+    if os.path.exists(f16_path):
+        report["results"]["F16"] = benchmark_model(f16_path, heldout_path, threads, context_size=context_size)
+    return report
+
+
+def compare_reports(report, baseline, max_perplexity_increase=0.02, max_speed_drop=0.10):
+    """Lists regressions of report against a baseline report, per level."""
+    regressions = []
+    for level, result in report["results"].items():
+        previous = baseline.get("results", {}).get(level)
+        if not previous:
+            continue
+        if result.get("perplexity") and previous.get("perplexity"):
+            if result["perplexity"] > previous["perplexity"] * (1 + max_perplexity_increase):
+                regressions.append(f"{level}: perplexity {previous['perplexity']} -> {result['perplexity']}")
+        for key in ("prompt_tokens_per_sec", "gen_tokens_per_sec"):
+            if result.get(key) and previous.get(key) and result[key] < previous[key] * (1 - max_speed_drop):
+                regressions.append(f"{level}: {key} {previous[key]} -> {result[key]}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark GGUF quantization levels on CPU")
+    parser.add_argument("--model-dir", required=True)
+    parser.add_argument("--dataset", required=True, help="training prompt/completion jsonl, used for calibration")
+    parser.add_argument("--eval-dataset", required=True, help="prompt/completion jsonl held out from training")
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--report", default=None, help="defaults to <output-dir>/quantization_report.json")
+    parser.add_argument("--levels", nargs="+", default=list(quantization_levels), choices=quantization_levels)
+    parser.add_argument("--heldout-records", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--context-size", type=int, default=512, help="perplexity window in tokens")
+    parser.add_argument("--baseline", default=None, help="previous report to check for regressions")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.model_dir, args.dataset, args.eval_dataset, args.output_dir, args.levels,
+                           args.heldout_records, args.threads, args.context_size)
+    report_path = args.report or os.path.join(args.output_dir, "quantization_report.json")
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    log(f"Quantization report written to {report_path}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare_reports(report, json.load(f))
+        for regression in regressions:
+            log_error(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
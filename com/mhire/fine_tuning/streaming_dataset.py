@@ -0,0 +1,81 @@
+import json
+import math
+
+from torch.utils.data import IterableDataset, get_worker_info
+
+
+# Function to lazily read a jsonl file one record at a time, parsing only every
+# num_shards-th record starting at shard so each reader only pays for its own share
+def iter_jsonl(file_path, shard=0, num_shards=1):
+    with open(file_path, "r", encoding="utf-8") as f:
+        index = 0
+        for line in f:
+            if not line.strip():
+                continue
+            if index % num_shards == shard:
+                yield json.loads(line)
+            index += 1
+
+
+# Function to count records in a jsonl file without parsing them
+def count_jsonl_records(file_path):
+    count = 0
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                count += 1
+    return count
+
+
+# Function to tokenize a batch of prompt/completion records in one tokenizer call
+def tokenize_records(tokenizer, records, padding="max_length"):
+    """Tokenizes records exactly like the per-record path, but batched."""
+    if not records:
+        return []
+    # Tokenize the input text (prompt)
+    inputs = tokenizer([record['prompt'] for record in records], padding=padding, truncation=True)
+    # Tokenize the label (completion)
+    labels = tokenizer([record['completion'] for record in records], padding=padding, truncation=True)
+
+    tokenized = []
+    for i in range(len(records)):
+        example = {key: values[i] for key, values in inputs.items()}
+        # Use input_ids as labels
+        example['labels'] = list(labels['input_ids'][i])
+        tokenized.append(example)
+    return tokenized
+
+
+class StreamingJsonlDataset(IterableDataset):
+    """Lazily reads and tokenizes a jsonl file, sharded across dataloader workers."""
+
+    def __init__(self, tokenizer, jsonl_file_path, batch_size=1000, padding="max_length"):
+        self.tokenizer = tokenizer
+        self.jsonl_file_path = jsonl_file_path
+        self.batch_size = batch_size
+        self.padding = padding
+        self._num_records = None
+
+    # No __len__: with sharded workers it need not match what is yielded, the Trainer gets max_steps instead
+    def num_records(self):
+        if self._num_records is None:
+            self._num_records = count_jsonl_records(self.jsonl_file_path)
+        return self._num_records
+
+    # Number of optimizer steps needed to consume the file once
+    def num_steps(self, per_device_batch_size, num_epochs=1):
+        return max(1, math.ceil(self.num_records() / per_device_batch_size) * num_epochs)
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        worker_id = worker_info.id if worker_info else 0
+        num_workers = worker_info.num_workers if worker_info else 1
+
+        batch = []
+        # Each worker only parses and keeps every num_workers-th record
+        for record in iter_jsonl(self.jsonl_file_path, worker_id, num_workers):
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                yield from tokenize_records(self.tokenizer, batch, padding=self.padding)
+                batch = []
+        yield from tokenize_records(self.tokenizer, batch, padding=self.padding)
@@ -0,0 +1,292 @@
+import json
+import logging
+import os
+import resource
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import torch
+import yaml
+from transformers import TrainerCallback
+
+from com.mhire.fine_tuning.lora import default_config_path
+from com.mhire.utility.cache_util import cache_root
+
+logger = logging.getLogger(__name__)
+
+default_telemetry_root = os.path.join(cache_root, "telemetry")
+default_metrics_port = 9400
+metric_prefix = "llm_train"
+# Shares of step time above which a run is reported as input- or memory-bound
+input_bound_ratio = 0.2
+memory_bound_ratio = 0.9
+
+
+# Function to get the resident set size of this process in bytes
+def current_rss():
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+# Function to get the peak resident set size of this process in bytes (ru_maxrss is in KB on Linux)
+def peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class ProfilerConfig:
+    """torch.profiler settings read from the profiler section of config.yaml."""
+
+    def __init__(self, config):
+        profiler_config = config.get('profiler', {}) or {}
+        self.enabled = bool(profiler_config.get('enabled', False))
+        self.output_dir = profiler_config.get('output_dir')
+        self.cpu = bool(profiler_config.get('cpu', True))
+        self.cuda = bool(profiler_config.get('cuda', True))
+        self.profile_memory = bool(profiler_config.get('profile_memory', False))
+        self.with_stack = bool(profiler_config.get('with_stack', False))
+        self.record_shapes = bool(profiler_config.get('record_shapes', True))
+        self.with_flops = bool(profiler_config.get('with_flops', False))
+        self.wait_steps = int(profiler_config.get('wait_steps', 5))
+        self.warmup_steps = int(profiler_config.get('warmup_steps', 5))
+        self.active_steps = int(profiler_config.get('active_steps', 2))
+        self.num_cycles = int(profiler_config.get('num_cycles', 1))
+
+    @classmethod
+    def from_yaml(cls, config_path=default_config_path):
+        with open(config_path, "r", encoding="utf-8") as f:
+            return cls(yaml.safe_load(f) or {})
+
+    def trace_dir(self, telemetry_dir):
+        # ${output_dir} points at the torchtune output dir, traces go next to our own metrics
+        output_dir = self.output_dir or "${output_dir}/profiling_outputs"
+        return output_dir.replace("${output_dir}", telemetry_dir)
+
+    def create(self, telemetry_dir):
+        """Builds a torch profiler over the configured step window, or None when disabled."""
+        if not self.enabled:
+            return None
+        activities = []
+        if self.cpu:
+            activities.append(torch.profiler.ProfilerActivity.CPU)
+        if self.cuda and torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        trace_dir = self.trace_dir(telemetry_dir)
+        logger.info(f"Profiling steps {self.wait_steps + self.warmup_steps + 1} to "
+                    f"{self.wait_steps + self.warmup_steps + self.active_steps}, traces in {trace_dir}")
+        return torch.profiler.profile(
+            activities=activities,
+            schedule=torch.profiler.schedule(wait=self.wait_steps, warmup=self.warmup_steps,
+                                             active=self.active_steps, repeat=self.num_cycles),
+            on_trace_ready=torch.profiler.tensorboard_trace_handler(trace_dir),
+            profile_memory=self.profile_memory,
+            with_stack=self.with_stack,
+            record_shapes=self.record_shapes,
+            with_flops=self.with_flops,
+        )
+
+
+class TrainingTelemetry(TrainerCallback):
+    """Per-step timing, throughput and memory of a Trainer run.
+
+    Data wait is the time between micro-batches, where the loop fetches and collates
+    input, the rest of the step counts as compute. Every optimizer step is appended to
+    metrics.jsonl in telemetry_dir, and the running totals are served in Prometheus text
+    format on metrics_port.
+    """
+
+    def __init__(self, telemetry_dir, profiler_config=None, metrics_port=None):
+        self.telemetry_dir = telemetry_dir
+        self.profiler_config = profiler_config
+        self.metrics_port = metrics_port
+        self.profiler = None
+        self.server = None
+        self.metrics_file = None
+        self.lock = threading.Lock()
+        self.totals = {"steps": 0, "tokens": 0, "step_seconds": 0.0, "data_wait_seconds": 0.0, "compute_seconds": 0.0}
+        self.last = {}
+        self.device_peak = 0
+        self.device_total = torch.cuda.get_device_properties(0).total_memory if torch.cuda.is_available() else 0
+        self._reset_step(time.perf_counter())
+
+    def _reset_step(self, now):
+        self.step_start = now
+        self.mark = now
+        self.step_tokens = 0
+        self.step_data_wait = 0.0
+
+    # Called by the trainer around each micro-batch
+    def micro_step_begin(self, num_tokens):
+        now = time.perf_counter()
+        self.step_data_wait += now - self.mark
+        self.step_tokens += num_tokens
+
+    def micro_step_end(self):
+        self.mark = time.perf_counter()
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        os.makedirs(self.telemetry_dir, exist_ok=True)
+        self.metrics_file = open(os.path.join(self.telemetry_dir, "metrics.jsonl"), "a", encoding="utf-8")
+        if self.metrics_port and self.server is None:
+            try:
+                self.server = MetricsServer(self, self.metrics_port)
+                self.server.start()
+            except OSError as e:
+                # Metrics are still written to metrics.jsonl
+                logger.warning(f"Could not serve metrics on port {self.metrics_port}: {e}")
+        if self.profiler_config:
+            self.profiler = self.profiler_config.create(self.telemetry_dir)
+            if self.profiler:
+                self.profiler.start()
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+        self._reset_step(time.perf_counter())
+
+    def on_step_end(self, args, state, control, **kwargs):
+        now = time.perf_counter()
+        wall = now - self.step_start
+        metrics = {
+            "step": state.global_step,
+            "time": time.time(),
+            "step_seconds": round(wall, 6),
+            "data_wait_seconds": round(self.step_data_wait, 6),
+            "compute_seconds": round(max(wall - self.step_data_wait, 0.0), 6),
+            "tokens": self.step_tokens,
+            "tokens_per_sec": round(self.step_tokens / wall, 2) if wall > 0 else 0.0,
+            "host_rss_bytes": current_rss(),
+            "host_peak_rss_bytes": peak_rss(),
+        }
+        if torch.cuda.is_available():
+            # Peak of this step alone, the run-wide peak is kept separately
+            metrics["device_peak_allocated_bytes"] = torch.cuda.max_memory_allocated()
+            metrics["device_peak_reserved_bytes"] = torch.cuda.max_memory_reserved()
+            torch.cuda.reset_peak_memory_stats()
+        with self.lock:
+            self.totals["steps"] += 1
+            self.totals["tokens"] += self.step_tokens
+            self.totals["step_seconds"] += wall
+            self.totals["data_wait_seconds"] += self.step_data_wait
+            self.totals["compute_seconds"] += metrics["compute_seconds"]
+            self.device_peak = max(self.device_peak, metrics.get("device_peak_reserved_bytes", 0))
+            self.last = metrics
+        if self.metrics_file:
+            self.metrics_file.write(json.dumps(metrics) + "\n")
+        if self.profiler:
+            self.profiler.step()
+        self._reset_step(time.perf_counter())
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        # Logging syncs the device for the loss, which is not input time
+        self.mark = time.perf_counter()
+        if self.metrics_file:
+            self.metrics_file.flush()
+
+    def on_save(self, args, state, control, **kwargs):
+        self.mark = time.perf_counter()
+
+    def on_train_end(self, args, state, control, **kwargs):
+        self.close()
+
+    def close(self):
+        """Stops the profiler and metrics server and writes the summary.
+
+        The Trainer skips on_train_end when training raises, so callers also call
+        this from a finally block; a second call does nothing.
+        """
+        if self.profiler:
+            self.profiler.stop()
+            self.profiler = None
+        if self.metrics_file:
+            self.metrics_file.close()
+            self.metrics_file = None
+            self.log_summary()
+        if self.server:
+            self.server.stop()
+            self.server = None
+
+    def summary(self):
+        with self.lock:
+            totals = dict(self.totals)
+            device_peak = self.device_peak
+        step_seconds = totals["step_seconds"]
+        return {
+            **totals,
+            "tokens_per_sec": round(totals["tokens"] / step_seconds, 2) if step_seconds else 0.0,
+            "data_wait_ratio": round(totals["data_wait_seconds"] / step_seconds, 4) if step_seconds else 0.0,
+            "host_peak_rss_bytes": peak_rss(),
+            "device_peak_reserved_bytes": device_peak,
+            "device_memory_ratio": round(device_peak / self.device_total, 4) if self.device_total else 0.0,
+        }
+
+    def log_summary(self):
+        summary = self.summary()
+        with open(os.path.join(self.telemetry_dir, "summary.json"), "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        logger.info(f"Training telemetry: {summary['steps']} steps, {summary['tokens_per_sec']} tokens/sec, "
+                    f"{summary['data_wait_ratio']:.1%} of step time waiting for data, "
+                    f"host peak {summary['host_peak_rss_bytes'] / 2**30:.1f} GiB, "
+                    f"device peak {summary['device_peak_reserved_bytes'] / 2**30:.1f} GiB")
+        if summary["data_wait_ratio"] > input_bound_ratio:
+            logger.warning("Run looks input-bound: raise num_proc or dataloader workers, or enable the tokenization cache")
+        if summary["device_memory_ratio"] > memory_bound_ratio:
+            logger.warning("Run looks memory-bound: lower max_batch_tokens or enable activation checkpointing")
+
+    def prometheus_text(self):
+        """Current metrics in the Prometheus text exposition format."""
+        summary = self.summary()
+        with self.lock:
+            last = dict(self.last)
+        samples = [
+            ("steps_total", "counter", "Optimizer steps finished", summary["steps"]),
+            ("tokens_total", "counter", "Non-padding tokens trained on", summary["tokens"]),
+            ("step_seconds_total", "counter", "Wall time spent in optimizer steps", summary["step_seconds"]),
+            ("data_wait_seconds_total", "counter", "Step time spent waiting for input batches", summary["data_wait_seconds"]),
+            ("compute_seconds_total", "counter", "Step time spent in forward, backward and optimizer", summary["compute_seconds"]),
+            ("last_step_seconds", "gauge", "Wall time of the last optimizer step", last.get("step_seconds", 0)),
+            ("tokens_per_second", "gauge", "Token throughput of the last optimizer step", last.get("tokens_per_sec", 0)),
+            ("host_rss_bytes", "gauge", "Resident memory of the training process", current_rss()),
+            ("host_peak_rss_bytes", "gauge", "Peak resident memory of the training process", summary["host_peak_rss_bytes"]),
+            ("device_peak_reserved_bytes", "gauge", "Peak device memory reserved by the allocator", summary["device_peak_reserved_bytes"]),
+        ]
+        lines = []
+        for name, metric_type, help_text, value in samples:
+            lines.append(f"# HELP {metric_prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {metric_prefix}_{name} {metric_type}")
+            lines.append(f"{metric_prefix}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Serves a TrainingTelemetry as Prometheus text on /metrics from a daemon thread."""
+
+    def __init__(self, telemetry, port=default_metrics_port, host="0.0.0.0"):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = telemetry.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Scrapes would otherwise flood the job log
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="metrics-server", daemon=True)
+        self.thread.start()
+        logger.info(f"Serving training metrics on port {self.httpd.server_address[1]}")
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
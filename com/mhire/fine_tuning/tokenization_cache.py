@@ -0,0 +1,214 @@
+import copy
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import traceback
+
+import numpy as np
+from torch.utils.data import Dataset
+
+from com.mhire.fine_tuning.parallel_tokenizer import ParallelTokenizer, default_chunk_size
+from com.mhire.utility.cache_util import cache_root, evict_lru, publish_dir, remove_stale_staging, touch
+
+logger = logging.getLogger(__name__)
+
+default_cache_dir = os.path.join(cache_root, "tokenized")
+default_cache_size_bytes = 50 * 1024 ** 3
+
+
+# Function to hash a file without reading it into memory
+def hash_file(file_path, digest=None, chunk_size=8 * 1024 * 1024):
+    digest = digest or hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest
+
+
+# Function to hash the tokenizer by the files it serializes to
+def hash_tokenizer(tokenizer):
+    digest = hashlib.sha256()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tokenizer.save_pretrained(tmp_dir)
+        for name in sorted(os.listdir(tmp_dir)):
+            digest.update(name.encode("utf-8"))
+            if name == "tokenizer.json":
+                # A fast tokenizer records the truncation and padding of its last call here,
+                # which would give the same tokenizer a new key once it has been used
+                with open(os.path.join(tmp_dir, name), "r", encoding="utf-8") as f:
+                    serialized = json.load(f)
+                serialized["truncation"], serialized["padding"] = None, None
+                digest.update(json.dumps(serialized, sort_keys=True).encode("utf-8"))
+            else:
+                hash_file(os.path.join(tmp_dir, name), digest)
+    return digest.hexdigest()
+
+
+class CachedTokenizedDataset(Dataset):
+    """Map-style dataset over memory-mapped int32 token shards."""
+
+    def __init__(self, entry_dir):
+        with open(os.path.join(entry_dir, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.fields = {}
+        for field in self.meta["fields"]:
+            offsets = np.load(os.path.join(entry_dir, f"{field}.offsets.npy"), mmap_mode="r")
+            data_path = os.path.join(entry_dir, f"{field}.bin")
+            if os.path.getsize(data_path) > 0:
+                data = np.memmap(data_path, dtype=np.int32, mode="r")
+            else:
+                data = np.empty(0, dtype=np.int32)
+            self.fields[field] = (data, offsets)
+
+    def __len__(self):
+        return self.meta["num_records"]
+
+    # Per-example lengths read straight from the offsets index
+    def lengths(self):
+        lengths = None
+        for data, offsets in self.fields.values():
+            field_lengths = np.diff(offsets)
+            lengths = field_lengths if lengths is None else np.maximum(lengths, field_lengths)
+        return [] if lengths is None else lengths.tolist()
+
+    def __getitem__(self, index):
+        # Only the requested row is paged in; widen to int64 as torch losses expect
+        return {
+            field: data[offsets[index]:offsets[index + 1]].astype(np.int64)
+            for field, (data, offsets) in self.fields.items()
+        }
+
+
+class BuildCancelled(Exception):
+    """A background cache build was stopped before it finished."""
+
+
+class TokenizationCache:
+    def __init__(self, cache_dir=default_cache_dir, max_size_bytes=default_cache_size_bytes):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.background_build = None
+        self.cancel_event = threading.Event()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for name in remove_stale_staging(self.cache_dir):
+            logger.info(f"Removed orphaned tokenization cache staging dir {name}")
+
+    # Cache key covers the dataset content, the tokenizer files and the padding mode
+    def cache_key(self, tokenizer, jsonl_file_path, padding="max_length"):
+        digest = hash_file(jsonl_file_path)
+        digest.update(hash_tokenizer(tokenizer).encode("utf-8"))
+        digest.update(str(padding).encode("utf-8"))
+        return digest.hexdigest()
+
+    def load(self, key):
+        """Returns the cached dataset for key, or None on a miss."""
+        entry_dir = os.path.join(self.cache_dir, key)
+        if not os.path.isfile(os.path.join(entry_dir, "meta.json")):
+            return None
+        touch(entry_dir)
+        logger.info(f"Tokenization cache hit: {entry_dir}")
+        return CachedTokenizedDataset(entry_dir)
+
+    def build(self, key, tokenizer, jsonl_file_path, batch_size=1000, padding="max_length",
+              num_proc=1, chunk_size=default_chunk_size, parallel_tokenizer=None):
+        """Tokenizes the jsonl file in batches straight into on-disk shards.
+
+        A started parallel_tokenizer is used as is, so its workers were forked by the caller.
+        """
+        entry_dir = os.path.join(self.cache_dir, key)
+        tmp_dir = tempfile.mkdtemp(prefix=f".{key}.", dir=self.cache_dir)
+        logger.info(f"Tokenization cache miss, building {entry_dir}")
+        files, offsets = {}, {}
+        try:
+            num_records = 0
+
+            parallel_tokenizer = parallel_tokenizer or ParallelTokenizer(
+                tokenizer, num_proc=num_proc, chunk_size=chunk_size, batch_size=batch_size, padding=padding)
+            for example in parallel_tokenizer.iter_tokenized(jsonl_file_path):
+                if self.cancel_event.is_set():
+                    raise BuildCancelled(f"Building tokenization cache entry {key} was cancelled")
+                num_records += 1
+                for field, values in example.items():
+                    if field not in files:
+                        files[field] = open(os.path.join(tmp_dir, f"{field}.bin"), "wb")
+                        offsets[field] = [0]
+                    values = np.asarray(values, dtype=np.int32)
+                    values.tofile(files[field])
+                    offsets[field].append(offsets[field][-1] + len(values))
+
+            for field, f in files.items():
+                f.close()
+                np.save(os.path.join(tmp_dir, f"{field}.offsets.npy"), np.asarray(offsets[field], dtype=np.int64))
+
+            meta = {
+                "num_records": num_records,
+                "fields": sorted(files),
+                "source": os.path.abspath(jsonl_file_path),
+                "created": time.time(),
+            }
+            with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+
+            # Publish atomically so a crashed build never looks like a hit
+            publish_dir(tmp_dir, entry_dir)
+        except Exception:
+            for f in files.values():
+                f.close()
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        self.evict(keep=key)
+        return CachedTokenizedDataset(entry_dir)
+
+    def build_in_background(self, key, tokenizer, jsonl_file_path, **kwargs):
+        """Builds the entry on a daemon thread, e.g. while training streams the same file.
+
+        The entry is only published once complete, so a run that ends first leaves no
+        partial entry behind and the next run simply builds it again. Call
+        finish_background_build() at shutdown; a process that dies instead leaves a
+        staging dir that remove_stale_staging() reclaims later.
+        """
+        # Fast tokenizers are not safe to call from two threads, the training loop keeps the original
+        tokenizer = copy.deepcopy(tokenizer)
+
+        def run():
+            try:
+                self.build(key, tokenizer, jsonl_file_path, **kwargs)
+            except BuildCancelled as e:
+                logger.info(str(e))
+            except Exception:
+                logger.warning(f"Building tokenization cache entry {key} failed: {traceback.format_exc()}")
+
+        self.cancel_event.clear()
+        self.background_build = threading.Thread(target=run, name="tokenization-cache-build", daemon=True)
+        self.background_build.start()
+        return self.background_build
+
+    def finish_background_build(self, cancel=False):
+        """Waits for the background build to publish its entry, or cancels it and removes its staging dir."""
+        if self.background_build is None:
+            return
+        if cancel:
+            self.cancel_event.set()
+        elif self.background_build.is_alive():
+            logger.info("Waiting for the tokenization cache build to finish")
+        self.background_build.join()
+        self.background_build = None
+
+    def evict(self, keep=None):
+        """Removes least recently used entries until the cache fits its budget."""
+        for name, size in evict_lru(self.cache_dir, self.max_size_bytes, keep=(keep,)):
+            logger.info(f"Evicting tokenization cache entry {name} ({size} bytes)")
+
+    def get_or_build(self, tokenizer, jsonl_file_path, padding="max_length", num_proc=1, chunk_size=default_chunk_size):
+        key = self.cache_key(tokenizer, jsonl_file_path, padding)
+        dataset = self.load(key)
+        if dataset is None:
+            dataset = self.build(key, tokenizer, jsonl_file_path, padding=padding,
+                                 num_proc=num_proc, chunk_size=chunk_size)
+        return dataset
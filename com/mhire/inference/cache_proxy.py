@@ -0,0 +1,402 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+from collections import Counter, OrderedDict
+
+import aiohttp
+from aiohttp import web
+
+from com.mhire.inference.ollama_client import default_base_url
+from com.mhire.utility.ollama_util import parse_modelfile
+
+default_port = 11500
+default_max_bytes = 256 * 1024 ** 2
+default_ttl = 3600
+# Modelfile at the repository root, the template the inference image is built with
+default_modelfile_path = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "Modelfile"))
+metric_prefix = "ollama_proxy"
+hop_by_hop_headers = {"connection", "keep-alive", "transfer-encoding", "content-length", "host", "content-encoding"}
+# Fields that do not change what the model generates
+ignored_key_fields = {"stream", "keep_alive"}
+system_placeholder = re.compile(r"\{\{-?\s*\.System\s*-?\}\}")
+prompt_placeholder = re.compile(r"\{\{-?\s*\.Prompt\s*-?\}\}")
+
+
+# Function to get the cache key of a generate request, independent of field order
+def request_key(body):
+    canonical = {key: value for key, value in body.items() if key not in ignored_key_fields}
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+# Function to tell whether a request always produces the same answer (greedy decoding)
+def is_deterministic(body):
+    options = body.get("options") or {}
+    return options.get("temperature") == 0
+
+
+# Function to fold streamed chunks into the single object Ollama returns for stream=false
+def aggregate_chunks(lines):
+    chunks = [json.loads(line) for line in lines]
+    final = dict(chunks[-1])
+    final["response"] = "".join(chunk.get("response", "") for chunk in chunks)
+    return final
+
+
+class ResponseCache:
+    """LRU cache of complete streamed responses with a TTL and a byte budget."""
+
+    def __init__(self, max_bytes=default_max_bytes, ttl=default_ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.size = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        created, lines, size = entry
+        if time.monotonic() - created > self.ttl:
+            self._remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return lines
+
+    def put(self, key, lines):
+        size = sum(len(line) for line in lines)
+        # One huge answer must not flush the whole cache
+        if size > self.max_bytes // 4:
+            return False
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (time.monotonic(), lines, size)
+        self.size += size
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+        return True
+
+    def _remove(self, key):
+        _, _, size = self.entries.pop(key)
+        self.size -= size
+
+
+class InflightResponse:
+    """Chunks of one upstream response, replayed to every client waiting on it."""
+
+    def __init__(self):
+        self.lines = []
+        self.done = False
+        self.error = None
+        self.status = 200
+        self.changed = asyncio.Condition()
+
+    async def add(self, line):
+        async with self.changed:
+            self.lines.append(line)
+            self.changed.notify_all()
+
+    async def finish(self, error=None, status=200):
+        async with self.changed:
+            self.done = True
+            self.error = error
+            self.status = status
+            self.changed.notify_all()
+
+    async def follow(self):
+        index = 0
+        while True:
+            async with self.changed:
+                await self.changed.wait_for(lambda: len(self.lines) > index or self.done)
+                new_lines = self.lines[index:]
+                done = self.done
+            for line in new_lines:
+                yield line
+            index += len(new_lines)
+            if done and index >= len(self.lines):
+                return
+
+
+class PrefixContextCache:
+    """Ollama token contexts of rendered system-prompt prefixes, one per model and system prompt.
+
+    Requests that share a system prompt are rewritten into raw requests carrying the
+    saved context of the rendered system block, so the long system prompt is not sent
+    and rendered again and every request starts with the same prefix for the runner's
+    prompt cache. Ollama ignores context in raw mode on some versions, so support is
+    probed once and the rewrite turns itself off when the context is not honoured.
+    """
+
+    def __init__(self, template, default_system=None, max_entries=256):
+        self.default_system = default_system
+        self.max_entries = max_entries
+        self.contexts = OrderedDict()
+        self.locks = {}
+        # The probe runs once for all keys, requests of other prompts wait for its answer
+        self.probe_lock = asyncio.Lock()
+        self.supported = None
+        self.prefix_template, self.suffix_template = None, None
+        # Only plain templates can be split, anything with conditionals is left to Ollama
+        if template and len(prompt_placeholder.findall(template)) == 1:
+            prompt_start = prompt_placeholder.search(template)
+            prefix, suffix = template[:prompt_start.start()], template[prompt_start.end():]
+            if "{{" not in system_placeholder.sub("", prefix) and "{{" not in suffix:
+                self.prefix_template, self.suffix_template = prefix, suffix
+
+    def applies(self, body):
+        if self.prefix_template is None or self.supported is False:
+            return False
+        if body.get("raw") or body.get("context") or body.get("template") or body.get("images") or body.get("suffix"):
+            return False
+        return bool(body.get("system") or self.default_system)
+
+    def render_prefix(self, system):
+        return system_placeholder.sub(lambda _: system, self.prefix_template)
+
+    async def _prefill(self, session, upstream_url, model, prefix):
+        # One greedy token after the prefix, its context minus the generated tokens is the prefix
+        body = {"model": model, "prompt": prefix, "raw": True, "stream": False,
+                "options": {"num_predict": 1, "temperature": 0}}
+        async with session.post(f"{upstream_url}/api/generate", json=body) as response:
+            response.raise_for_status()
+            result = await response.json()
+        context = result.get("context") or []
+        return context[:len(context) - result.get("eval_count", 0)]
+
+    async def _probe(self, session, upstream_url, model, context):
+        body = {"model": model, "prompt": "\n", "raw": True, "stream": False, "context": context,
+                "options": {"num_predict": 1, "temperature": 0}}
+        async with session.post(f"{upstream_url}/api/generate", json=body) as response:
+            response.raise_for_status()
+            result = await response.json()
+        return (result.get("context") or [])[:len(context)] == context
+
+    async def context_for(self, session, upstream_url, model, system):
+        """Returns the prefix context for model and system prompt, prefilling it on a miss.
+
+        Returns (None, False) once the upstream is known to ignore the context, the
+        request must then be sent unchanged.
+        """
+        key = (model, system)
+        if self.supported is False:
+            return None, False
+        if key in self.contexts:
+            self.contexts.move_to_end(key)
+            return self.contexts[key], True
+        lock = self.locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            # The probe may have failed while this request waited for the lock
+            if self.supported is False:
+                return None, False
+            if key in self.contexts:
+                return self.contexts[key], True
+            context = await self._prefill(session, upstream_url, model, self.render_prefix(system))
+            async with self.probe_lock:
+                if self.supported is None:
+                    self.supported = bool(context) and await self._probe(session, upstream_url, model, context)
+            if not self.supported:
+                return None, False
+            self.contexts[key] = context
+            while len(self.contexts) > self.max_entries:
+                evicted, _ = self.contexts.popitem(last=False)
+                self.locks.pop(evicted, None)
+            return context, False
+
+    def rewrite(self, body, context):
+        upstream_body = {key: value for key, value in body.items() if key != "system"}
+        upstream_body.update(raw=True, context=context, prompt=body["prompt"] + self.suffix_template)
+        return upstream_body
+
+
+class CacheProxy:
+    """Caching reverse proxy for the Ollama API.
+
+    Greedy (temperature 0) generate requests are answered from an exact-response
+    cache, and identical requests in flight share one upstream call. Everything
+    else is passed through unchanged. Counters are served on /metrics.
+    """
+
+    def __init__(self, upstream_url=default_base_url, cache=None, prefix_cache=None, max_connections=64):
+        self.upstream_url = upstream_url.rstrip("/")
+        self.cache = cache or ResponseCache()
+        self.prefix_cache = prefix_cache
+        self.max_connections = max_connections
+        self.inflight = {}
+        self.tasks = set()
+        self.counts = Counter()
+        self.session = None
+
+        self.app = web.Application()
+        self.app.router.add_post("/api/generate", self.generate)
+        self.app.router.add_get("/metrics", self.metrics)
+        self.app.router.add_route("*", "/{path:.*}", self.passthrough)
+        self.app.on_startup.append(self._open_session)
+        self.app.on_cleanup.append(self._close_session)
+
+    async def _open_session(self, app):
+        connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=None),
+                                             read_bufsize=2 ** 20)
+
+    async def _close_session(self, app):
+        await self.session.close()
+
+    async def _upstream_body(self, body):
+        if not (self.prefix_cache and self.prefix_cache.applies(body)):
+            return body
+        system = body.get("system") or self.prefix_cache.default_system
+        try:
+            context, hit = await self.prefix_cache.context_for(self.session, self.upstream_url, body.get("model"), system)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            # Fall back to the plain request, the prefix is retried next time
+            self.counts["prefix_errors"] += 1
+            return body
+        if context is None:
+            return body
+        self.counts["prefix_hits" if hit else "prefix_misses"] += 1
+        return self.prefix_cache.rewrite(body, context)
+
+    async def _fetch(self, body, inflight, key=None):
+        """Streams one upstream response into inflight, caching it when complete."""
+        try:
+            upstream_body = await self._upstream_body(body)
+            upstream_body["stream"] = True
+            async with self.session.post(f"{self.upstream_url}/api/generate", json=upstream_body) as response:
+                if response.status != 200:
+                    await inflight.finish(await response.text(), response.status)
+                    return
+                async for line in response.content:
+                    if line.strip():
+                        await inflight.add(line if line.endswith(b"\n") else line + b"\n")
+            complete = bool(inflight.lines) and json.loads(inflight.lines[-1]).get("done")
+            if key is not None and complete:
+                self.cache.put(key, list(inflight.lines))
+            await inflight.finish(None if complete else "upstream closed the stream early", 200 if complete else 502)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            await inflight.finish(f"{type(e).__name__}: {e}", 502)
+        finally:
+            if key is not None:
+                self.inflight.pop(key, None)
+
+    def _start_fetch(self, body, key=None):
+        inflight = InflightResponse()
+        if key is not None:
+            self.inflight[key] = inflight
+        # Runs on its own, a disconnecting client does not cancel it for the others
+        task = asyncio.ensure_future(self._fetch(body, inflight, key))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return inflight
+
+    async def generate(self, request):
+        body = await request.json()
+        stream = body.get("stream", True)
+        key = request_key(body) if is_deterministic(body) else None
+
+        lines, inflight = None, None
+        if key is None:
+            self.counts["uncacheable"] += 1
+            inflight = self._start_fetch(body)
+        elif (lines := self.cache.get(key)) is not None:
+            self.counts["hits"] += 1
+        elif key in self.inflight:
+            self.counts["inflight_hits"] += 1
+            inflight = self.inflight[key]
+        else:
+            self.counts["misses"] += 1
+            inflight = self._start_fetch(body, key)
+
+        if lines is None:
+            if not stream:
+                async for _ in inflight.follow():
+                    pass
+                if inflight.error:
+                    return web.json_response({"error": inflight.error}, status=inflight.status)
+                lines = inflight.lines
+            else:
+                return await self._stream(request, inflight)
+
+        if not stream:
+            return web.json_response(aggregate_chunks(lines))
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        await response.write(b"".join(lines))
+        await response.write_eof()
+        return response
+
+    async def _stream(self, request, inflight):
+        response = None
+        async for line in inflight.follow():
+            if response is None:
+                response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+                await response.prepare(request)
+            await response.write(line)
+        if response is None:
+            # Nothing was streamed, so the upstream status can still be passed on
+            return web.json_response({"error": inflight.error}, status=inflight.status)
+        if inflight.error:
+            await response.write((json.dumps({"error": inflight.error}) + "\n").encode("utf-8"))
+        await response.write_eof()
+        return response
+
+    async def passthrough(self, request):
+        headers = {key: value for key, value in request.headers.items() if key.lower() not in hop_by_hop_headers}
+        async with self.session.request(request.method, f"{self.upstream_url}{request.rel_url}", headers=headers,
+                                        data=await request.read()) as upstream:
+            response = web.StreamResponse(status=upstream.status, headers={
+                key: value for key, value in upstream.headers.items() if key.lower() not in hop_by_hop_headers})
+            await response.prepare(request)
+            async for data in upstream.content.iter_any():
+                await response.write(data)
+            await response.write_eof()
+            return response
+
+    def stats(self):
+        lookups = self.counts["hits"] + self.counts["inflight_hits"] + self.counts["misses"]
+        return {
+            **self.counts,
+            "hit_ratio": round((self.counts["hits"] + self.counts["inflight_hits"]) / lookups, 4) if lookups else 0.0,
+            "entries": len(self.cache.entries),
+            "bytes": self.cache.size,
+            "evictions": self.cache.evictions,
+            "inflight": len(self.inflight),
+            "prefix_entries": len(self.prefix_cache.contexts) if self.prefix_cache else 0,
+        }
+
+    async def metrics(self, request):
+        stats = self.stats()
+        counters = ("hits", "inflight_hits", "misses", "uncacheable", "evictions", "prefix_hits", "prefix_misses",
+                    "prefix_errors")
+        lines = []
+        for name in counters:
+            lines += [f"# TYPE {metric_prefix}_{name}_total counter", f"{metric_prefix}_{name}_total {stats.get(name, 0)}"]
+        for name in ("hit_ratio", "entries", "bytes", "inflight", "prefix_entries"):
+            lines += [f"# TYPE {metric_prefix}_{name} gauge", f"{metric_prefix}_{name} {stats[name]}"]
+        return web.Response(text="\n".join(lines) + "\n", content_type="text/plain")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Caching proxy in front of the Ollama API")
+    parser.add_argument("--upstream", default=default_base_url)
+    parser.add_argument("--port", type=int, default=default_port)
+    parser.add_argument("--max-bytes", type=int, default=default_max_bytes, help="memory budget of the response cache")
+    parser.add_argument("--ttl", type=float, default=default_ttl, help="seconds a cached response stays valid")
+    parser.add_argument("--modelfile", default=default_modelfile_path, help="template used for system-prompt prefixes")
+    parser.add_argument("--no-prefix-context", action="store_true", help="do not reuse contexts of system prompts")
+    args = parser.parse_args()
+
+    prefix_cache = None
+    if not args.no_prefix_context and os.path.isfile(args.modelfile):
+        modelfile = parse_modelfile(args.modelfile)
+        prefix_cache = PrefixContextCache(modelfile["template"], modelfile["system"])
+    proxy = CacheProxy(args.upstream, ResponseCache(args.max_bytes, args.ttl), prefix_cache)
+    web.run_app(proxy.app, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import time
+from datetime import datetime
+
+from com.mhire.inference.ollama_client import OllamaClient, default_base_url, default_model, read_prompts
+
+default_concurrency_levels = (1, 4, 16)
+
+
+# Function to get the p-th percentile of a list of numbers by linear interpolation
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    rank = (len(values) - 1) * p / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def summarize(results, wall_time):
+    """Latency percentiles, throughput and error rate of one concurrency level."""
+    ok = [result for result in results if not result["error"]]
+    ttfts = [result["ttft_sec"] for result in ok if result["ttft_sec"] is not None]
+    latencies = [result["latency_sec"] for result in ok]
+    tokens = sum(result.get("eval_count", 0) for result in ok)
+    summary = {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "error_rate": round((len(results) - len(ok)) / len(results), 4) if results else 0.0,
+        "wall_time_sec": round(wall_time, 3),
+        "requests_per_sec": round(len(ok) / wall_time, 3) if wall_time > 0 else 0.0,
+        # Aggregate decode throughput the server sustained at this concurrency
+        "tokens_per_sec": round(tokens / wall_time, 2) if wall_time > 0 else 0.0,
+    }
+    for p in (50, 95, 99):
+        value = percentile(ttfts, p)
+        summary[f"ttft_p{p}_sec"] = round(value, 4) if value is not None else None
+        value = percentile(latencies, p)
+        summary[f"latency_p{p}_sec"] = round(value, 4) if value is not None else None
+    per_request = [result["eval_tokens_per_sec"] for result in ok if result.get("eval_tokens_per_sec")]
+    if per_request:
+        summary["per_request_tokens_per_sec_p50"] = round(percentile(per_request, 50), 2)
+    # Keep a few distinct error messages to tell timeouts from server failures
+    summary["error_samples"] = sorted({result["error"] for result in results if result["error"]})[:5]
+    return summary
+
+
+async def run_level(records, concurrency, num_requests, base_url, model, timeout):
+    # Cycle through the prompts so every level sends the same number of requests
+    batch = list(itertools.islice(itertools.cycle(records), num_requests))
+    async with OllamaClient(base_url, model, max_concurrency=concurrency, timeout=timeout) as client:
+        start = time.perf_counter()
+        results = await client.generate_all(batch)
+        wall_time = time.perf_counter() - start
+    return summarize(results, wall_time)
+
+
+async def run_load_test(records, concurrency_levels=default_concurrency_levels, requests_per_level=None,
+                        base_url=default_base_url, model=default_model, warmup_requests=1, timeout=300):
+    """Sends the prompts at each concurrency level and returns the report."""
+    if not records:
+        raise ValueError("No prompts to send")
+    report = {"url": base_url, "model": model, "created": datetime.now().isoformat(), "levels": {}}
+
+    # The first request pays the model load, keep it out of the numbers
+    if warmup_requests:
+        await run_level(records, 1, warmup_requests, base_url, model, timeout)
+
+    for concurrency in concurrency_levels:
+        num_requests = requests_per_level or max(len(records), concurrency * 4)
+        summary = await run_level(records, concurrency, num_requests, base_url, model, timeout)
+        report["levels"][str(concurrency)] = summary
+        print(f"concurrency {concurrency}: {summary['requests_per_sec']} req/s, {summary['tokens_per_sec']} tokens/s, "
+              f"TTFT p50/p95/p99 {summary['ttft_p50_sec']}/{summary['ttft_p95_sec']}/{summary['ttft_p99_sec']}s, "
+              f"errors {summary['error_rate']:.1%}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test an Ollama server across concurrency levels")
+    parser.add_argument("--prompts", required=True, help="jsonl with a prompt field and optional system/options")
+    parser.add_argument("--url", default=default_base_url)
+    parser.add_argument("--model", default=default_model)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=list(default_concurrency_levels))
+    parser.add_argument("--requests", type=int, default=None, help="requests per level, defaults to the prompt count")
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--report", default=None, help="write the report as json")
+    args = parser.parse_args()
+
+    records = read_prompts(args.prompts)
+    report = asyncio.run(run_load_test(records, args.concurrency, args.requests, args.url, args.model,
+                                       args.warmup, args.timeout))
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Load test report written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+
+from aiohttp import web
+
+default_port = 11435
+
+
+class MockOllamaServer:
+    """Stand-in for the Ollama generate API with configurable latency and failures.
+
+    Streams the prompt's words back one token per token_delay after a first-token
+    delay, which makes TTFT and throughput numbers of a load test predictable.
+    raw_context=False mimics Ollama versions that drop the context of raw requests.
+    """
+
+    def __init__(self, first_token_delay=0.05, token_delay=0.01, num_tokens=16, error_rate=0.0, seed=None,
+                 host="127.0.0.1", port=0, raw_context=True):
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.num_tokens = num_tokens
+        self.error_rate = error_rate
+        self.raw_context = raw_context
+        self.random = random.Random(seed)
+        self.host = host
+        self.port = port
+        self.request_counts = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.last_body = None
+        self.bodies = []
+        self.runner = None
+
+        self.app = web.Application()
+        self.app.router.add_post("/api/generate", self.generate)
+        self.app.router.add_get("/api/tags", self.tags)
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def tags(self, request):
+        return web.json_response({"models": [{"name": "model:latest"}]})
+
+    def tokens(self, body):
+        words = body.get("prompt", "").split() or ["ok"]
+        num_predict = (body.get("options") or {}).get("num_predict") or 0
+        num_tokens = min(self.num_tokens, num_predict) if num_predict > 0 else self.num_tokens
+        return [f"{words[i % len(words)]} " for i in range(num_tokens)]
+
+    async def generate(self, request):
+        body = await request.json()
+        self.request_counts["generate"] += 1
+        self.last_body = body
+        self.bodies.append(body)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.random.random() < self.error_rate:
+                self.request_counts["errors"] += 1
+                return web.json_response({"error": "mock failure"}, status=500)
+
+            start = time.perf_counter()
+            await asyncio.sleep(self.first_token_delay)
+            prompt_done = time.perf_counter()
+            tokens = self.tokens(body)
+            context = [] if body.get("raw") and not self.raw_context else list(body.get("context") or [])
+            context = context + list(range(len(body.get("prompt", "").split()) + len(tokens)))
+            final = {
+                "model": body.get("model"),
+                "done": True,
+                "context": context,
+                "prompt_eval_count": len(body.get("prompt", "").split()),
+                "eval_count": len(tokens),
+            }
+
+            if body.get("stream", True) is False:
+                await asyncio.sleep(self.token_delay * len(tokens))
+                final.update(response="".join(tokens), total_duration=int((time.perf_counter() - start) * 1e9),
+                             eval_duration=int((time.perf_counter() - prompt_done) * 1e9))
+                return web.json_response(final)
+
+            response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+            await response.prepare(request)
+            for index, token in enumerate(tokens):
+                if index:
+                    await asyncio.sleep(self.token_delay)
+                await response.write((json.dumps({"model": body.get("model"), "response": token, "done": False}) + "\n").encode())
+            final.update(response="", total_duration=int((time.perf_counter() - start) * 1e9),
+                         eval_duration=int((time.perf_counter() - prompt_done) * 1e9))
+            await response.write((json.dumps(final) + "\n").encode())
+            await response.write_eof()
+            return response
+        finally:
+            self.in_flight -= 1
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        # Port 0 picks a free port, read back the one actually bound
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a mock Ollama generate API for local tests")
+    parser.add_argument("--port", type=int, default=default_port)
+    parser.add_argument("--first-token-delay", type=float, default=0.05)
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    parser.add_argument("--num-tokens", type=int, default=16)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = MockOllamaServer(args.first_token_delay, args.token_delay, args.num_tokens, args.error_rate, port=args.port)
+    web.run_app(server.app, host=server.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
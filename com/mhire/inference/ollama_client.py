@@ -0,0 +1,145 @@
+import argparse
+import asyncio
+import json
+import time
+
+import aiohttp
+
+default_base_url = "http://localhost:11434"
+# The name OllamaModelStore gives the model baked into the inference image
+default_model = "model"
+default_concurrency = 8
+
+
+# Function to read prompt records from a jsonl file, the training format works as is
+def read_prompts(jsonl_file_path, limit=None):
+    records = []
+    with open(jsonl_file_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "prompt" not in record:
+                raise ValueError(f"Prompt record without a prompt field: {line.strip()[:200]}")
+            records.append(record)
+            if limit and len(records) >= limit:
+                break
+    return records
+
+
+class OllamaClient:
+    """Async client for the Ollama generate API over one pooled keep-alive session.
+
+    At most max_concurrency requests are in flight, which also bounds the
+    connection pool, and responses are read as they stream so time to first
+    token is measured on the first chunk.
+    """
+
+    def __init__(self, base_url=default_base_url, model=default_model, max_concurrency=default_concurrency,
+                 timeout=300):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.semaphore = None
+        self.session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60)
+        # The final chunk carries the whole token context, larger than the default line buffer
+        self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout, read_bufsize=2 ** 20)
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    def request_body(self, record):
+        body = {"model": record.get("model", self.model), "prompt": record["prompt"], "stream": True}
+        for key in ("system", "options", "context", "template", "keep_alive"):
+            if key in record:
+                body[key] = record[key]
+        return body
+
+    async def generate(self, record, on_token=None):
+        """Sends one prompt record, streaming the answer, and returns the response with timings.
+
+        Errors are returned in the result instead of raised, so one bad request does
+        not stop a batch.
+        """
+        result = {"prompt": record["prompt"], "response": "", "error": None, "ttft_sec": None}
+        async with self.semaphore:
+            start = time.perf_counter()
+            try:
+                async with self.session.post(f"{self.base_url}/api/generate", json=self.request_body(record)) as response:
+                    if response.status != 200:
+                        raise RuntimeError(f"HTTP {response.status}: {(await response.text())[:500]}")
+                    chunks = []
+                    # Ollama streams one JSON object per line
+                    async for line in response.content:
+                        if not line.strip():
+                            continue
+                        chunk = json.loads(line)
+                        if chunk.get("error"):
+                            raise RuntimeError(chunk["error"])
+                        if result["ttft_sec"] is None:
+                            result["ttft_sec"] = time.perf_counter() - start
+                        if chunk.get("response"):
+                            chunks.append(chunk["response"])
+                            if on_token:
+                                on_token(chunk["response"])
+                        if chunk.get("done"):
+                            result["eval_count"] = chunk.get("eval_count", len(chunks))
+                            result["prompt_eval_count"] = chunk.get("prompt_eval_count")
+                            result["context"] = chunk.get("context")
+                            # Server-side decode rate, free of network and queueing time
+                            if chunk.get("eval_duration"):
+                                result["eval_tokens_per_sec"] = result["eval_count"] / (chunk["eval_duration"] / 1e9)
+                    result["response"] = "".join(chunks)
+                    result.setdefault("eval_count", len(chunks))
+            except (aiohttp.ClientError, asyncio.TimeoutError, RuntimeError, ValueError) as e:
+                result["error"] = f"{type(e).__name__}: {e}"
+            result["latency_sec"] = time.perf_counter() - start
+        return result
+
+    async def generate_all(self, records, on_result=None):
+        """Runs every record with bounded concurrency and returns results in input order."""
+        async def run(record):
+            result = await self.generate(record)
+            if on_result:
+                on_result(result)
+            return result
+        return await asyncio.gather(*(run(record) for record in records))
+
+
+async def run_prompts(prompts_path, output_path, base_url=default_base_url, model=default_model,
+                      max_concurrency=default_concurrency, limit=None):
+    records = read_prompts(prompts_path, limit)
+    with open(output_path, "w", encoding="utf-8") as f:
+        # Results are written as they finish, so a long run can be followed with tail -f
+        def write(result):
+            result = {key: value for key, value in result.items() if key != "context"}
+            f.write(json.dumps(result) + "\n")
+            f.flush()
+
+        async with OllamaClient(base_url, model, max_concurrency) as client:
+            results = await client.generate_all(records, on_result=write)
+    errors = sum(1 for result in results if result["error"])
+    print(f"{len(results)} prompts sent, {errors} errors, results written to {output_path}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send prompts from a jsonl file to an Ollama server")
+    parser.add_argument("--prompts", required=True, help="jsonl with a prompt field and optional system/options")
+    parser.add_argument("--output", required=True, help="jsonl of responses and timings")
+    parser.add_argument("--url", default=default_base_url)
+    parser.add_argument("--model", default=default_model)
+    parser.add_argument("--concurrency", type=int, default=default_concurrency)
+    parser.add_argument("--limit", type=int, default=None)
+    args = parser.parse_args()
+    asyncio.run(run_prompts(args.prompts, args.output, args.url, args.model, args.concurrency, args.limit))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,26 @@
 import os
 import traceback
 import logging
-import requests
 from com.mhire.utility.metadata_util import MetadataHelper
-from com.mhire.utility.util import clear_storage, log, log_error, log_file, gsutil_url_log
+from com.mhire.utility.util import clear_storage, log, log_error, log_file, logger, gsutil_url_log
 from com.mhire.utility.gcp_util import GCPUtil
+from com.mhire.utility.artifact_cache import ArtifactCache
+from com.mhire.utility.cache_util import cache_root
+from com.mhire.utility.pipeline_util import Pipeline, Stage
 from com.mhire.utility.docker_util import DockerUtil
 from com.mhire.fine_tuning.fine_tuning import FineTuneModel
-from com.mhire.fine_tuning.quantize import quantize
+from com.mhire.fine_tuning.quantize import quantize, default_quantization_level
+from com.mhire.fine_tuning.tokenization_cache import default_cache_dir
+from com.mhire.fine_tuning.checkpointing import default_checkpoint_root
+from com.mhire.fine_tuning.lora import LoraTrainingConfig
+from com.mhire.fine_tuning.telemetry import ProfilerConfig, default_telemetry_root, default_metrics_port
+
+default_pipeline_root = os.path.join(cache_root, "pipeline")
 
 def fetch_and_validate_metadata():
 
-    project_id = requests.get("http://metadata.google.internal/computeMetadata/v1/project/project-id", headers={"Metadata-Flavor": "Google"}).text
-    vm_zone = requests.get("http://metadata.google.internal/computeMetadata/v1/instance/zone", headers={"Metadata-Flavor": "Google"}).text.split('/')[-1]  # Extract only the zone name
-    vm_instance = requests.get("http://metadata.google.internal/computeMetadata/v1/instance/name", headers={"Metadata-Flavor": "Google"}).text
-    
-    # Initialize utility instances
-    metaDataHelper = MetadataHelper(project_id, vm_zone, vm_instance)
-    gcp_util = GCPUtil()
+    # One recursive read of the metadata server gives project, zone, name and attributes
+    metaDataHelper = MetadataHelper()
     """Fetches metadata and ensures that all necessary variables are available."""
     log("Fetching metadata from instance...")
     
@@ -39,9 +42,12 @@ def fetch_and_validate_metadata():
 
 def main():
 
-    gcp_util = GCPUtil(service_account_key_path="/tmp/service_account_key.json")
+    gcp_util = GCPUtil(service_account_key_path="/tmp/service_account_key.json", artifact_cache=ArtifactCache())
     fine_tuning = FineTuneModel()
     docker_util = DockerUtil()
+    # Read the recipe before clear_storage() wipes the working dir it ships in
+    lora_config = LoraTrainingConfig.from_yaml()
+    profiler_config = ProfilerConfig.from_yaml()
 
     """Main function to handle the startup process for fine-tuning."""
     log("Starting fine-tuning startup script")
@@ -50,61 +56,71 @@ def main():
         # Fetch and validate metadata
         model_path, dataset_path, model_save_name, fine_tuning_id, full_docker_image_name = fetch_and_validate_metadata()
 
-        # Clear any existing storage
-        clear_storage()
-        log("Storage cleared.")
+        # Ship the log to Cloud Storage while the job runs, so a crashed job still leaves one
+        logger.start_upload(gcp_util.storage_client, f"{gsutil_url_log}{fine_tuning_id}.jsonl")
 
         working_directory = "/llm-utility/"
-
-        # Download data and model.zip in instance and unzip the model
-        # Download and unzip the model from Google Cloud Storage
-        log(f"Downloading the model from: {model_path}")
-        gcp_util.download_from_gcs(model_path, working_directory)
-        #log(f"Model downloaded successfully.")
-
-        # Download the dataset from Google Cloud Storage
-        log(f"Downloading dataset to Google Cloud Storage: {dataset_path}")
-        gcp_util.download_from_gcs(dataset_path, working_directory)
-        log("Dataset downloaded successfully.")    
-
-        # Perform fine-tuning and save in instance's local path
-        # Define paths for the fine-tuning process
         model_local_path = working_directory  # Path where the model is located
         dataset_local_path = os.path.join(working_directory, os.path.basename(dataset_path))  # Path to the downloaded dataset
+        gguf_local_path = os.path.join(working_directory, "model_file.gguf")
 
-        # Perform fine-tuning using the specified paths
-        fine_tuning.fine_tune_model(model_local_path, dataset_local_path)
-
-        log("Fine-tuning completed successfully.")
+        # Stage progress survives a crash, so a restarted job resumes instead of starting over
+        pipeline = Pipeline(os.path.join(default_pipeline_root, f"{fine_tuning_id}.json"))
 
-        # Zip fine-tuned model and upload in Cloud storage
-
-        # Quantize the model and save the gguf file in instance 
-
-        # Build, tag docker image
-        docker_util.build_docker_image(full_docker_image_name)
-
-        # Push Docker image (Assuming the full image name includes registry)
-        docker_util.push_docker_image(full_docker_image_name)  # Pass registry URL
-    
-        # Create model directory first
-
-        log_file_path = os.path.join(working_directory, f"{fine_tuning_id}.txt")
-        if os.path.exists(log_file):
-            os.rename(log_file, log_file_path)
-            log(f"Log file renamed to: {log_file_path}")
+        # Clear any existing storage, unless it holds outputs of an interrupted run
+        if pipeline.has_progress():
+            log("Resuming interrupted run, keeping storage.")
         else:
-            log_error("Log file not found for renaming.")
-            raise FileNotFoundError(f"Log file {log_file} not found.")
-
-        # Upload the renamed log file to Cloud Storage
-        gcp_util.upload_file_to_gcs(log_file_path, gsutil_url_log)
+            clear_storage()
+            log("Storage cleared.")
+
+        # Download and unzip the model and download the dataset from Google Cloud Storage in parallel
+        pipeline.add(Stage("download_model", lambda results: gcp_util.download_from_gcs(model_path, working_directory),
+                           outputs=[os.path.join(model_local_path, "config.json")], retries=2, retry_delay=30))
+        pipeline.add(Stage("download_dataset", lambda results: gcp_util.download_from_gcs(dataset_path, working_directory),
+                           outputs=[dataset_local_path], retries=2, retry_delay=30))
+
+        # Warm the Ollama base image while training runs
+        pipeline.add(Stage("pull_base_image", lambda results: docker_util.ensure_base_image(), retries=2, retry_delay=30))
+
+        # Perform fine-tuning using the specified paths, tokenizing while the model loads. A cache
+        # miss tokenizes up front in parallel, so even the first run gets token-budget buckets
+        pipeline.add(Stage("fine_tune", lambda results: fine_tuning.fine_tune_model(
+            model_local_path, dataset_local_path, streaming=False, cache_dir=default_cache_dir, dynamic_padding=True,
+            max_batch_tokens=8192, num_proc=os.cpu_count(),
+            checkpoint_dir=os.path.join(default_checkpoint_root, fine_tuning_id), lora_config=lora_config,
+            telemetry_dir=os.path.join(default_telemetry_root, fine_tuning_id), profiler_config=profiler_config,
+            metrics_port=default_metrics_port),
+            deps=["download_model", "download_dataset"]))
+
+        # Quantize the model and save the gguf file in instance
+        pipeline.add(Stage("quantize", lambda results: quantize(
+            results["fine_tune"], gguf_local_path, level=default_quantization_level, calibration_jsonl=dataset_local_path),
+            deps=["fine_tune"], outputs=[gguf_local_path]))
+
+        # Build, tag and push the docker image once (Assuming the full image name includes registry)
+        def build_image(results):
+            docker_util.build_docker_image(full_docker_image_name, gguf_local_path)
+
+        pipeline.add(Stage("build_image", build_image, deps=["quantize", "pull_base_image"]))
+        pipeline.add(Stage("push_image", lambda results: docker_util.push_docker_image(full_docker_image_name),
+                           deps=["build_image"], retries=2, retry_delay=30))
+
+        pipeline.run()
+        log("Fine-tuning pipeline completed successfully.")
+
+        # Upload the rest of the log and keep it under the job id, the next job starts a fresh log
+        logger.close()
+        os.rename(log_file, os.path.join(working_directory, f"{fine_tuning_id}.jsonl"))
 
     except Exception as e:
         log_error(f"Error encountered during fine-tuning setup: {traceback.format_exc()}")
         log_error(f"Exception: {str(e)}")
     except ModuleNotFoundError as e:
         log_error(f"No module named 'llm_utility': {str(e)}")
+    finally:
+        # Write out buffered records and upload the rest of the log
+        logger.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
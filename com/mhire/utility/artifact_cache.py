@@ -0,0 +1,103 @@
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from com.mhire.utility.util import log
+from com.mhire.utility.cache_util import cache_root, evict_lru, publish_dir, remove_stale_staging, touch
+
+default_cache_dir = os.path.join(cache_root, "artifacts")
+default_cache_size_bytes = 200 * 1024 ** 3
+# ioctl request for a copy-on-write clone on btrfs/xfs
+FICLONE = 0x40049409
+
+
+# Function to hardlink a file, falling back to a symlink across filesystems, then a reflink and a plain copy
+def link_or_copy(src, dst):
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+        return "hardlink"
+    except OSError as e:
+        # The cache is a host volume and the work dir is on the container's overlay, so
+        # neither a hardlink nor a reflink can cross; point at the cached file instead
+        if e.errno == errno.EXDEV:
+            os.symlink(src, dst)
+            return "symlink"
+    try:
+        with open(src, "rb") as src_f, open(dst, "wb") as dst_f:
+            fcntl.ioctl(dst_f.fileno(), FICLONE, src_f.fileno())
+        return "reflink"
+    except OSError:
+        shutil.copy2(src, dst)
+        return "copy"
+
+
+class ArtifactCache:
+    """Content-addressed cache of downloaded GCS objects, shared across jobs on a VM.
+
+    Entries materialized in this process may be symlinked from the work dir, so they
+    are never evicted while it runs.
+    """
+
+    def __init__(self, cache_dir=default_cache_dir, max_size_bytes=default_cache_size_bytes):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.in_use = set()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for name in remove_stale_staging(self.cache_dir):
+            log(f"Removed orphaned artifact cache staging dir {name}")
+
+    # Key on the object's generation and content hash, so an overwritten object misses
+    def cache_key(self, blob):
+        identity = f"{blob.bucket.name}/{blob.name}#{blob.generation}:{blob.md5_hash or ''}:{blob.crc32c or ''}"
+        return hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+    def entry_files_dir(self, key):
+        return os.path.join(self.cache_dir, key, "files")
+
+    def has(self, key):
+        return os.path.isfile(os.path.join(self.cache_dir, key, "meta.json"))
+
+    def materialize(self, key, target_dir):
+        """Links every cached file of an entry into target_dir."""
+        entry_dir = os.path.join(self.cache_dir, key)
+        files_dir = self.entry_files_dir(key)
+        touch(entry_dir)
+        self.in_use.add(key)
+        linked, methods = [], set()
+        for root, dirs, files in os.walk(files_dir):
+            for file in files:
+                src = os.path.join(root, file)
+                dst = os.path.join(target_dir, os.path.relpath(src, files_dir))
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                methods.add(link_or_copy(src, dst))
+                linked.append(dst)
+        log(f"Artifact cache hit: {len(linked)} files from {entry_dir} into {target_dir} ({', '.join(sorted(methods))})")
+        return linked
+
+    def populate(self, key, source, fill):
+        """Runs fill(staging_dir) to produce the entry's files, then publishes it atomically."""
+        entry_dir = os.path.join(self.cache_dir, key)
+        staging_dir = tempfile.mkdtemp(prefix=f".{key}.", dir=self.cache_dir)
+        try:
+            files_dir = os.path.join(staging_dir, "files")
+            os.makedirs(files_dir)
+            fill(files_dir)
+            with open(os.path.join(staging_dir, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump({"source": source, "created": time.time()}, f)
+            publish_dir(staging_dir, entry_dir)
+        except Exception:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """Removes least recently used entries until the cache fits its budget."""
+        keep = self.in_use | ({keep} if keep else set())
+        for name, size in evict_lru(self.cache_dir, self.max_size_bytes, keep):
+            log(f"Evicting artifact cache entry {name} ({size} bytes)")
@@ -0,0 +1,95 @@
+import os
+import shutil
+import time
+
+# Host volume (/var/cache/llm-cache on the VM) mounted into the training container. It is
+# outside /llm-utility/, so clear_storage() does not wipe it, and caches, checkpoints,
+# stage records and telemetry outlive the job and a restarted container.
+cache_root = "/llm-cache"
+# A staging dir nothing has written to for this long belongs to a build that died
+default_stale_staging_seconds = 24 * 3600
+
+
+# Function to compute the total size of a directory
+def dir_size(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            total += os.path.getsize(os.path.join(root, file))
+    return total
+
+
+# Function to mark a cache entry as recently used for LRU eviction
+def touch(entry_dir):
+    os.utime(entry_dir)
+
+
+# Function to move a fully written staging dir into place, so a half-written entry is never read
+def publish_dir(staging_dir, entry_dir):
+    if os.path.isdir(entry_dir):
+        shutil.rmtree(entry_dir)
+    os.rename(staging_dir, entry_dir)
+
+
+# Function to get the newest modification time of a directory or anything in it
+def last_modified(path):
+    newest = os.path.getmtime(path)
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            try:
+                newest = max(newest, os.path.getmtime(os.path.join(root, name)))
+            except OSError:
+                pass
+    return newest
+
+
+def remove_stale_staging(cache_dir, max_age_seconds=default_stale_staging_seconds):
+    """Removes hidden staging dirs of builds that never finished.
+
+    A build cut off by preemption, a crash or the end of the process leaves its
+    staging dir behind, and evict_lru never counts those. Any file written keeps a
+    staging dir fresh, so a build still running is left alone. Returns the names of
+    the removed dirs.
+    """
+    removed = []
+    cutoff = time.time() - max_age_seconds
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if not name.startswith(".") or not os.path.isdir(path):
+            continue
+        try:
+            if last_modified(path) >= cutoff:
+                continue
+        except OSError:
+            # Published or removed by its own build in the meantime
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        removed.append(name)
+    return removed
+
+
+def evict_lru(cache_dir, max_size_bytes, keep=()):
+    """Removes least recently used entries of cache_dir until it fits max_size_bytes.
+
+    Entries are the subdirectories of cache_dir; hidden ones are staging dirs of
+    builds in progress and never count or get removed here, see remove_stale_staging. Returns the (name, size)
+    of every removed entry.
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.startswith(".") or not os.path.isdir(path):
+            continue
+        entries.append((os.path.getmtime(path), dir_size(path), name, path))
+
+    evicted = []
+    total = sum(size for _, size, _, _ in entries)
+    for _, size, name, path in sorted(entries):
+        if total <= max_size_bytes:
+            break
+        if name in keep:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        evicted.append((name, size))
+        total -= size
+    return evicted
@@ -1,46 +1,99 @@
+import os
+import shutil
 import docker
-from docker.errors import DockerException
-from com.mhire.utility.util import log
-from com.mhire.utility.gcp_util import GCPUtil
+from docker.errors import DockerException, ImageNotFound
+from com.mhire.utility.util import log, log_error, sha256_file
+from com.mhire.utility.ollama_util import OllamaModelStore, parse_modelfile
+
+repo_root = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+default_dockerfile_path = os.path.join(repo_root, "ollama_docker", "Dockerfile")
+default_modelfile_path = os.path.join(repo_root, "Modelfile")
+default_base_image = "ollama/ollama:latest"
+model_digest_label = "com.mhire.model.digest"
 
 class DockerUtil():
-    def __init__(self):
-        # Initialize the Docker client
-        self.gcp_util = GCPUtil()
-        self.client = docker.from_env()
+    def __init__(self, client=None, base_image=default_base_image, dockerfile_path=default_dockerfile_path,
+                 modelfile_path=default_modelfile_path):
+        # Initialize the Docker client (a fake client can be injected for tests)
+        self.client = client or docker.from_env()
+        self.base_image = base_image
+        # Read the templates now, clear_storage() may remove the checkout before the build
+        with open(dockerfile_path, "r", encoding="utf-8") as f:
+            self.dockerfile = f.read()
+        self.modelfile = parse_modelfile(modelfile_path)
+
+    # Make sure the base Ollama image is in the local layer cache, pulling it only once
+    def ensure_base_image(self):
+        try:
+            self.client.images.get(self.base_image)
+            log(f"Using cached base image {self.base_image}")
+        except ImageNotFound:
+            log(f"Pulling base image {self.base_image}")
+            self.client.images.pull(self.base_image)
 
-    # Build and push Docker image directly to the registry
-    def build_docker_image(self, full_image_name):
+    # Build the inference image: cached base layers plus one model store layer
+    def build_docker_image(self, full_image_name, gguf_path, context_dir="/llm-utility/ollama_image"):
         # Full image path for the registry
         log(f"Building Docker image: {full_image_name}")
-        
+
         try:
+            gguf_digest = f"sha256:{sha256_file(gguf_path)}"
+
+            # The same model was already built on this host, just retag it
+            existing = self.client.images.list(filters={"label": f"{model_digest_label}={gguf_digest}"})
+            if existing:
+                existing[0].tag(full_image_name)
+                log(f"Reusing image {existing[0].id} for model {gguf_digest}")
+                return existing[0]
+
+            self.ensure_base_image()
+
+            # Minimal build context: the Dockerfile and the content-addressed model store
+            shutil.rmtree(context_dir, ignore_errors=True)
+            os.makedirs(context_dir)
+            with open(os.path.join(context_dir, "Dockerfile"), "w", encoding="utf-8") as f:
+                f.write(self.dockerfile)
+            OllamaModelStore(os.path.join(context_dir, "models")).write(gguf_path, self.modelfile, gguf_digest=gguf_digest)
+
             # Build the Docker image and tag it directly for the registry
             image, logs = self.client.images.build(
-                path="/LLM_Util/llm-utility", 
-                dockerfile="Dockerfile", 
-                tag=full_image_name, 
-                nocache=True
+                path=context_dir,
+                dockerfile="Dockerfile",
+                tag=full_image_name,
+                buildargs={"BASE_IMAGE": self.base_image},
+                labels={model_digest_label: gguf_digest},
+                pull=False,
+                rm=True,
             )
             # Log the build output
             for log_line in logs:
-                log(log_line.get('stream', '').strip())
+                line = log_line.get('stream', '').strip()
+                if line:
+                    log(line)
 
             log(f"Docker image {full_image_name} built successfully.")
-
-            # Push the Docker image to the registry
-            self.push_docker_image(full_image_name)  # <-- Passing image_name and tag here
+            return image
 
         except DockerException as e:
-            self.gcp_util.handle_error(f"Error building Docker image {full_image_name}: {str(e)}")
+            log_error(f"Error building Docker image {full_image_name}: {str(e)}")
+            raise
 
     def push_docker_logs(self, push_logs):
+        pushed, existing = set(), set()
         for log_line in push_logs:
             if 'errorDetail' in log_line:
-                log(f"Error pushing image: {log_line['errorDetail']['message']}")
-                self.gcp_util.handle_error(f"Push failed: {log_line['errorDetail']['message']}")
+                log_error(f"Error pushing image: {log_line['errorDetail']['message']}")
                 return False  # Stop execution if an error is found
-            log(log_line.get('status', ''))
+            status = log_line.get('status', '')
+            # Progress lines repeat per chunk, only log layer state changes
+            if status == 'Pushing':
+                continue
+            if status == 'Pushed':
+                pushed.add(log_line.get('id'))
+            elif status == 'Layer already exists':
+                existing.add(log_line.get('id'))
+            log(status)
+        log(f"Pushed {len(pushed)} layers, {len(existing)} already in the registry")
         return True
 
     # Push Docker image to Google Artifact Registry
@@ -49,7 +102,11 @@ class DockerUtil():
         try:
             # Push the Docker image and handle logs
             push_logs = self.client.images.push(full_image_name, stream=True, decode=True)
-            if self.push_docker_logs(push_logs):  # Calling the push_docker_logs method
-                log(f"Docker image {full_image_name} pushed to registry successfully.")
+            pushed = self.push_docker_logs(push_logs)  # Calling the push_docker_logs method
         except DockerException as e:
-            self.gcp_util.handle_error(f"Error pushing Docker image {full_image_name}: {str(e)}")
\ No newline at end of file
+            log_error(f"Error pushing Docker image {full_image_name}: {str(e)}")
+            raise
+        # The registry reports push errors in the stream, not as an exception
+        if not pushed:
+            raise RuntimeError(f"Push of Docker image {full_image_name} failed")
+        log(f"Docker image {full_image_name} pushed to registry successfully.")
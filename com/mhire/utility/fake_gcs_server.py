@@ -0,0 +1,296 @@
+import argparse
+import base64
+import hashlib
+import json
+import re
+import threading
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+import google_crc32c
+
+object_pattern = re.compile(r"^(?:/download)?/storage/v1/b/([^/]+)/o/([^/]+?)(/compose)?$")
+upload_pattern = re.compile(r"^/upload/storage/v1/b/([^/]+)/o$")
+range_pattern = re.compile(r"^bytes=(\d+)-(\d*)$")
+
+
+# Function to compute the base64 crc32c and md5 GCS reports for an object
+def object_checksums(data):
+    crc32c = base64.b64encode(google_crc32c.Checksum(data).digest()).decode("utf-8")
+    md5 = base64.b64encode(hashlib.md5(data).digest()).decode("utf-8")
+    return crc32c, md5
+
+
+class FakeGcsServer:
+    """Local stand-in for the GCS JSON API calls TransferUtil and GCPUtil make.
+
+    Serves object metadata, ranged media downloads, multipart and resumable
+    uploads, compose and delete, with generations and checksums like the real
+    service. Point a storage.Client at it with STORAGE_EMULATOR_HOST=url.
+    download_budget and upload_budget are how many more media requests to serve
+    before answering 403, which lets tests interrupt a transfer midway.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.objects = {}
+        self.uploads = {}
+        self.generation = 0
+        self.download_budget = None
+        self.upload_budget = None
+        self.lock = threading.Lock()
+        self.request_counts = Counter()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def put_object(self, bucket_name, name, data, composite=False):
+        """Stores an object as a new generation and returns its metadata."""
+        with self.lock:
+            return self._put(bucket_name, name, bytes(data), composite)
+
+    def get_object(self, bucket_name, name):
+        entry = self.objects.get((bucket_name, name))
+        return entry["data"] if entry else None
+
+    def object_names(self, bucket_name):
+        return sorted(name for bucket, name in self.objects if bucket == bucket_name)
+
+    def _put(self, bucket_name, name, data, composite=False, content_type="application/octet-stream"):
+        self.generation += 1
+        crc32c, md5 = object_checksums(data)
+        self.objects[(bucket_name, name)] = {
+            "data": data, "generation": self.generation, "crc32c": crc32c,
+            # Composite objects have no md5, only a crc32c
+            "md5Hash": None if composite else md5, "contentType": content_type,
+            "updated": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+        }
+        return self._resource(bucket_name, name)
+
+    def _resource(self, bucket_name, name):
+        entry = self.objects[(bucket_name, name)]
+        resource = {
+            "kind": "storage#object",
+            "id": f"{bucket_name}/{name}/{entry['generation']}",
+            "bucket": bucket_name,
+            "name": name,
+            "generation": str(entry["generation"]),
+            "metageneration": "1",
+            "size": str(len(entry["data"])),
+            "crc32c": entry["crc32c"],
+            "contentType": entry["contentType"],
+            "timeCreated": entry["updated"],
+            "updated": entry["updated"],
+            "mediaLink": f"{self.url}/download/storage/v1/b/{bucket_name}/o/{quote(name, safe='')}"
+                         f"?generation={entry['generation']}&alt=media",
+        }
+        if entry["md5Hash"]:
+            resource["md5Hash"] = entry["md5Hash"]
+        else:
+            resource["componentCount"] = 2
+        return resource
+
+    def _lookup(self, bucket_name, name, query):
+        entry = self.objects.get((bucket_name, name))
+        # Only the live generation is kept, an older pinned one is gone as on an unversioned bucket
+        if entry is None or ("generation" in query and int(query["generation"][0]) != entry["generation"]):
+            return None
+        return entry
+
+    def _take_budget(self, attribute):
+        budget = getattr(self, attribute)
+        if budget is None:
+            return True
+        if budget <= 0:
+            return False
+        setattr(self, attribute, budget - 1)
+        return True
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, so a pooled client reuses its connections
+            protocol_version = "HTTP/1.1"
+
+            def _send(self, status, body=b"", content_type="application/json", headers=None):
+                data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _error(self, status, message):
+                self._send(status, {"error": {"code": status, "message": message}})
+
+            def _body(self):
+                return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                query = parse_qs(url.query)
+                match = object_pattern.match(url.path)
+                if not match or match.group(3):
+                    return self._error(404, f"{url.path} not found")
+                bucket_name, name = match.group(1), unquote(match.group(2))
+                media = query.get("alt") == ["media"]
+
+                with server.lock:
+                    server.request_counts["GET media" if media else "GET object"] += 1
+                    entry = server._lookup(bucket_name, name, query)
+                    if entry is None:
+                        return self._error(404, f"No such object: {bucket_name}/{name}")
+                    if not media:
+                        return self._send(200, server._resource(bucket_name, name))
+                    if not server._take_budget("download_budget"):
+                        return self._error(403, "Download budget exhausted")
+                    data = entry["data"]
+                    headers = {"x-goog-generation": str(entry["generation"])}
+
+                range_match = range_pattern.match(self.headers.get("Range", ""))
+                if not range_match:
+                    hashes = f"crc32c={entry['crc32c']}" + (f",md5={entry['md5Hash']}" if entry["md5Hash"] else "")
+                    headers["x-goog-hash"] = hashes
+                    return self._send(200, data, "application/octet-stream", headers)
+                start = int(range_match.group(1))
+                end = min(int(range_match.group(2)) if range_match.group(2) else len(data) - 1, len(data) - 1)
+                if start >= len(data):
+                    return self._error(416, "Requested range not satisfiable")
+                headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+                self._send(206, data[start:end + 1], "application/octet-stream", headers)
+
+            def do_POST(self):
+                url = urlsplit(self.path)
+                query = parse_qs(url.query)
+                body = self._body()
+
+                match = upload_pattern.match(url.path)
+                if match:
+                    return self._upload(match.group(1), query, body)
+
+                match = object_pattern.match(url.path)
+                if not match or not match.group(3):
+                    return self._error(404, f"{url.path} not found")
+                bucket_name, name = match.group(1), unquote(match.group(2))
+                request = json.loads(body or b"{}")
+                with server.lock:
+                    server.request_counts["POST compose"] += 1
+                    sources = [server.objects.get((bucket_name, source["name"])) for source in request.get("sourceObjects", [])]
+                    if not sources or len(sources) > 32:
+                        return self._error(400, "Compose takes between 1 and 32 source objects")
+                    if any(source is None for source in sources):
+                        return self._error(404, "Compose source object not found")
+                    data = b"".join(source["data"] for source in sources)
+                    self._send(200, server._put(bucket_name, name, data, composite=True))
+
+            def _upload(self, bucket_name, query, body):
+                upload_type = query.get("uploadType", [""])[0]
+                with server.lock:
+                    server.request_counts["POST upload"] += 1
+                    if not server._take_budget("upload_budget"):
+                        return self._error(403, "Upload budget exhausted")
+
+                if upload_type == "multipart":
+                    metadata, data = self._multipart_parts(body)
+                    with server.lock:
+                        return self._send(200, server._put(bucket_name, metadata["name"], data,
+                                                           content_type=metadata.get("contentType") or "application/octet-stream"))
+                if upload_type == "media":
+                    with server.lock:
+                        return self._send(200, server._put(bucket_name, query["name"][0], body))
+                if upload_type == "resumable":
+                    metadata = json.loads(body or b"{}")
+                    upload_id = uuid.uuid4().hex
+                    with server.lock:
+                        server.uploads[upload_id] = {"bucket": bucket_name, "name": metadata.get("name") or query["name"][0],
+                                                     "data": bytearray()}
+                    location = f"{server.url}/upload/storage/v1/b/{bucket_name}/o?uploadType=resumable&upload_id={upload_id}"
+                    return self._send(200, headers={"Location": location})
+                self._error(400, f"Unsupported uploadType {upload_type}")
+
+            def _multipart_parts(self, body):
+                boundary = self.headers.get("Content-Type").split("boundary=", 1)[1].strip('"').encode("utf-8")
+                parts = []
+                for part in body.split(b"--" + boundary)[1:-1]:
+                    _, _, content = part.partition(b"\r\n\r\n")
+                    parts.append(content[:-2])
+                return json.loads(parts[0]), parts[1]
+
+            def do_PUT(self):
+                url = urlsplit(self.path)
+                query = parse_qs(url.query)
+                body = self._body()
+                upload_id = query.get("upload_id", [""])[0]
+                with server.lock:
+                    server.request_counts["PUT upload"] += 1
+                    upload = server.uploads.get(upload_id)
+                    if upload is None:
+                        return self._error(404, "No such upload")
+                    # Content-Range is bytes start-end/total, or bytes */total on the last empty request
+                    content_range = self.headers.get("Content-Range", "")
+                    total = content_range.rsplit("/", 1)[-1]
+                    if not content_range.startswith("bytes */"):
+                        start = int(content_range[len("bytes "):].split("-", 1)[0])
+                        del upload["data"][start:]
+                        upload["data"].extend(body)
+                    if total != "*" and len(upload["data"]) >= int(total):
+                        del server.uploads[upload_id]
+                        return self._send(200, server._put(upload["bucket"], upload["name"], bytes(upload["data"])))
+                    headers = {"Range": f"bytes=0-{len(upload['data']) - 1}"} if upload["data"] else {}
+                    self._send(308, headers=headers)
+
+            def do_DELETE(self):
+                url = urlsplit(self.path)
+                match = object_pattern.match(url.path)
+                if not match or match.group(3):
+                    return self._error(404, f"{url.path} not found")
+                bucket_name, name = match.group(1), unquote(match.group(2))
+                with server.lock:
+                    server.request_counts["DELETE object"] += 1
+                    if server._lookup(bucket_name, name, parse_qs(url.query)) is None:
+                        return self._error(404, f"No such object: {bucket_name}/{name}")
+                    del server.objects[(bucket_name, name)]
+                    self._send(204)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="fake-gcs-server", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a fake GCS JSON API for local runs and tests")
+    parser.add_argument("--port", type=int, default=4443)
+    args = parser.parse_args()
+
+    server = FakeGcsServer(port=args.port)
+    print(f"Fake GCS server on {server.url}, export STORAGE_EMULATOR_HOST={server.url}")
+    server.httpd.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
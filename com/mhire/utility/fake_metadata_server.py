@@ -0,0 +1,173 @@
+import argparse
+import base64
+import hashlib
+import json
+import re
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+instance_pattern = re.compile(r"^/compute/v1/projects/([^/]+)/zones/([^/]+)/instances/([^/]+)(/setMetadata)?$")
+
+
+class FakeMetadataServer:
+    """Local stand-in for the GCE metadata server and the Compute API instance metadata calls.
+
+    Point MetadataHelper at it with metadata_url=f"{url}/computeMetadata/v1" and
+    compute_url=f"{url}/compute/v1", or set GCE_METADATA_HOST and COMPUTE_API_URL.
+    request_counts records how many calls each endpoint received.
+    """
+
+    def __init__(self, attributes=None, project_id="fake-project", zone="us-central1-a", instance_name="fake-instance",
+                 host="127.0.0.1", port=0):
+        self.project_id = project_id
+        self.zone = zone
+        self.instance_name = instance_name
+        self.attributes = dict(attributes or {})
+        self.version = 0
+        self.lock = threading.Lock()
+        self.request_counts = Counter()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def fingerprint(self):
+        digest = hashlib.sha256(f"{self.version}:{json.dumps(self.attributes, sort_keys=True)}".encode("utf-8"))
+        return base64.b64encode(digest.digest()[:8]).decode("ascii")
+
+    def set_attribute(self, key, value):
+        """Changes an attribute as another writer would, invalidating outstanding fingerprints."""
+        with self.lock:
+            self.attributes[key] = value
+            self.version += 1
+
+    def metadata_tree(self):
+        return {
+            "project": {"projectId": self.project_id, "numericProjectId": 123456789},
+            "instance": {
+                "name": self.instance_name,
+                "zone": f"projects/123456789/zones/{self.zone}",
+                "attributes": dict(self.attributes),
+                "serviceAccounts": {"default": {"email": "fake@fake-project.iam.gserviceaccount.com"}},
+            },
+        }
+
+    def _metadata_value(self, path):
+        # Walks the tree like the real server: /instance/attributes/<key>, /project/project-id, ...
+        tree = self.metadata_tree()
+        aliases = {"project-id": "projectId", "numeric-project-id": "numericProjectId", "service-accounts": "serviceAccounts"}
+        value = tree
+        for part in [part for part in path.split("/") if part]:
+            part = aliases.get(part, part)
+            if not isinstance(value, dict) or part not in value:
+                return None
+            value = value[part]
+        return value
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send(self, status, body, content_type="application/json"):
+                data = body if isinstance(body, bytes) else (
+                    json.dumps(body) if content_type == "application/json" else str(body)).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _error(self, status, message):
+                self._send(status, {"error": {"code": status, "message": message}})
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                with server.lock:
+                    if url.path.startswith("/computeMetadata/v1"):
+                        server.request_counts[f"GET {url.path}"] += 1
+                        if self.headers.get("Metadata-Flavor") != "Google":
+                            return self._error(403, "Missing Metadata-Flavor:Google header")
+                        path = url.path[len("/computeMetadata/v1"):]
+                        if path.rstrip("/") == "/instance/service-accounts/default/token":
+                            return self._send(200, {"access_token": "fake-token", "expires_in": 3599, "token_type": "Bearer"})
+                        value = server._metadata_value(path)
+                        if value is None:
+                            return self._error(404, f"{path} not found")
+                        if isinstance(value, dict) and "recursive=true" not in url.query:
+                            return self._send(200, "\n".join(f"{key}/" if isinstance(item, dict) else key
+                                                             for key, item in value.items()), "application/text")
+                        if isinstance(value, (dict, list)):
+                            return self._send(200, value)
+                        return self._send(200, value, "application/text")
+
+                    match = instance_pattern.match(url.path)
+                    if match and not match.group(4):
+                        server.request_counts["GET instance"] += 1
+                        if match.group(3) != server.instance_name:
+                            return self._error(404, f"Instance {match.group(3)} not found")
+                        items = [{"key": key, "value": value} for key, value in server.attributes.items()]
+                        return self._send(200, {"metadata": {"kind": "compute#metadata", "fingerprint": server.fingerprint(),
+                                                             "items": items}})
+                self._error(404, f"{url.path} not found")
+
+            def do_POST(self):
+                url = urlsplit(self.path)
+                match = instance_pattern.match(url.path)
+                if not match or not match.group(4):
+                    return self._error(404, f"{url.path} not found")
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                with server.lock:
+                    server.request_counts["POST setMetadata"] += 1
+                    if self.headers.get("Authorization") is None:
+                        return self._error(401, "Missing access token")
+                    # Same optimistic locking as the Compute API
+                    if body.get("fingerprint") != server.fingerprint():
+                        return self._error(412, "Supplied fingerprint does not match current metadata fingerprint.")
+                    server.attributes = {item["key"]: item["value"] for item in body.get("items", [])}
+                    server.version += 1
+                    return self._send(200, {"kind": "compute#operation", "operationType": "setMetadata", "status": "DONE"})
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="fake-metadata-server", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve fake GCE metadata for local runs and tests")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--attributes", default=None, help="JSON file of instance metadata attributes")
+    args = parser.parse_args()
+
+    attributes = {}
+    if args.attributes:
+        with open(args.attributes, "r", encoding="utf-8") as f:
+            attributes = json.load(f)
+    server = FakeMetadataServer(attributes, port=args.port)
+    print(f"Fake metadata server on {server.url}, export GCE_METADATA_HOST={server.url[len('http://'):]} "
+          f"COMPUTE_API_URL={server.url}/compute/v1")
+    server.httpd.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,25 @@
 import os
 import logging
-from google.cloud import storage
 from google.oauth2 import service_account
 from com.mhire.utility.zip_util import ZipUtil 
+from com.mhire.utility.transfer_util import TransferUtil, pooled_storage_client
 from com.mhire.utility.util import log, log_error
 
 logging.getLogger('google.cloud').setLevel(logging.DEBUG)
 
 class GCPUtil:
-    def __init__(self, service_account_key_path=None):
+    def __init__(self, service_account_key_path=None, artifact_cache=None):
         if service_account_key_path:
             # Use the provided service account key file
             credentials = service_account.Credentials.from_service_account_file(service_account_key_path)
-            self.storage_client = storage.Client(credentials=credentials)
+            self.storage_client = pooled_storage_client(credentials)
         else:
             # Default to ADC if no key file is provided
-            self.storage_client = storage.Client()
+            self.storage_client = pooled_storage_client()
         self.zip_util = ZipUtil()
+        self.transfer_util = TransferUtil(self.storage_client)
+        # Optional ArtifactCache that keeps downloads across jobs on the same VM
+        self.artifact_cache = artifact_cache
 
     def upload_file_to_gcs(self, local_upload_path, gsutil_url):
         """Uploads a file to Google Cloud Storage at a specified path."""
@@ -44,34 +47,23 @@ class GCPUtil:
             if blob_path.endswith('/'):
                 blob_path = os.path.join(blob_path, os.path.basename(local_upload_path))
 
-            # Get the GCS bucket and blob (file in GCS)
-            bucket = self.storage_client.bucket(bucket_name)
-            blob = bucket.blob(blob_path)
-
-            # Perform the file upload
+            # Perform the file upload, verified by checksum instead of an extra exists() probe
             log(f"Uploading {local_upload_path} to {gsutil_url}")
-            blob.upload_from_filename(local_upload_path)
-
-            # Check if the upload succeeded by verifying if the blob exists
-            if blob.exists():
-                log(f"File {local_upload_path} successfully uploaded to {gsutil_url}")
-            else:
-                log_error(f"File {local_upload_path} was uploaded but does not appear in GCS at {gsutil_url}")
+            self.transfer_util.upload(local_upload_path, bucket_name, blob_path)
+            log(f"File {local_upload_path} successfully uploaded to {gsutil_url}")
         except Exception as e:
             # Log the specific error and raise the exception
             log_error(f"Error during file upload to GCS: {str(e)}")
             raise
 
 
-    def download_from_gcs(self, gsutil_url, local_download_path):
+    def download_from_gcs(self, gsutil_url, local_download_path, stream_extract=True, on_extracted=None):
         """Downloads a file from Google Cloud Storage."""
         logging.info(f"Downloading file from: {gsutil_url} to {local_download_path}")
         try:
             if gsutil_url.startswith("gs://"):
                 gs_path = gsutil_url[5:]
                 bucket_name, blob_path = gs_path.split("/", 1)
-                bucket = self.storage_client.bucket(bucket_name)
-                blob = bucket.blob(blob_path)
 
                 # Check if local_download_path is a directory
                 if os.path.isdir(local_download_path):
@@ -81,18 +73,47 @@ class GCPUtil:
                 # Ensure the directory for the file exists
                 os.makedirs(os.path.dirname(local_download_path), exist_ok=True)
 
-                # Download the file
-                with open(local_download_path, "wb") as file:
-                    blob.download_to_file(file)
-
-                log(f"File downloaded to: {local_download_path}")
-
-                # If the downloaded file is a zip file, extract it
-                if local_download_path.endswith('.zip'):
-                    extract_to_path = os.path.dirname(local_download_path)
-                    self.zip_util.unzip_file(local_download_path, extract_to_path)
+                # Serve the object from the local artifact cache, filling it on a miss
+                if self.artifact_cache:
+                    blob = self.storage_client.bucket(bucket_name).get_blob(blob_path)
+                    if blob is None:
+                        raise FileNotFoundError(f"{gsutil_url} does not exist")
+                    key = self.artifact_cache.cache_key(blob)
+                    if not self.artifact_cache.has(key):
+                        log(f"Artifact cache miss for {gsutil_url}")
+                        self.artifact_cache.populate(key, gsutil_url, lambda files_dir: self._download_to(
+                            bucket_name, blob_path, os.path.join(files_dir, os.path.basename(blob_path)),
+                            stream_extract, keep_archive=False))
+                    for file_path in self.artifact_cache.materialize(key, os.path.dirname(local_download_path)):
+                        if on_extracted:
+                            on_extracted(file_path)
+                    return
+
+                self._download_to(bucket_name, blob_path, local_download_path, stream_extract, on_extracted)
             else:
                 log_error("Invalid gs:// URL.")
         except Exception as e:
             log_error(f"Error downloading file from GCS: {e}")
-            raise
\ No newline at end of file
+            raise
+
+    def _download_to(self, bucket_name, blob_path, local_download_path, stream_extract, on_extracted=None, keep_archive=True):
+        """Downloads one object to local_download_path, extracting zip archives next to it."""
+        # Extract zip members straight from GCS so the archive never lands on disk
+        if stream_extract and local_download_path.endswith('.zip'):
+            fetch_range, size = self.transfer_util.range_fetcher(bucket_name, blob_path)
+            self.zip_util.extract_remote(fetch_range, size, os.path.dirname(local_download_path),
+                                         max_workers=self.transfer_util.max_workers, on_extracted=on_extracted)
+            log(f"File streamed and extracted to: {os.path.dirname(local_download_path)}")
+            return
+
+        # Download the file in parallel byte ranges, resuming any interrupted attempt
+        self.transfer_util.download(bucket_name, blob_path, local_download_path)
+
+        log(f"File downloaded to: {local_download_path}")
+
+        # If the downloaded file is a zip file, extract it
+        if local_download_path.endswith('.zip'):
+            extract_to_path = os.path.dirname(local_download_path)
+            self.zip_util.unzip_file(local_download_path, extract_to_path)
+            if not keep_archive:
+                os.remove(local_download_path)
@@ -0,0 +1,247 @@
+import atexit
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from com.mhire.utility.cache_util import cache_root
+
+default_flush_interval = 1.0
+default_upload_interval = 60
+default_upload_state_dir = os.path.join(cache_root, "log-uploads")
+
+
+class StructuredLogger:
+    """JSON-lines logger whose callers only append to an in-memory buffer.
+
+    A background thread formats the buffered records, appends them to the log file
+    through one open handle and echoes them to stdout, once per flush interval or
+    as soon as an error is logged.
+    """
+
+    def __init__(self, path, flush_interval=default_flush_interval):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.buffer = deque()
+        self.wake = threading.Event()
+        self.stopping = False
+        self.thread = None
+        self.uploader = None
+        self.start_lock = threading.Lock()
+        atexit.register(self.close)
+
+    def log(self, level, message, fields=None):
+        # deque.append is atomic, formatting and I/O happen on the writer thread
+        self.buffer.append((time.time(), level, message, threading.current_thread().name, fields))
+        if self.thread is None:
+            self._start()
+        if level == "ERROR":
+            self.wake.set()
+
+    def _start(self):
+        with self.start_lock:
+            if self.thread is None and not self.stopping:
+                self.thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            self._drain()
+            if self.stopping and not self.buffer:
+                return
+
+    def _drain(self):
+        records, waiters = [], []
+        while True:
+            try:
+                item = self.buffer.popleft()
+            except IndexError:
+                break
+            # flush() enqueues an Event that is set once everything before it is written
+            if isinstance(item, threading.Event):
+                waiters.append(item)
+            else:
+                records.append(item)
+        if records:
+            self._write(records)
+        for waiter in waiters:
+            waiter.set()
+
+    def _write(self, records):
+        lines, console = [], []
+        for created, level, message, thread, fields in records:
+            timestamp = datetime.fromtimestamp(created)
+            record = {"ts": timestamp.isoformat(timespec="milliseconds"), "level": level, "thread": thread,
+                      "msg": message}
+            if fields:
+                record.update(fields)
+            lines.append(json.dumps(record, default=str) + "\n")
+            prefix = "ERROR: " if level == "ERROR" else ""
+            console.append(f"{timestamp.strftime('%H:%M:%S')} {prefix}{message}\n")
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # Reopened per batch, not per record, so a renamed or cleared file is recreated
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("".join(lines))
+        except OSError as e:
+            console.append(f"Could not write log file {self.path}: {e}\n")
+        sys.stdout.write("".join(console))
+        sys.stdout.flush()
+
+    def flush(self, timeout=10):
+        """Blocks until every record logged so far is in the log file."""
+        if self.thread is None or not self.thread.is_alive():
+            return
+        done = threading.Event()
+        self.buffer.append(done)
+        self.wake.set()
+        done.wait(timeout)
+
+    def start_upload(self, storage_client, gsutil_url, interval=default_upload_interval):
+        """Starts appending new log lines to gsutil_url every interval seconds."""
+        self.uploader = LogUploader(self, storage_client, gsutil_url, interval)
+        self.uploader.start()
+        return self.uploader
+
+    def stop_upload(self):
+        """Makes a last upload of the log and stops uploading."""
+        if self.uploader:
+            self.uploader.stop()
+            self.uploader = None
+
+    def redirect(self, path):
+        """Sends records logged from now on to another file, e.g. one log per batch job."""
+        self.flush()
+        self.path = path
+
+    def close(self):
+        """Writes out the buffer, stops the writer and makes a last upload."""
+        self.flush()
+        self.stop_upload()
+        self.stopping = True
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join(timeout=10)
+            self.thread = None
+        self.stopping = False
+
+
+class LogUploader:
+    """Uploads the log file to a GCS object incrementally.
+
+    GCS objects are immutable, so each round uploads only the bytes written since
+    the last one and composes them onto the end of the existing object. The
+    uploaded offset is saved per local log file under state_dir: a restarted
+    process resumes where it stopped, and a new run's log, e.g. from a fresh
+    container, is appended to the object from its first line instead of
+    replacing the log of the run before it.
+    """
+
+    def __init__(self, logger, storage_client, gsutil_url, interval=default_upload_interval,
+                 state_dir=default_upload_state_dir):
+        if not gsutil_url.startswith("gs://") or "/" not in gsutil_url[5:]:
+            raise ValueError(f"Invalid GCS URL {gsutil_url}, expected gs://<bucket-name>/<object-path>")
+        bucket_name, blob_path = gsutil_url[5:].split("/", 1)
+        if blob_path.endswith("/"):
+            blob_path = os.path.join(blob_path, os.path.basename(logger.path))
+        self.logger = logger
+        # Fixed at start, the logger may be redirected to another file later
+        self.path = logger.path
+        self.bucket = storage_client.bucket(bucket_name)
+        self.blob_path = blob_path
+        self.interval = interval
+        self.state_path = os.path.join(state_dir, bucket_name, f"{blob_path}.json")
+        self.offset = None
+        self.head = None
+        self.remote_exists = False
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="log-uploader", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.upload()
+
+    def _read_head(self):
+        # The first line carries the run's first timestamp, so it tells one local log from another
+        with open(self.path, "rb") as f:
+            line = f.readline(64 * 1024)
+        return hashlib.sha256(line).hexdigest() if line.endswith(b"\n") else None
+
+    def _resume_offset(self, local_size):
+        self.remote_exists = self.bucket.get_blob(self.blob_path) is not None
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        if self.remote_exists and state.get("head") == self.head and state.get("offset", 0) <= local_size:
+            return state.get("offset", 0)
+        # Another file, its lines go after whatever earlier runs uploaded
+        return 0
+
+    def _save_state(self):
+        try:
+            os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+            temp_path = f"{self.state_path}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"path": self.path, "head": self.head, "offset": self.offset}, f)
+            os.replace(temp_path, self.state_path)
+        except OSError:
+            # Only costs a resume, the next run appends its whole log instead
+            pass
+
+    def upload(self):
+        """Uploads the complete lines written since the last upload, returning the bytes sent."""
+        with self.lock:
+            try:
+                if not os.path.exists(self.path):
+                    return 0
+                size = os.path.getsize(self.path)
+                if self.offset is None or self.offset > size:
+                    self.head = self._read_head()
+                    if self.head is None:
+                        return 0
+                    self.offset = self._resume_offset(size)
+                with open(self.path, "rb") as f:
+                    f.seek(self.offset)
+                    data = f.read(size - self.offset)
+                # Only send whole lines so the object is always valid JSON lines
+                data = data[:data.rfind(b"\n") + 1]
+                if not data:
+                    return 0
+
+                blob = self.bucket.blob(self.blob_path)
+                if not self.remote_exists:
+                    blob.upload_from_string(data, content_type="application/x-ndjson")
+                else:
+                    part = self.bucket.blob(f"{self.blob_path}.part")
+                    part.upload_from_string(data, content_type="application/x-ndjson")
+                    blob.content_type = "application/x-ndjson"
+                    blob.compose([blob, part])
+                    part.delete()
+                self.remote_exists = True
+                self.offset += len(data)
+                self._save_state()
+                return len(data)
+            except Exception as e:
+                # Keep the job running, the next round retries from the same offset
+                self.logger.log("ERROR", f"Log upload to gs://{self.bucket.name}/{self.blob_path} failed: {e}")
+                return 0
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout=self.interval)
+        self.logger.flush()
+        self.upload()
@@ -1,59 +1,189 @@
 import logging
-from googleapiclient import discovery
-from googleapiclient.errors import HttpError
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# GCE_METADATA_HOST is also honoured by google-auth, it points everything at a local fake server
+metadata_host = os.environ.get("GCE_METADATA_HOST", "metadata.google.internal")
+compute_api_url = os.environ.get("COMPUTE_API_URL", "https://compute.googleapis.com/compute/v1")
+metadata_headers = {"Metadata-Flavor": "Google"}
+default_ttl = 30
+default_max_retries = 5
+
+
+class MetadataConflict(Exception):
+    """setMetadata was rejected because the metadata changed since it was read."""
+
 
 class MetadataHelper:
-    def __init__(self, project_id, zone, instance_name):
-        self.compute = discovery.build('compute', 'v1')
-        self.project_id = project_id
-        self.zone = zone
-        self.instance_name = instance_name
+    """Reads and writes this VM's instance metadata over one pooled HTTP session.
+
+    Reads come from the metadata server in one recursive request and are cached
+    for ttl seconds. Writes go to the Compute API: every pending key is merged into
+    a single setMetadata call guarded by the metadata fingerprint, and a call that
+    loses a race with another writer is retried on fresh metadata.
+    """
+
+    def __init__(self, project_id=None, zone=None, instance_name=None, ttl=default_ttl,
+                 metadata_url=None, compute_url=compute_api_url, max_retries=default_max_retries):
+        self.metadata_url = metadata_url or f"http://{metadata_host}/computeMetadata/v1"
+        self.compute_url = compute_url
+        self.ttl = ttl
+        self.max_retries = max_retries
+
+        # One keep-alive pool for the metadata server and the Compute API, retrying transient errors
+        self.session = requests.Session()
+        retry = Retry(total=3, backoff_factor=0.2, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=("GET",))
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=8, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.lock = threading.Lock()
+        self.cache = None
+        self.cache_time = 0
+        self.token = None
+        self.token_expiry = 0
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.deferring = 0
+
+        self._project_id, self._zone, self._instance_name = project_id, zone, instance_name
+
+    def _read_server(self, force=False):
+        """Returns the project and instance metadata trees, fetched at most once per ttl."""
+        with self.lock:
+            if force or self.cache is None or time.monotonic() - self.cache_time > self.ttl:
+                response = self.session.get(f"{self.metadata_url}/", params={"recursive": "true"},
+                                            headers=metadata_headers, timeout=10)
+                response.raise_for_status()
+                self.cache = response.json()
+                self.cache_time = time.monotonic()
+            return self.cache
+
+    @property
+    def project_id(self):
+        if self._project_id is None:
+            self._project_id = self._read_server()["project"]["projectId"]
+        return self._project_id
+
+    @property
+    def zone(self):
+        if self._zone is None:
+            # The server reports projects/<number>/zones/<zone>
+            self._zone = self._read_server()["instance"]["zone"].split("/")[-1]
+        return self._zone
+
+    @property
+    def instance_name(self):
+        if self._instance_name is None:
+            self._instance_name = self._read_server()["instance"]["name"]
+        return self._instance_name
+
+    def _access_token(self):
+        with self.lock:
+            if self.token is None or time.monotonic() > self.token_expiry:
+                response = self.session.get(f"{self.metadata_url}/instance/service-accounts/default/token",
+                                            headers=metadata_headers, timeout=10)
+                response.raise_for_status()
+                token = response.json()
+                self.token = token["access_token"]
+                # Refresh a minute early so a request never carries an expired token
+                self.token_expiry = time.monotonic() + int(token.get("expires_in", 0)) - 60
+            return self.token
+
+    def _instance_url(self):
+        return f"{self.compute_url}/projects/{self.project_id}/zones/{self.zone}/instances/{self.instance_name}"
 
     def get_instance_info(self):
-        """Fetches existing instance metadata."""
+        """Fetches the instance metadata block (fingerprint and items) from the Compute API."""
         try:
-            return self.compute.instances().get(
-                project=self.project_id,
-                zone=self.zone,
-                instance=self.instance_name
-            ).execute()
-        except HttpError as e:
+            response = self.session.get(self._instance_url(), params={"fields": "metadata"},
+                                        headers={"Authorization": f"Bearer {self._access_token()}"}, timeout=30)
+            response.raise_for_status()
+            return response.json()
+        except requests.RequestException as e:
             logging.error(f"Error fetching instance information: {e}")
             raise
 
-    def read_all_metadata(self):
-        """Fetches all instance metadata as a dictionary."""
+    def read_all_metadata(self, force=False):
+        """Fetches all instance metadata attributes as a dictionary."""
         try:
-            instance_metadata = self.get_instance_info()
-            metadata_items = instance_metadata['metadata'].get('items', [])
-            return {item['key']: item['value'] for item in metadata_items}
-        except HttpError as e:
+            return dict(self._read_server(force)["instance"].get("attributes", {}))
+        except requests.RequestException as e:
             logging.error(f"Error fetching instance metadata: {e}")
             raise
 
+    def get(self, key, default=None):
+        return self.read_all_metadata().get(key, default)
+
+    def _set_metadata(self, updates):
+        for attempt in range(1, self.max_retries + 1):
+            metadata = self.get_instance_info()["metadata"]
+            items = {item["key"]: item["value"] for item in metadata.get("items", [])}
+            items.update(updates)
+            response = self.session.post(
+                f"{self._instance_url()}/setMetadata",
+                json={"fingerprint": metadata["fingerprint"],
+                      "items": [{"key": key, "value": value} for key, value in items.items()]},
+                headers={"Authorization": f"Bearer {self._access_token()}"}, timeout=30)
+            # 412 means another writer changed the metadata after we read its fingerprint
+            if response.status_code == 412:
+                logging.info(f"Metadata fingerprint changed, retrying setMetadata (attempt {attempt})")
+                time.sleep(0.1 * attempt)
+                continue
+            response.raise_for_status()
+            # Our own write makes the cached attributes stale
+            with self.lock:
+                self.cache = None
+            return response.json()
+        raise MetadataConflict(f"setMetadata lost {self.max_retries} races for keys {list(updates)}")
+
+    def update_many(self, updates):
+        """Writes several metadata keys in one setMetadata call."""
+        with self.pending_lock:
+            self.pending.update(updates)
+            if self.deferring:
+                return None
+        return self.flush()
+
     def update_metadata(self, key, value):
         """Updates a specific metadata key."""
+        return self.update_many({key: value})
+
+    def flush(self):
+        """Writes every pending key. Updates queued while another write runs share the next call."""
+        with self.write_lock:
+            with self.pending_lock:
+                updates, self.pending = self.pending, {}
+            # An earlier writer already sent our keys along with its own
+            if not updates:
+                return None
+            try:
+                return self._set_metadata(updates)
+            except (requests.RequestException, MetadataConflict) as e:
+                logging.error(f"Error updating instance metadata: {e}")
+                # Hand the keys to the next writer, without overriding newer values
+                with self.pending_lock:
+                    self.pending = {**updates, **self.pending}
+                raise
+
+    @contextmanager
+    def deferred(self):
+        """Collects every update made in the block into one setMetadata call on exit."""
+        with self.pending_lock:
+            self.deferring += 1
         try:
-            instance_metadata = self.get_instance_info()
-            fingerprint = instance_metadata['metadata']['fingerprint']
-            metadata_items = instance_metadata['metadata'].get('items', [])
-            
-            updated = False
-            for item in metadata_items:
-                if item['key'] == key:
-                    item['value'] = value
-                    updated = True
-                    break
-            if not updated:
-                metadata_items.append({'key': key, 'value': value})
-
-            metadata = {"fingerprint": fingerprint, "items": metadata_items}
-            return self.compute.instances().setMetadata(
-                project=self.project_id,
-                zone=self.zone,
-                instance=self.instance_name,
-                body=metadata
-            ).execute()
-        except HttpError as e:
-            logging.error(f"Error updating instance metadata: {e}")
-            raise
\ No newline at end of file
+            yield self
+        finally:
+            with self.pending_lock:
+                self.deferring -= 1
+                flush = self.deferring == 0 and bool(self.pending)
+            if flush:
+                self.flush()
@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+
+from com.mhire.utility.util import sha256_file
+
+# Media types Ollama uses for the layers of a model manifest
+model_media_type = "application/vnd.ollama.image.model"
+template_media_type = "application/vnd.ollama.image.template"
+system_media_type = "application/vnd.ollama.image.system"
+params_media_type = "application/vnd.ollama.image.params"
+config_media_type = "application/vnd.docker.container.image.v1+json"
+manifest_media_type = "application/vnd.docker.distribution.manifest.v2+json"
+
+
+# Function to parse the FROM, PARAMETER, TEMPLATE and SYSTEM directives of a Modelfile
+def parse_modelfile(modelfile_path):
+    with open(modelfile_path, "r", encoding="utf-8") as f:
+        text = f.read()
+
+    modelfile = {"from": None, "parameters": {}, "template": None, "system": None}
+    pattern = re.compile(r'^(FROM|PARAMETER|TEMPLATE|SYSTEM)[ \t]+(?:"""([\s\S]*?)"""|([^\n]*))', re.MULTILINE)
+    for match in pattern.finditer(text):
+        command, quoted, raw = match.group(1), match.group(2), match.group(3)
+        value = quoted if quoted is not None else raw.strip().strip('"')
+        if command == "FROM":
+            modelfile["from"] = value
+        elif command == "TEMPLATE":
+            modelfile["template"] = value
+        elif command == "SYSTEM":
+            modelfile["system"] = value
+        else:
+            name, _, param = value.partition(" ")
+            param = param.strip().strip('"')
+            try:
+                param = json.loads(param) if not param.startswith("<") else param
+            except ValueError:
+                pass
+            # stop may be given several times and is always a list
+            if name == "stop":
+                modelfile["parameters"].setdefault(name, []).append(param)
+            else:
+                modelfile["parameters"][name] = param
+    return modelfile
+
+
+class OllamaModelStore:
+    """Writes a model into Ollama's on-disk, content-addressed store layout.
+
+    The result is what `ollama create` would produce, so an image only needs a single
+    COPY of the store instead of running ollama at build time.
+    """
+
+    def __init__(self, models_dir):
+        self.models_dir = models_dir
+        self.blobs_dir = os.path.join(models_dir, "blobs")
+
+    def _blob_path(self, digest):
+        return os.path.join(self.blobs_dir, digest.replace(":", "-"))
+
+    def _add_bytes(self, data, media_type):
+        digest = f"sha256:{hashlib.sha256(data).hexdigest()}"
+        with open(self._blob_path(digest), "wb") as f:
+            f.write(data)
+        return {"mediaType": media_type, "digest": digest, "size": len(data)}
+
+    def _add_file(self, file_path, media_type, digest=None):
+        digest = digest or f"sha256:{sha256_file(file_path)}"
+        blob_path = self._blob_path(digest)
+        if not os.path.exists(blob_path):
+            # Hardlink the multi-GB GGUF instead of copying it when on the same filesystem
+            try:
+                os.link(file_path, blob_path)
+            except OSError:
+                shutil.copyfile(file_path, blob_path)
+        return {"mediaType": media_type, "digest": digest, "size": os.path.getsize(file_path)}
+
+    def write(self, gguf_path, modelfile, model_name="model", tag="latest", gguf_digest=None):
+        """Writes blobs and manifest for model_name:tag from a parsed Modelfile and returns the manifest."""
+        os.makedirs(self.blobs_dir, exist_ok=True)
+
+        layers = [self._add_file(gguf_path, model_media_type, gguf_digest)]
+        if modelfile["template"]:
+            layers.append(self._add_bytes(modelfile["template"].encode("utf-8"), template_media_type))
+        if modelfile["system"]:
+            layers.append(self._add_bytes(modelfile["system"].encode("utf-8"), system_media_type))
+        if modelfile["parameters"]:
+            layers.append(self._add_bytes(json.dumps(modelfile["parameters"]).encode("utf-8"), params_media_type))
+
+        config = {
+            "model_format": "gguf",
+            "architecture": "amd64",
+            "os": "linux",
+            "rootfs": {"type": "layers", "diff_ids": [layer["digest"] for layer in layers]},
+        }
+        config_layer = self._add_bytes(json.dumps(config).encode("utf-8"), config_media_type)
+
+        manifest = {
+            "schemaVersion": 2,
+            "mediaType": manifest_media_type,
+            "config": config_layer,
+            "layers": layers,
+        }
+        manifest_dir = os.path.join(self.models_dir, "manifests", "registry.ollama.ai", "library", model_name)
+        os.makedirs(manifest_dir, exist_ok=True)
+        with open(os.path.join(manifest_dir, tag), "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        return manifest
@@ -0,0 +1,121 @@
+import json
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from com.mhire.utility.util import log, log_error
+
+
+class Stage:
+    """A named unit of pipeline work with dependencies, outputs and a retry policy."""
+
+    def __init__(self, name, func, deps=(), outputs=(), retries=0, retry_delay=10):
+        # func(results) receives the results of finished stages by name
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        # Paths this stage produces; if they exist after a crash the stage is skipped
+        self.outputs = list(outputs)
+        self.retries = retries
+        self.retry_delay = retry_delay
+
+
+class Pipeline:
+    """Runs stages as soon as their dependencies finish, recording progress for resume."""
+
+    def __init__(self, state_path, max_workers=4):
+        self.state_path = os.path.abspath(state_path)
+        self.max_workers = max_workers
+        self.stages = {}
+        self.lock = threading.Lock()
+        self.state = {"stages": {}}
+        if os.path.isfile(state_path):
+            with open(state_path, "r", encoding="utf-8") as f:
+                self.state = json.load(f)
+
+    def add(self, stage):
+        for dep in stage.deps:
+            if dep not in self.stages:
+                raise ValueError(f"Stage {stage.name} depends on unknown stage {dep}")
+        self.stages[stage.name] = stage
+        return stage
+
+    # Whether an earlier attempt of this run finished any stage
+    def has_progress(self):
+        return any(record.get("status") == "done" for record in self.state["stages"].values())
+
+    def _save_state(self):
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, indent=2, default=str)
+        os.replace(tmp_path, self.state_path)
+
+    def _record(self, name, **fields):
+        with self.lock:
+            self.state["stages"].setdefault(name, {}).update(fields)
+            self._save_state()
+
+    def _can_skip(self, stage):
+        record = self.state["stages"].get(stage.name, {})
+        # A stage returning a path, like a timestamped output dir, declares it as its output
+        outputs = stage.outputs or ([record["result"]] if isinstance(record.get("result"), str) else [])
+        return (record.get("status") == "done" and bool(outputs)
+                and all(os.path.exists(path) for path in outputs))
+
+    def _run_stage(self, stage, results):
+        if self._can_skip(stage):
+            log(f"Stage {stage.name}: outputs present, skipping")
+            return self.state["stages"][stage.name].get("result")
+
+        for attempt in range(1, stage.retries + 2):
+            start = time.time()
+            self._record(stage.name, status="running", attempt=attempt, start=start, end=None)
+            log(f"Stage {stage.name} started (attempt {attempt})")
+            try:
+                result = stage.func(results)
+            except Exception as e:
+                self._record(stage.name, status="failed", end=time.time(), error=str(e))
+                log_error(f"Stage {stage.name} failed on attempt {attempt}: {traceback.format_exc()}")
+                if attempt > stage.retries:
+                    raise
+                time.sleep(stage.retry_delay * attempt)
+                continue
+            end = time.time()
+            self._record(stage.name, status="done", end=end, duration=round(end - start, 3), result=result)
+            log(f"Stage {stage.name} finished in {end - start:.1f}s")
+            return result
+
+    def run(self):
+        """Runs every stage, starting independent ones concurrently, and returns their results."""
+        results, futures = {}, {}
+        pending = dict(self.stages)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or futures:
+                for name, stage in list(pending.items()):
+                    if all(dep in results for dep in stage.deps):
+                        futures[executor.submit(self._run_stage, stage, dict(results))] = name
+                        del pending[name]
+                if not futures:
+                    raise RuntimeError(f"Stages {list(pending)} can never run")
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = futures.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        # Let running stages finish but start nothing new
+                        for other in futures:
+                            other.cancel()
+                        self.log_summary()
+                        raise error
+                    results[name] = future.result()
+
+        self.log_summary()
+        return results
+
+    def log_summary(self):
+        for name, record in self.state["stages"].items():
+            log(f"Stage {name}: {record.get('status')} in {record.get('duration', '-')}s "
+                f"(attempt {record.get('attempt', '-')})")
@@ -0,0 +1,228 @@
+import base64
+import hashlib
+import json
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import google.auth
+import google_crc32c
+from google.auth.credentials import with_scopes_if_required
+from google.auth.transport.requests import AuthorizedSession
+from google.cloud import storage
+from requests.adapters import HTTPAdapter
+from com.mhire.utility.util import log, log_error
+
+default_chunk_size = 64 * 1024 * 1024
+default_max_workers = 16
+# GCS compose accepts at most 32 source objects per call
+max_compose_sources = 32
+
+
+# Function to compute base64 crc32c and md5 of a local file, as GCS reports them
+def file_checksums(file_path, chunk_size=8 * 1024 * 1024):
+    crc = google_crc32c.Checksum()
+    md5 = hashlib.md5()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            crc.update(chunk)
+            md5.update(chunk)
+    return base64.b64encode(crc.digest()).decode("utf-8"), base64.b64encode(md5.digest()).decode("utf-8")
+
+
+# Function to split a size into (index, start, end) byte ranges, end inclusive
+def byte_ranges(size, chunk_size):
+    return [(i, start, min(start + chunk_size, size) - 1) for i, start in enumerate(range(0, size, chunk_size))]
+
+
+def pooled_storage_client(credentials=None, project=None, max_workers=default_max_workers):
+    """Builds a storage.Client whose connection pool fits max_workers parallel transfers.
+
+    Without credentials, Application Default Credentials are used. The client talks
+    to a local fake GCS server when STORAGE_EMULATOR_HOST is set.
+    """
+    if credentials is None:
+        credentials, default_project = google.auth.default(scopes=storage.Client.SCOPE)
+        project = project or default_project
+    credentials = with_scopes_if_required(credentials, storage.Client.SCOPE)
+    # Size the connection pool to the thread pool so workers never wait on a socket
+    session = AuthorizedSession(credentials)
+    adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return storage.Client(project=project or getattr(credentials, "project_id", None), credentials=credentials,
+                          _http=session)
+
+
+class TransferManifest:
+    """Local record of completed chunks so an interrupted transfer can resume."""
+
+    def __init__(self, path, identity):
+        self.path = path
+        self.identity = identity
+        self.completed = {}
+        self.lock = threading.Lock()
+        if os.path.isfile(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                # Only resume a transfer of exactly the same object and chunking
+                if data.get("identity") == identity:
+                    self.completed = data.get("completed", {})
+            except (OSError, ValueError):
+                self.completed = {}
+
+    def is_done(self, index):
+        return str(index) in self.completed
+
+    def mark_done(self, index, value=True):
+        with self.lock:
+            self.completed[str(index)] = value
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"identity": self.identity, "completed": self.completed}, f)
+            os.replace(tmp_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class TransferUtil:
+    """Parallel byte-range downloads and composite uploads.
+
+    Give it a client from pooled_storage_client() with the same max_workers, so every
+    worker gets its own keep-alive connection.
+    """
+
+    def __init__(self, storage_client, max_workers=default_max_workers, chunk_size=default_chunk_size):
+        self.storage_client = storage_client
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+
+    def range_fetcher(self, bucket_name, blob_path):
+        """Returns a (fetch_range, size) pair for reading a blob by byte ranges."""
+        bucket = self.storage_client.bucket(bucket_name)
+        blob = bucket.get_blob(blob_path)
+        if blob is None:
+            raise FileNotFoundError(f"gs://{bucket_name}/{blob_path} does not exist")
+        pinned = bucket.blob(blob_path, generation=blob.generation)
+
+        def fetch_range(start, end):
+            return pinned.download_as_bytes(client=self.storage_client, start=start, end=end,
+                                            raw_download=True, checksum=None)
+
+        return fetch_range, blob.size
+
+    def download(self, bucket_name, blob_path, local_path, verify=True):
+        """Downloads a blob in parallel byte ranges into local_path."""
+        bucket = self.storage_client.bucket(bucket_name)
+        blob = bucket.get_blob(blob_path)
+        if blob is None:
+            raise FileNotFoundError(f"gs://{bucket_name}/{blob_path} does not exist")
+
+        part_path = f"{local_path}.part"
+        identity = {"generation": blob.generation, "size": blob.size, "chunk_size": self.chunk_size}
+        manifest = TransferManifest(f"{local_path}.manifest.json", identity)
+        if not manifest.completed and os.path.exists(part_path):
+            os.remove(part_path)
+
+        # Preallocate so every worker can write its range in place
+        with open(part_path, "ab") as f:
+            f.truncate(blob.size)
+
+        # Pin the generation so a concurrent overwrite cannot mix two versions
+        pinned = bucket.blob(blob_path, generation=blob.generation)
+        ranges = [r for r in byte_ranges(blob.size, self.chunk_size) if not manifest.is_done(r[0])]
+        if manifest.completed:
+            log(f"Resuming download of {blob_path}: {len(ranges)} chunks left")
+
+        def fetch(byte_range):
+            index, start, end = byte_range
+            with open(part_path, "r+b") as f:
+                f.seek(start)
+                pinned.download_to_file(f, client=self.storage_client, start=start, end=end,
+                                        raw_download=True, checksum=None)
+            manifest.mark_done(index)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(fetch, ranges))
+
+        if verify:
+            crc32c, md5 = file_checksums(part_path)
+            if (blob.crc32c and crc32c != blob.crc32c) or (blob.md5_hash and md5 != blob.md5_hash):
+                manifest.remove()
+                os.remove(part_path)
+                raise IOError(f"Checksum mismatch downloading gs://{bucket_name}/{blob_path}")
+
+        os.replace(part_path, local_path)
+        manifest.remove()
+        return local_path
+
+    def upload(self, local_path, bucket_name, blob_path):
+        """Uploads a file as parallel parts composed into one object, verified by crc32c."""
+        bucket = self.storage_client.bucket(bucket_name)
+        size = os.path.getsize(local_path)
+        crc32c, _ = file_checksums(local_path)
+
+        # Small files go up in one request, checksummed by the upload itself
+        if size <= self.chunk_size:
+            blob = bucket.blob(blob_path)
+            blob.upload_from_filename(local_path, checksum="crc32c")
+            return blob
+
+        chunk_size = max(self.chunk_size, math.ceil(size / max_compose_sources ** 2))
+        ranges = byte_ranges(size, chunk_size)
+        identity = {"bucket": bucket_name, "blob": blob_path, "size": size, "crc32c": crc32c, "chunk_size": chunk_size}
+        manifest = TransferManifest(f"{local_path}.manifest.json", identity)
+        part_prefix = f"{blob_path}.parts/{crc32c.rstrip('=').replace('/', '_')}"
+
+        def put(byte_range):
+            index, start, end = byte_range
+            part_name = f"{part_prefix}/{index:05d}"
+            if manifest.is_done(index):
+                # Trust the manifest only if the part is still there with the same content
+                existing = bucket.get_blob(part_name)
+                if existing is not None and existing.crc32c == manifest.completed[str(index)]:
+                    return part_name
+            with open(local_path, "rb") as f:
+                f.seek(start)
+                data = f.read(end - start + 1)
+            part = bucket.blob(part_name)
+            part.upload_from_string(data, checksum="crc32c")
+            part_crc = google_crc32c.Checksum(data)
+            manifest.mark_done(index, base64.b64encode(part_crc.digest()).decode("utf-8"))
+            return part_name
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            part_names = list(executor.map(put, ranges))
+
+        # Compose in rounds of 32 until a single object remains
+        sources = [bucket.blob(name) for name in part_names]
+        intermediates = []
+        round_index = 0
+        while len(sources) > max_compose_sources:
+            composed = []
+            for i in range(0, len(sources), max_compose_sources):
+                target = bucket.blob(f"{part_prefix}/compose-{round_index}-{i // max_compose_sources:05d}")
+                target.compose(sources[i:i + max_compose_sources])
+                composed.append(target)
+            intermediates.extend(composed)
+            sources = composed
+            round_index += 1
+
+        blob = bucket.blob(blob_path)
+        blob.compose(sources)
+        blob.reload()
+
+        for name in part_names:
+            bucket.blob(name).delete()
+        for target in intermediates:
+            target.delete()
+
+        if blob.crc32c != crc32c:
+            log_error(f"Checksum mismatch after uploading {local_path} to gs://{bucket_name}/{blob_path}")
+            raise IOError(f"Checksum mismatch uploading {local_path}")
+        manifest.remove()
+        return blob
@@ -1,40 +1,37 @@
+import hashlib
 import os
 import shutil
-from datetime import datetime
+from com.mhire.utility.log_util import StructuredLogger
 
 # Function to clear storage
 def clear_storage():
     for root, dirs, files in os.walk("/llm-utility/"):
         for file in files:
-            os.remove(os.path.join(root, file))
+            # Keep the live log, it is uploaded incrementally for the whole job
+            if os.path.join(root, file) != log_file:
+                os.remove(os.path.join(root, file))
         for dir in dirs:
             shutil.rmtree(os.path.join(root, dir))
 
-# Function to ensure the log file exists
-def ensure_log_file_exists():
-    if not os.path.exists(log_file):
-        # Create the log file if it does not exist
-        os.makedirs(os.path.dirname(log_file), exist_ok=True)
-        with open(log_file, "w") as log_f:
-            log_f.write("Log File Created\n")
+# Function to hash a file in chunks, returning the hex digest
+def sha256_file(file_path, chunk_size=8 * 1024 * 1024):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-# Function to log messages with timestamps
-def log(message):
-    ensure_log_file_exists()
-    timestamp = datetime.now().strftime("%H:%M:%S")
-    with open(log_file, "a") as log_f:
-        log_f.write(f"{timestamp} {message}\n")
-    print(f"{timestamp} {message}")
+# Function to log messages, extra keyword fields are added to the JSON record
+def log(message, **fields):
+    logger.log("INFO", message, fields)
 
-# Function to log errors with timestamps
-def log_error(message):
-    ensure_log_file_exists()
-    timestamp = datetime.now().strftime("%H:%M:%S")
-    error_message = f"{timestamp} ERROR: {message}"
-    with open(log_file, "a") as log_f:
-        log_f.write(f"{error_message}\n")
-    print(error_message)
+# Function to log errors, which also wakes the writer to persist them right away
+def log_error(message, **fields):
+    logger.log("ERROR", message, fields)
 
 # Path for the log file
-log_file = f"/llm-utility/logs.txt"
-gsutil_url_log = "gs://fine_tuning_llm_testing/logs/"
\ No newline at end of file
+log_file = f"/llm-utility/logs.jsonl"
+gsutil_url_log = "gs://fine_tuning_llm_testing/logs/"
+
+# Buffered JSON lines writer shared by the whole process
+logger = StructuredLogger(log_file)
@@ -1,24 +1,165 @@
+import glob
+import io
+import json
 import os
+import shutil
+import tarfile
 import zipfile
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+from com.mhire.utility.util import sha256_file
+
+
+class RangeReader(io.RawIOBase):
+    """Seekable, read-only file over a remote object fetched by byte ranges."""
+
+    def __init__(self, fetch_range, size, buffer_size=32 * 1024 * 1024):
+        # fetch_range(start, end) returns bytes for the inclusive range [start, end]
+        self.fetch_range = fetch_range
+        self.size = size
+        self.buffer_size = buffer_size
+        self.position = 0
+        self.buffer = b""
+        self.buffer_start = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        elif whence == io.SEEK_END:
+            self.position = self.size + offset
+        self.position = max(0, min(self.position, self.size))
+        return self.position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self.position
+        size = min(size, self.size - self.position)
+        if size <= 0:
+            return b""
+
+        buffer_end = self.buffer_start + len(self.buffer)
+        if not (self.buffer_start <= self.position and self.position + size <= buffer_end):
+            # Read ahead so zipfile's small reads turn into a few large range requests
+            end = min(self.size, self.position + max(size, self.buffer_size)) - 1
+            self.buffer = self.fetch_range(self.position, end)
+            self.buffer_start = self.position
+
+        offset = self.position - self.buffer_start
+        data = self.buffer[offset:offset + size]
+        self.position += len(data)
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+
+# Weight formats are already dense, deflating them costs CPU for almost no gain
+incompressible_extensions = ('.safetensors', '.bin', '.pt', '.pth', '.gguf', '.zip', '.zst', '.gz')
+manifest_name = "manifest.json"
+
+
+# Function to list the files to package, skipping archives written into the same dir
+def list_model_files(output_dir, exclude=()):
+    excluded = {os.path.realpath(path) for path in exclude}
+    model_files = []
+    for root, dirs, files in os.walk(output_dir):
+        for file in sorted(files):
+            file_path = os.path.join(root, file)
+            if os.path.realpath(file_path) in excluded:
+                continue
+            model_files.append((file_path, os.path.relpath(file_path, output_dir)))
+    return model_files
+
+
 class ZipUtil:
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+
+    # Function to build a manifest of sizes and sha256 hashes for the packaged files
+    def build_manifest(self, model_files):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            hashes = list(executor.map(lambda item: sha256_file(item[0]), model_files))
+        return {
+            "files": [
+                {"path": arcname, "size": os.path.getsize(file_path), "sha256": digest}
+                for (file_path, arcname), digest in zip(model_files, hashes)
+            ]
+        }
+
     def zip_model_files(self, output_dir, model_name):
-        """Zips all model files in a directory."""
+        """Zips all model files in a directory, storing weights and deflating the rest."""
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         zip_file_name = f"{model_name}_{timestamp}.zip"
         zip_file_path = os.path.join(output_dir, zip_file_name)
 
-        with zipfile.ZipFile(zip_file_path, 'w') as zipf:
-            for root, dirs, files in os.walk(output_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    zipf.write(file_path, os.path.relpath(file_path, output_dir))
-                    
+        # Skip this archive and any earlier packages of the same model in the dir
+        previous = glob.glob(os.path.join(output_dir, f"{glob.escape(model_name)}_*.zip"))
+        model_files = list_model_files(output_dir, exclude=[zip_file_path] + previous)
+        manifest = self.build_manifest(model_files)
+        stored = [item for item in model_files if item[1].lower().endswith(incompressible_extensions)]
+        compressible = [item for item in model_files if item not in stored]
+
+        # Weights go in as-is, the hashing above is what runs across cores
+        with zipfile.ZipFile(zip_file_path, 'w', allowZip64=True) as zipf:
+            for file_path, arcname in stored:
+                zipf.write(file_path, arcname, compress_type=zipfile.ZIP_STORED)
+            for file_path, arcname in compressible:
+                zipf.write(file_path, arcname, compress_type=zipfile.ZIP_DEFLATED)
+            zipf.writestr(manifest_name, json.dumps(manifest, indent=2))
+
         logging.info(f"Model files zipped into: {zip_file_name}")
         return zip_file_path
 
+    def tar_zst_model_files(self, output_dir, model_name, fileobj=None, level=3):
+        """Packages model files as a streaming tar.zst, optionally straight into fileobj.
+
+        Passing a writable upload stream (for example blob.open("wb")) uploads the
+        archive while it is being built.
+        """
+        import zstandard
+
+        model_files = list_model_files(output_dir)
+        manifest = self.build_manifest(model_files)
+        manifest_bytes = json.dumps(manifest, indent=2).encode("utf-8")
+
+        archive_path = None
+        if fileobj is None:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            archive_path = os.path.join(os.path.dirname(os.path.abspath(output_dir)), f"{model_name}_{timestamp}.tar.zst")
+            fileobj = open(archive_path, "wb")
+
+        try:
+            # zstd spreads compression across all cores with threads=-1
+            compressor = zstandard.ZstdCompressor(level=level, threads=-1)
+            with compressor.stream_writer(fileobj, closefd=False) as writer:
+                with tarfile.open(fileobj=writer, mode="w|") as tar:
+                    manifest_info = tarfile.TarInfo(manifest_name)
+                    manifest_info.size = len(manifest_bytes)
+                    tar.addfile(manifest_info, io.BytesIO(manifest_bytes))
+                    for file_path, arcname in model_files:
+                        tar.add(file_path, arcname)
+        finally:
+            if archive_path:
+                fileobj.close()
+
+        logging.info(f"Model files packaged into: {archive_path or 'stream'}")
+        return archive_path, manifest
+
     def unzip_file(self, zip_file_path, extract_to_path=None):
         """Unzips a file to the given directory."""
         if extract_to_path is None:
@@ -29,4 +170,38 @@ class ZipUtil:
         with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
             zip_ref.extractall(extract_to_path)
             
-        logging.info(f"Extracted {zip_file_path} to {extract_to_path}")
\ No newline at end of file
+        logging.info(f"Extracted {zip_file_path} to {extract_to_path}")
+
+    def extract_remote(self, fetch_range, size, extract_to_path, max_workers=8, on_extracted=None):
+        """Extracts a remote zip member by member without storing the archive."""
+        os.makedirs(extract_to_path, exist_ok=True)
+        root = os.path.realpath(extract_to_path)
+
+        with zipfile.ZipFile(RangeReader(fetch_range, size)) as zip_ref:
+            members = [info for info in zip_ref.infolist() if not info.is_dir()]
+
+        # Largest members first so the slowest downloads start earliest
+        members.sort(key=lambda info: info.compress_size, reverse=True)
+
+        def extract(info):
+            target_path = os.path.realpath(os.path.join(root, info.filename))
+            if not target_path.startswith(root + os.sep):
+                raise ValueError(f"Refusing to extract {info.filename} outside {extract_to_path}")
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+
+            # Each worker has its own reader, and the rename makes a file visible only once complete
+            partial_path = f"{target_path}.partial"
+            with zipfile.ZipFile(RangeReader(fetch_range, size)) as zip_ref:
+                with zip_ref.open(info) as source, open(partial_path, "wb") as target:
+                    shutil.copyfileobj(source, target, 8 * 1024 * 1024)
+            os.replace(partial_path, target_path)
+            logging.info(f"Extracted {info.filename}")
+            if on_extracted:
+                on_extracted(target_path)
+            return target_path
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            extracted = list(executor.map(extract, members))
+
+        logging.info(f"Extracted {len(extracted)} files to {extract_to_path}")
+        return extracted
\ No newline at end of file
@@ -30,5 +30,9 @@ gcloud config set project $GCP_PROJECT_ID --quiet
 # Configure Docker authentication
 gcloud auth configure-docker us-central1-docker.pkg.dev --quiet
 
-# Run the main command
-python3 -m com.mhire.startup_fine_tuning
+# Run the main command, or a queue of jobs on one base model when a job spec is given
+if [ -n "$BATCH_JOBS" ]; then
+  python3 -m com.mhire.batch_fine_tuning --jobs "$BATCH_JOBS" ${BATCH_MODEL_PATH:+--model-path "$BATCH_MODEL_PATH"}
+else
+  python3 -m com.mhire.startup_fine_tuning
+fi
@@ -0,0 +1,72 @@
+import json
+import os
+
+import pytest
+
+from com.mhire.utility import util
+
+tiny_model_repo = "hf-internal-testing/tiny-random-LlamaForCausalLM"
+
+
+@pytest.fixture(autouse=True)
+def quiet_log(monkeypatch):
+    # The job log lives under /llm-utility, which only exists in the training image
+    monkeypatch.setattr(util.logger, "log", lambda *args, **kwargs: None)
+
+
+# Function to build a tiny randomly initialized Llama with a byte-level BPE tokenizer, fully offline
+def build_tiny_model(model_dir):
+    import torch
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+    from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+    tokenizer = Tokenizer(models.BPE(unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(vocab_size=512, special_tokens=["<unk>", "<s>", "</s>", "<pad>"],
+                                  initial_alphabet=pre_tokenizers.ByteLevel.alphabet())
+    tokenizer.train_from_iterator([f"Question {i}: what is {i} plus {i}? The answer is {2 * i}." for i in range(200)],
+                                  trainer)
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=tokenizer, unk_token="<unk>", bos_token="<s>",
+                                        eos_token="</s>", pad_token="<pad>", model_max_length=128)
+    tokenizer.save_pretrained(model_dir)
+
+    # Widths are multiples of 256 so every GGUF quantization type applies
+    config = LlamaConfig(vocab_size=len(tokenizer), hidden_size=256, intermediate_size=512, num_hidden_layers=2,
+                         num_attention_heads=4, num_key_value_heads=4, max_position_embeddings=128,
+                         bos_token_id=tokenizer.bos_token_id, eos_token_id=tokenizer.eos_token_id,
+                         pad_token_id=tokenizer.pad_token_id)
+    torch.manual_seed(0)
+    LlamaForCausalLM(config).save_pretrained(model_dir)
+
+
+@pytest.fixture(scope="session")
+def tiny_model_dir(tmp_path_factory):
+    """Directory of a tiny Llama checkpoint for CPU tests.
+
+    TINY_MODEL_DIR wins, then hf-internal-testing's tiny Llama from the Hub, whose
+    tokenizer llama.cpp can convert, and offline a model built on the spot.
+    """
+    if os.environ.get("TINY_MODEL_DIR"):
+        return os.environ["TINY_MODEL_DIR"]
+    pytest.importorskip("torch")
+    pytest.importorskip("transformers")
+    try:
+        import huggingface_hub
+        return huggingface_hub.snapshot_download(tiny_model_repo)
+    except Exception:
+        model_dir = str(tmp_path_factory.mktemp("tiny-model"))
+        build_tiny_model(model_dir)
+        return model_dir
+
+
+@pytest.fixture
+def dataset_jsonl(tmp_path):
+    """Small prompt/completion jsonl in the training format."""
+    path = tmp_path / "dataset.jsonl"
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(64):
+            record = {"prompt": f"Question {i}: what is {i} plus {i}, and why does it matter for the answer?",
+                      "completion": f"The answer is {2 * i}, because adding {i} to itself doubles it."}
+            f.write(json.dumps(record) + "\n")
+    return str(path)
@@ -0,0 +1,147 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("google.cloud.storage")
+pytest.importorskip("docker")
+
+import torch
+
+from com.mhire.batch_fine_tuning import BatchRunner, group_by_model, load_job_specs
+
+
+def test_load_job_specs_reads_every_spec_format_in_a_dir(tmp_path):
+    (tmp_path / "a.json").write_text(json.dumps({"fine_tuning_id": "a", "dataset_path": "gs://bucket/a.jsonl"}))
+    (tmp_path / "b.jsonl").write_text(json.dumps({"fine_tuning_id": "b1", "dataset_path": "b1.jsonl"}) + "\n\n"
+                                      + json.dumps({"fine_tuning_id": "b2", "dataset_path": "b2.jsonl"}) + "\n")
+    (tmp_path / "c.yaml").write_text("- fine_tuning_id: c1\n  dataset_path: c1.jsonl\n  lora: false\n"
+                                     "- fine_tuning_id: c2\n  dataset_path: c2.jsonl\n")
+    (tmp_path / "notes.txt").write_text("not a spec")
+
+    jobs = load_job_specs(str(tmp_path))
+
+    assert [job["fine_tuning_id"] for job in jobs] == ["a", "b1", "b2", "c1", "c2"]
+    assert jobs[3]["lora"] is False
+    assert load_job_specs(str(tmp_path / "c.yaml")) == jobs[3:]
+
+
+@pytest.mark.parametrize("specs, message", [
+    ([{"fine_tuning_id": "a"}], "missing"),
+    ([{"fine_tuning_id": "a", "dataset_path": "a.jsonl"}, {"fine_tuning_id": "a", "dataset_path": "b.jsonl"}],
+     "Duplicate"),
+])
+def test_load_job_specs_rejects_invalid_specs(tmp_path, specs, message):
+    spec_path = tmp_path / "jobs.json"
+    spec_path.write_text(json.dumps(specs))
+
+    with pytest.raises(ValueError, match=message):
+        load_job_specs(str(spec_path))
+
+
+def test_group_by_model_keeps_queue_order():
+    jobs = [{"fine_tuning_id": "a", "model_path": "llama"}, {"fine_tuning_id": "b"},
+            {"fine_tuning_id": "c", "model_path": "llama"}, {"fine_tuning_id": "d", "model_path": "mistral"}]
+
+    groups = group_by_model(jobs, default_model_path="mistral")
+
+    assert list(groups) == ["llama", "mistral"]
+    assert [job["fine_tuning_id"] for job in groups["llama"]] == ["a", "c"]
+    assert [job["fine_tuning_id"] for job in groups["mistral"]] == ["b", "d"]
+    with pytest.raises(ValueError):
+        group_by_model([{"fine_tuning_id": "a"}])
+
+
+class FakeFineTuning:
+    """Stands in for FineTuneModel, recording the model each job was handed."""
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.calls = []
+
+    def fine_tune_model(self, model_local_path, dataset_path, lora_config=None, model=None, output_dir=None, **kwargs):
+        job_id = os.path.basename(os.path.dirname(output_dir))
+        self.calls.append((job_id, model, {key: value.clone() for key, value in model.state_dict().items()}))
+        if lora_config is None:
+            # A full fine-tune updates the shared base weights in place
+            with torch.no_grad():
+                for parameter in model.parameters():
+                    parameter.add_(1.0)
+        if job_id in self.fail:
+            raise RuntimeError("CUDA out of memory")
+        return output_dir
+
+
+@pytest.fixture
+def runner(tmp_path, monkeypatch):
+    monkeypatch.setattr("com.mhire.batch_fine_tuning.FineTuneModel", lambda: FakeFineTuning())
+    batch_runner = BatchRunner(gcp_util=None, work_dir=str(tmp_path / "batch"), upload_logs=False)
+    batch_runner.loads = []
+    load_base_model = batch_runner.load_base_model
+
+    def counting_load(model_dir):
+        batch_runner.loads.append(model_dir)
+        return load_base_model(model_dir)
+
+    monkeypatch.setattr(batch_runner, "load_base_model", counting_load)
+    return batch_runner
+
+
+def job(fine_tuning_id, dataset_jsonl, **fields):
+    return {"fine_tuning_id": fine_tuning_id, "dataset_path": dataset_jsonl, **fields}
+
+
+def read_result(runner, fine_tuning_id):
+    with open(os.path.join(runner.work_dir, "jobs", fine_tuning_id, "result.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_finished_jobs_are_skipped_on_restart(runner, tiny_model_dir, dataset_jsonl):
+    jobs = [job("done", dataset_jsonl), job("failed", dataset_jsonl), job("new", dataset_jsonl)]
+    for fine_tuning_id, status in (("done", "done"), ("failed", "failed")):
+        job_dir = os.path.join(runner.work_dir, "jobs", fine_tuning_id)
+        os.makedirs(job_dir)
+        with open(os.path.join(job_dir, "result.json"), "w", encoding="utf-8") as f:
+            json.dump({"status": status}, f)
+
+    report = runner.run(jobs, default_model_path=tiny_model_dir)
+
+    assert [call[0] for call in runner.fine_tuning.calls] == ["failed", "new"]
+    assert report["jobs_run"] == report["jobs_done"] == 2
+    assert read_result(runner, "new")["status"] == "done"
+    assert read_result(runner, "done") == {"status": "done"}
+
+    # A group with nothing left to do never loads its model
+    runner.loads.clear()
+    runner.run(jobs, default_model_path=tiny_model_dir)
+    assert runner.loads == []
+
+
+def test_base_weights_are_restored_after_a_full_fine_tune(runner, tiny_model_dir, dataset_jsonl):
+    jobs = [job("full", dataset_jsonl, lora=False), job("adapter", dataset_jsonl)]
+
+    runner.run(jobs, default_model_path=tiny_model_dir)
+
+    (_, full_model, before), (_, adapter_model, after) = runner.fine_tuning.calls
+    # The next job trains on the original weights, without a second load
+    assert adapter_model is full_model
+    assert runner.loads == [tiny_model_dir]
+    assert set(after) == set(before)
+    assert all(torch.equal(before[key], after[key]) for key in before)
+
+
+def test_model_is_reloaded_after_a_failed_job(runner, tiny_model_dir, dataset_jsonl):
+    runner.fine_tuning.fail = {"broken"}
+    jobs = [job("broken", dataset_jsonl), job("next", dataset_jsonl)]
+
+    report = runner.run(jobs, default_model_path=tiny_model_dir)
+
+    (_, broken_model, _), (_, next_model, _) = runner.fine_tuning.calls
+    assert next_model is not broken_model
+    assert runner.loads == [tiny_model_dir, tiny_model_dir]
+    assert (report["jobs_done"], report["jobs_failed"]) == (1, 1)
+    result = read_result(runner, "broken")
+    assert result["status"] == "failed"
+    assert result["error"] == "CUDA out of memory"
@@ -0,0 +1,65 @@
+import random
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from com.mhire.fine_tuning.batching import DynamicPaddingCollator, LengthBucketBatchSampler
+
+
+def test_collator_pads_to_the_longest_row_and_masks_padding():
+    collator = DynamicPaddingCollator(pad_token_id=0)
+    batch = collator([
+        {"input_ids": [5, 6, 7], "attention_mask": [1, 1, 1], "labels": [8, 9]},
+        {"input_ids": [5], "labels": [8, 9, 10, 11]},
+    ])
+
+    assert batch["input_ids"].tolist() == [[5, 6, 7, 0], [5, 0, 0, 0]]
+    assert batch["attention_mask"].tolist() == [[1, 1, 1, 0], [1, 0, 0, 0]]
+    # Padded label positions are ignored by the loss
+    assert batch["labels"].tolist() == [[8, 9, -100, -100], [8, 9, 10, 11]]
+
+
+def test_collator_rounds_up_to_a_multiple():
+    collator = DynamicPaddingCollator(pad_token_id=2, pad_to_multiple_of=8)
+    batch = collator([{"input_ids": [1, 1, 1], "labels": [1, 1, 1]}])
+
+    assert batch["input_ids"].shape == (1, 8)
+    assert batch["attention_mask"].sum().item() == 3
+
+
+@pytest.fixture
+def lengths():
+    rng = random.Random(7)
+    return [rng.randint(1, 300) for _ in range(1000)]
+
+
+def test_sampler_covers_every_example_once_within_the_token_budget(lengths):
+    sampler = LengthBucketBatchSampler(lengths, max_batch_tokens=1024, bucket_size=100)
+    batches = list(sampler)
+
+    assert sorted(index for batch in batches for index in batch) == list(range(len(lengths)))
+    for batch in batches:
+        assert max(lengths[i] for i in batch) * len(batch) <= 1024
+
+
+def test_sampler_gives_an_oversized_example_its_own_batch():
+    batches = list(LengthBucketBatchSampler([10, 5000, 10], max_batch_tokens=100, shuffle=False))
+
+    assert [1] in batches
+    assert sorted(index for batch in batches for index in batch) == [0, 1, 2]
+
+
+def test_sampler_is_deterministic_per_epoch_and_reshuffles_every_pass(lengths):
+    sampler = LengthBucketBatchSampler(lengths, max_batch_tokens=1024, bucket_size=100, seed=3)
+    first = list(sampler)
+    second = list(sampler)
+
+    assert first != second
+    # A resumed run pins the epoch and replays exactly that pass
+    sampler.set_epoch(0)
+    assert list(sampler) == first
+    sampler.set_epoch(1)
+    assert list(sampler) == second
+    assert list(LengthBucketBatchSampler(lengths, 1024, bucket_size=100, seed=3)) == first
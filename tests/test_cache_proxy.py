@@ -0,0 +1,91 @@
+import asyncio
+
+import aiohttp
+from aiohttp import web
+
+from com.mhire.inference.cache_proxy import CacheProxy, PrefixContextCache
+from com.mhire.inference.mock_ollama_server import MockOllamaServer
+
+template = "<|im_start|>system\n{{ .System }}<|im_end|>\n<|im_start|>user\n{{ .Prompt }}<|im_end|>\n<|im_start|>assistant\n"
+system = "You are a careful assistant that answers in one short sentence"
+
+
+async def run_proxy(upstream, requests, prefix_cache):
+    proxy = CacheProxy(upstream.url, prefix_cache=prefix_cache)
+    runner = web.AppRunner(proxy.app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+    try:
+        async with aiohttp.ClientSession() as session:
+            async def send(body):
+                async with session.post(f"{url}/api/generate", json=body) as response:
+                    return response.status, await response.json()
+            return proxy, await asyncio.gather(*(send(body) for body in requests))
+    finally:
+        await runner.cleanup()
+
+
+def client_bodies(upstream):
+    # Prefill and probe requests are raw one-token calls without a system prompt
+    return [body for body in upstream.bodies if (body.get("options") or {}).get("num_predict") != 1]
+
+
+def test_concurrent_requests_keep_system_prompt_when_context_is_ignored():
+    async def run():
+        async with MockOllamaServer(first_token_delay=0.05, token_delay=0, raw_context=False) as upstream:
+            prefix_cache = PrefixContextCache(template)
+            requests = [{"model": "model", "prompt": f"question {i}", "system": system, "stream": False}
+                        for i in range(4)]
+            proxy, responses = await run_proxy(upstream, requests, prefix_cache)
+            return upstream, proxy, prefix_cache, responses
+
+    upstream, proxy, prefix_cache, responses = asyncio.run(run())
+    assert all(status == 200 for status, _ in responses)
+    assert prefix_cache.supported is False
+    assert prefix_cache.contexts == {}
+    bodies = client_bodies(upstream)
+    assert len(bodies) == 4
+    for body in bodies:
+        assert body["system"] == system
+        assert not body.get("raw")
+        assert "context" not in body
+    assert proxy.counts["prefix_hits"] == proxy.counts["prefix_misses"] == 0
+
+
+def test_concurrent_requests_share_one_prefix_context():
+    async def run():
+        async with MockOllamaServer(first_token_delay=0.05, token_delay=0) as upstream:
+            prefix_cache = PrefixContextCache(template)
+            requests = [{"model": "model", "prompt": f"question {i}", "system": system, "stream": False}
+                        for i in range(4)]
+            proxy, responses = await run_proxy(upstream, requests, prefix_cache)
+            return upstream, proxy, prefix_cache, responses
+
+    upstream, proxy, prefix_cache, responses = asyncio.run(run())
+    assert all(status == 200 for status, _ in responses)
+    assert prefix_cache.supported is True
+    assert len(prefix_cache.contexts) == 1
+    bodies = client_bodies(upstream)
+    assert len(bodies) == 4
+    for body in bodies:
+        assert body["raw"] is True
+        assert "system" not in body
+        assert body["context"] == prefix_cache.contexts[("model", system)]
+    assert proxy.counts["prefix_misses"] == 1
+    assert proxy.counts["prefix_hits"] == 3
+
+
+def test_identical_greedy_requests_share_one_upstream_call():
+    async def run():
+        async with MockOllamaServer(first_token_delay=0.1, token_delay=0) as upstream:
+            body = {"model": "model", "prompt": "same question", "stream": False, "options": {"temperature": 0}}
+            proxy, responses = await run_proxy(upstream, [body] * 8, None)
+            return upstream, proxy, responses
+
+    upstream, proxy, responses = asyncio.run(run())
+    assert upstream.request_counts["generate"] == 1
+    assert len({result["response"] for _, result in responses}) == 1
+    assert proxy.counts["misses"] == 1
+    assert proxy.counts["inflight_hits"] == 7
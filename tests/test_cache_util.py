@@ -0,0 +1,70 @@
+import errno
+import os
+
+from com.mhire.utility.artifact_cache import ArtifactCache, link_or_copy
+from com.mhire.utility.cache_util import evict_lru, publish_dir, remove_stale_staging
+
+
+def make_entry(cache_dir, name, size, mtime):
+    entry_dir = os.path.join(cache_dir, name)
+    os.makedirs(entry_dir)
+    with open(os.path.join(entry_dir, "data"), "wb") as f:
+        f.write(b"x" * size)
+    os.utime(entry_dir, (mtime, mtime))
+    return entry_dir
+
+
+def test_evict_lru_removes_oldest_entries_first(tmp_path):
+    make_entry(tmp_path, "old", 100, 1000)
+    make_entry(tmp_path, "kept", 100, 1001)
+    make_entry(tmp_path, "new", 100, 1002)
+    make_entry(tmp_path, ".staging", 100, 900)
+    evicted = evict_lru(str(tmp_path), 150, keep=("kept",))
+    assert evicted == [("old", 100), ("new", 100)]
+    assert sorted(os.listdir(tmp_path)) == [".staging", "kept"]
+
+
+def test_publish_dir_replaces_existing_entry(tmp_path):
+    make_entry(tmp_path, "entry", 1, 1000)
+    staging_dir = make_entry(tmp_path, ".entry.tmp", 2, 1000)
+    publish_dir(staging_dir, os.path.join(tmp_path, "entry"))
+    assert os.path.getsize(os.path.join(tmp_path, "entry", "data")) == 2
+    assert not os.path.exists(staging_dir)
+
+
+def test_link_or_copy_symlinks_across_filesystems(tmp_path, monkeypatch):
+    src = tmp_path / "src"
+    src.write_bytes(b"weights")
+
+    def cross_device_link(src, dst):
+        raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+    monkeypatch.setattr(os, "link", cross_device_link)
+    assert link_or_copy(str(src), str(tmp_path / "dst")) == "symlink"
+    assert os.readlink(tmp_path / "dst") == str(src)
+
+
+def test_materialized_entries_are_not_evicted(tmp_path):
+    cache = ArtifactCache(str(tmp_path / "cache"), max_size_bytes=150)
+
+    def fill(size):
+        return lambda files_dir: open(os.path.join(files_dir, "data"), "wb").write(b"x" * size)
+
+    cache.populate("model", "gs://bucket/model.zip", fill(100))
+    linked = cache.materialize("model", str(tmp_path / "work"))
+    assert [os.path.relpath(path, tmp_path / "work") for path in linked] == ["data"]
+    # The second entry pushes the cache over budget, the model in use stays
+    cache.populate("dataset", "gs://bucket/dataset.jsonl", fill(100))
+    assert cache.has("model") and cache.has("dataset")
+    assert os.path.getsize(linked[0]) == 100
+
+
+def test_remove_stale_staging_keeps_builds_still_writing(tmp_path):
+    orphan = make_entry(tmp_path, ".orphan.1", 10, 1000)
+    os.utime(os.path.join(orphan, "data"), (1000, 1000))
+    # A build appending to its shard keeps the file fresh even though the dir is old
+    make_entry(tmp_path, ".writing.2", 10, 1000)
+    make_entry(tmp_path, "published", 10, 1000)
+
+    assert remove_stale_staging(str(tmp_path), max_age_seconds=3600) == [".orphan.1"]
+    assert sorted(os.listdir(tmp_path)) == [".writing.2", "published"]
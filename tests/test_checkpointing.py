@@ -0,0 +1,59 @@
+import os
+import random
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+import torch
+from transformers import AutoModelForCausalLM, TrainerState, TrainingArguments
+
+from com.mhire.fine_tuning.checkpointing import AsyncCheckpointCallback, latest_checkpoint, list_checkpoints
+
+
+@pytest.mark.parametrize("keep_last, kept", [(0, ["checkpoint-3"]), (1, ["checkpoint-3"]),
+                                             (2, ["checkpoint-2", "checkpoint-3"])])
+def test_old_checkpoints_are_pruned_to_keep_last(tiny_model_dir, tmp_path, keep_last, kept):
+    model = AutoModelForCausalLM.from_pretrained(tiny_model_dir)
+    args = TrainingArguments(output_dir=str(tmp_path / "output"), report_to=[])
+    checkpoint_dir = str(tmp_path / "checkpoints")
+    callback = AsyncCheckpointCallback(checkpoint_dir, save_steps=1, keep_last=keep_last)
+
+    state = TrainerState()
+    for step in (1, 2, 3):
+        state.global_step = step
+        callback.on_step_end(args, state, None, model=model)
+    callback.on_train_end(args, state, None)
+
+    assert [os.path.basename(path) for path in list_checkpoints(checkpoint_dir)] == kept
+    assert latest_checkpoint(checkpoint_dir).endswith("checkpoint-3")
+
+
+def test_checkpoint_holds_the_state_a_resume_needs(tiny_model_dir, tmp_path):
+    model = AutoModelForCausalLM.from_pretrained(tiny_model_dir)
+    args = TrainingArguments(output_dir=str(tmp_path / "output"), report_to=[])
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-3)
+    lr_scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=1, gamma=0.5)
+    optimizer.step()
+    lr_scheduler.step()
+    callback = AsyncCheckpointCallback(str(tmp_path / "checkpoints"), save_steps=1)
+
+    random.seed(11)
+    torch.manual_seed(11)
+    state = TrainerState(global_step=1)
+    callback.on_step_end(args, state, None, model=model, optimizer=optimizer, lr_scheduler=lr_scheduler)
+    expected = random.random(), torch.rand(1)
+    callback.on_train_end(args, state, None)
+
+    checkpoint = latest_checkpoint(str(tmp_path / "checkpoints"))
+    for name in ("model.safetensors", "optimizer.pt", "scheduler.pt", "rng_state.pth", "trainer_state.json",
+                 "training_args.bin"):
+        assert os.path.isfile(os.path.join(checkpoint, name))
+    assert torch.load(os.path.join(checkpoint, "scheduler.pt"))["last_epoch"] == 1
+
+    # Restoring the saved RNG state replays the draws made right after the snapshot
+    rng_state = torch.load(os.path.join(checkpoint, "rng_state.pth"), weights_only=False)
+    random.setstate(rng_state["python"])
+    torch.random.set_rng_state(rng_state["cpu"])
+    assert (random.random(), torch.rand(1)) == expected
@@ -0,0 +1,102 @@
+import hashlib
+import os
+
+import pytest
+
+pytest.importorskip("docker")
+
+from docker.errors import ImageNotFound
+
+from com.mhire.utility.docker_util import DockerUtil, model_digest_label
+
+
+class FakeImage:
+    def __init__(self, image_id, labels):
+        self.id = image_id
+        self.labels = labels
+        self.tags = []
+
+    def tag(self, name):
+        self.tags.append(name)
+
+
+class FakeImages:
+    """The docker.DockerClient.images calls DockerUtil makes, recorded in memory."""
+
+    def __init__(self, push_logs=None):
+        self.images = {}
+        self.calls = []
+        self.push_logs = push_logs or [{"status": "Layer already exists", "id": "base"},
+                                       {"status": "Pushed", "id": "model"}]
+
+    def get(self, name):
+        self.calls.append(("get", name))
+        if name not in self.images:
+            raise ImageNotFound(name)
+        return self.images[name]
+
+    def pull(self, name):
+        self.calls.append(("pull", name))
+        self.images[name] = FakeImage(name, {})
+        return self.images[name]
+
+    def list(self, filters=None):
+        key, value = filters["label"].split("=", 1)
+        return [image for image in self.images.values() if image.labels.get(key) == value]
+
+    def build(self, path, tag, labels, **kwargs):
+        self.calls.append(("build", tag))
+        self.context_files = sorted(os.path.relpath(os.path.join(root, file), path)
+                                    for root, dirs, files in os.walk(path) for file in files)
+        image = FakeImage(f"image-{len(self.images)}", labels)
+        self.images[tag] = image
+        return image, [{"stream": "Step 1/3"}]
+
+    def push(self, name, stream, decode):
+        self.calls.append(("push", name))
+        return iter(self.push_logs)
+
+
+class FakeDockerClient:
+    def __init__(self, push_logs=None):
+        self.images = FakeImages(push_logs)
+
+
+@pytest.fixture
+def gguf_path(tmp_path):
+    path = tmp_path / "model_file.gguf"
+    path.write_bytes(b"GGUF" + os.urandom(1024))
+    return str(path)
+
+
+def test_build_puts_the_model_in_one_content_addressed_layer(tmp_path, gguf_path):
+    client = FakeDockerClient()
+    util = DockerUtil(client=client)
+    image = util.build_docker_image("registry/model:1", gguf_path, context_dir=str(tmp_path / "context"))
+
+    digest = hashlib.sha256(open(gguf_path, "rb").read()).hexdigest()
+    assert image.labels == {model_digest_label: f"sha256:{digest}"}
+    assert f"models/blobs/sha256-{digest}" in client.images.context_files
+    assert ("pull", util.base_image) in client.images.calls
+
+
+def test_rebuilding_the_same_model_only_retags(tmp_path, gguf_path):
+    client = FakeDockerClient()
+    util = DockerUtil(client=client)
+    first = util.build_docker_image("registry/model:1", gguf_path, context_dir=str(tmp_path / "context"))
+    second = util.build_docker_image("registry/model:2", gguf_path, context_dir=str(tmp_path / "context"))
+
+    assert second is first
+    assert first.tags == ["registry/model:2"]
+    assert [call for call in client.images.calls if call[0] in ("build", "pull")] == [
+        ("pull", util.base_image), ("build", "registry/model:1")]
+
+
+def test_push_happens_once_and_reports_stream_errors():
+    client = FakeDockerClient()
+    DockerUtil(client=client).push_docker_image("registry/model:1")
+    assert [call for call in client.images.calls if call[0] == "push"] == [("push", "registry/model:1")]
+
+    failing = FakeDockerClient(push_logs=[{"errorDetail": {"message": "denied"}, "error": "denied"}])
+    with pytest.raises(RuntimeError, match="registry/model:1"):
+        DockerUtil(client=failing).push_docker_image("registry/model:1")
@@ -0,0 +1,84 @@
+from com.mhire.utility.log_util import LogUploader, StructuredLogger
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.content_type = None
+
+    @property
+    def size(self):
+        return len(self.bucket.objects[self.name])
+
+    def upload_from_string(self, data, content_type=None):
+        self.bucket.objects[self.name] = bytes(data)
+
+    def compose(self, sources):
+        self.bucket.objects[self.name] = b"".join(self.bucket.objects[source.name] for source in sources)
+
+    def delete(self):
+        del self.bucket.objects[self.name]
+
+
+class FakeBucket:
+    """The few google.cloud.storage bucket calls LogUploader makes, kept in memory."""
+
+    def __init__(self, name):
+        self.name = name
+        self.objects = {}
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def get_blob(self, name):
+        return FakeBlob(self, name) if name in self.objects else None
+
+
+class FakeStorageClient:
+    def __init__(self):
+        self.buckets = {}
+
+    def bucket(self, name):
+        return self.buckets.setdefault(name, FakeBucket(name))
+
+
+def run_job(log_path, state_dir, storage_client, messages):
+    logger = StructuredLogger(str(log_path))
+    uploader = LogUploader(logger, storage_client, "gs://logs-bucket/logs/job.jsonl", interval=3600,
+                           state_dir=str(state_dir))
+    for message in messages:
+        logger.log("INFO", message)
+    logger.flush()
+    uploader.upload()
+    logger.close()
+    return uploader
+
+
+def remote_messages(storage_client):
+    data = storage_client.bucket("logs-bucket").objects["logs/job.jsonl"].decode("utf-8")
+    return [line.split('"msg": "')[1].split('"')[0] for line in data.splitlines()]
+
+
+def test_restarted_job_with_a_shorter_log_keeps_the_crashed_run(tmp_path):
+    storage_client = FakeStorageClient()
+    run_job(tmp_path / "run1" / "logs.jsonl", tmp_path / "state", storage_client, [f"first {i}" for i in range(5)])
+    # A fresh container starts with a new, shorter log file at the same path
+    run_job(tmp_path / "run2" / "logs.jsonl", tmp_path / "state", storage_client, ["second 0"])
+    assert remote_messages(storage_client) == [f"first {i}" for i in range(5)] + ["second 0"]
+
+
+def test_restarted_job_with_a_longer_log_is_appended_from_its_start(tmp_path):
+    storage_client = FakeStorageClient()
+    run_job(tmp_path / "run1" / "logs.jsonl", tmp_path / "state", storage_client, ["first 0"])
+    run_job(tmp_path / "run2" / "logs.jsonl", tmp_path / "state", storage_client, [f"second {i}" for i in range(5)])
+    assert remote_messages(storage_client) == ["first 0"] + [f"second {i}" for i in range(5)]
+
+
+def test_restarted_uploader_resumes_the_same_log_file(tmp_path):
+    storage_client = FakeStorageClient()
+    log_path = tmp_path / "logs.jsonl"
+    run_job(log_path, tmp_path / "state", storage_client, ["line 0", "line 1"])
+    # Same local file, e.g. the process restarted inside the container
+    run_job(log_path, tmp_path / "state", storage_client, ["line 2"])
+    assert remote_messages(storage_client) == ["line 0", "line 1", "line 2"]
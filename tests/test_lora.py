@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("peft")
+
+from com.mhire.fine_tuning import fine_tuning
+from com.mhire.fine_tuning.checkpointing import list_checkpoints, remove_checkpoints
+from com.mhire.fine_tuning.fine_tuning import FineTuneModel
+from com.mhire.fine_tuning.lora import LoraTrainingConfig
+
+
+@pytest.fixture
+def lora_config():
+    # The repository recipe, shortened so a CPU run takes a few optimizer steps
+    config = LoraTrainingConfig.from_yaml()
+    config.gradient_accumulation_steps = 8
+    config.warmup_steps = 0
+    return config
+
+
+def test_lora_fine_tune_tiny_model_on_cpu(tiny_model_dir, dataset_jsonl, lora_config, tmp_path, monkeypatch):
+    checkpoint_dir = str(tmp_path / "checkpoints")
+    checkpoints = {}
+
+    def record_and_remove(path):
+        checkpoints.update({checkpoint: os.listdir(checkpoint) for checkpoint in list_checkpoints(path)})
+        remove_checkpoints(path)
+
+    monkeypatch.setattr(fine_tuning, "remove_checkpoints", record_and_remove)
+    output_path = FineTuneModel().fine_tune_model(
+        tiny_model_dir, dataset_jsonl, dynamic_padding=True, checkpoint_dir=checkpoint_dir, save_steps=2,
+        keep_checkpoints=1, lora_config=lora_config, telemetry_dir=str(tmp_path / "telemetry"),
+        output_dir=str(tmp_path / "finetuned"))
+
+    # Adapter plus the merged full model that quantization and serving consume
+    assert os.path.isfile(os.path.join(output_path, "adapter", "adapter_config.json"))
+    assert os.path.isfile(os.path.join(output_path, "config.json"))
+    assert any(name.endswith(".safetensors") for name in os.listdir(output_path))
+    assert os.path.isfile(os.path.join(output_path, "tokenizer_config.json"))
+
+    # Checkpoints hold adapter weights only, are pruned to keep_checkpoints and go once the model is exported
+    assert len(checkpoints) == 1
+    assert "adapter_model.safetensors" in list(checkpoints.values())[0]
+    assert not os.path.exists(checkpoint_dir)
+    assert os.path.isfile(os.path.join(tmp_path, "telemetry", "summary.json"))
+
+
+def test_preloaded_base_model_is_returned_without_adapters(tiny_model_dir, dataset_jsonl, lora_config, tmp_path):
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    model = AutoModelForCausalLM.from_pretrained(tiny_model_dir)
+    tokenizer = AutoTokenizer.from_pretrained(tiny_model_dir)
+    before = {key: value.clone() for key, value in model.state_dict().items()}
+
+    FineTuneModel().fine_tune_model(tiny_model_dir, dataset_jsonl, dynamic_padding=True, lora_config=lora_config,
+                                    model=model, tokenizer=tokenizer, output_dir=str(tmp_path / "finetuned"))
+
+    # The next job in a batch gets the untouched base model back
+    assert not hasattr(model, "peft_config")
+    assert lora_config.activation_checkpointing
+    assert not model.is_gradient_checkpointing
+    after = model.state_dict()
+    assert set(after) == set(before)
+    assert all(torch.equal(before[key], after[key]) for key in before)
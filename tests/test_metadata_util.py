@@ -0,0 +1,111 @@
+import threading
+
+import pytest
+
+pytest.importorskip("requests")
+
+from com.mhire.utility.fake_metadata_server import FakeMetadataServer
+from com.mhire.utility.metadata_util import MetadataConflict, MetadataHelper
+
+metadata_read = "GET /computeMetadata/v1/"
+
+
+@pytest.fixture
+def server():
+    attributes = {"model_path": "gs://bucket/model.zip", "status": "pending"}
+    with FakeMetadataServer(attributes) as server:
+        yield server
+
+
+def make_helper(server, **kwargs):
+    return MetadataHelper(metadata_url=f"{server.url}/computeMetadata/v1", compute_url=f"{server.url}/compute/v1",
+                          **kwargs)
+
+
+def test_one_recursive_read_serves_identity_and_attributes(server):
+    helper = make_helper(server)
+
+    assert helper.project_id == "fake-project"
+    assert helper.zone == "us-central1-a"
+    assert helper.instance_name == "fake-instance"
+    assert helper.get("model_path") == "gs://bucket/model.zip"
+    assert helper.read_all_metadata()["status"] == "pending"
+    assert server.request_counts[metadata_read] == 1
+
+
+def test_reads_are_refetched_after_the_ttl(server):
+    helper = make_helper(server, ttl=0)
+    helper.get("status")
+    server.set_attribute("status", "running")
+
+    assert helper.get("status") == "running"
+    assert server.request_counts[metadata_read] == 2
+
+
+def test_deferred_updates_share_one_set_metadata_call(server):
+    helper = make_helper(server)
+    with helper.deferred():
+        helper.update_metadata("status", "running")
+        helper.update_metadata("progress", "10")
+        helper.update_many({"step": "3", "progress": "20"})
+        assert server.request_counts["POST setMetadata"] == 0
+
+    assert server.request_counts["POST setMetadata"] == 1
+    assert server.request_counts["GET instance"] == 1
+    assert server.attributes == {"model_path": "gs://bucket/model.zip", "status": "running", "progress": "20",
+                                 "step": "3"}
+    # Our own write invalidates the cached attributes
+    assert helper.get("status") == "running"
+
+
+def test_concurrent_updates_all_land(server):
+    helper = make_helper(server)
+    threads = [threading.Thread(target=helper.update_metadata, args=(f"key-{i}", str(i))) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert all(server.attributes[f"key-{i}"] == str(i) for i in range(8))
+    assert server.request_counts["POST setMetadata"] <= 8
+
+
+def test_lost_fingerprint_race_is_retried_on_fresh_metadata(server, monkeypatch):
+    helper = make_helper(server)
+    get_instance_info = helper.get_instance_info
+    reads = []
+
+    def racing_get_instance_info():
+        info = get_instance_info()
+        # Another writer changes the metadata between our read and our write, once
+        if not reads:
+            server.set_attribute("heartbeat", "1")
+        reads.append(info)
+        return info
+
+    monkeypatch.setattr(helper, "get_instance_info", racing_get_instance_info)
+    helper.update_metadata("status", "running")
+
+    assert server.request_counts["POST setMetadata"] == 2
+    assert server.attributes["status"] == "running"
+    assert server.attributes["heartbeat"] == "1"
+
+
+def test_conflict_after_max_retries_keeps_the_keys_pending(server, monkeypatch):
+    helper = make_helper(server, max_retries=2)
+    get_instance_info = helper.get_instance_info
+
+    def always_racing_get_instance_info():
+        info = get_instance_info()
+        server.set_attribute("heartbeat", str(server.version))
+        return info
+
+    monkeypatch.setattr(helper, "get_instance_info", always_racing_get_instance_info)
+    monkeypatch.setattr("com.mhire.utility.metadata_util.time.sleep", lambda seconds: None)
+    with pytest.raises(MetadataConflict):
+        helper.update_metadata("status", "running")
+    assert helper.pending == {"status": "running"}
+
+    monkeypatch.setattr(helper, "get_instance_info", get_instance_info)
+    helper.flush()
+    assert server.attributes["status"] == "running"
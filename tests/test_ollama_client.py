@@ -0,0 +1,157 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from aiohttp import web
+
+from com.mhire.inference.load_test import percentile, run_load_test
+from com.mhire.inference.mock_ollama_server import MockOllamaServer
+from com.mhire.inference.ollama_client import OllamaClient, read_prompts, run_prompts
+
+
+def run_against(server, scenario):
+    async def run():
+        async with server:
+            return await scenario(server)
+    return asyncio.run(run())
+
+
+def test_generate_streams_tokens_and_reports_timings():
+    tokens = []
+
+    async def scenario(server):
+        async with OllamaClient(server.url, max_concurrency=2) as client:
+            return await client.generate({"prompt": "hello there", "system": "be brief"}, on_token=tokens.append)
+
+    result = run_against(MockOllamaServer(first_token_delay=0.05, token_delay=0.001, num_tokens=4), scenario)
+
+    assert result["error"] is None
+    assert result["response"] == "hello there hello there "
+    assert tokens == ["hello ", "there ", "hello ", "there "]
+    assert result["eval_count"] == 4
+    assert result["prompt_eval_count"] == 2
+    assert result["context"]
+    assert result["ttft_sec"] >= 0.05
+    assert result["latency_sec"] >= result["ttft_sec"]
+    assert result["eval_tokens_per_sec"] > 0
+
+
+def test_generate_all_bounds_concurrency_and_keeps_input_order():
+    records = [{"prompt": f"prompt {i}"} for i in range(12)]
+
+    async def scenario(server):
+        async with OllamaClient(server.url, max_concurrency=3) as client:
+            return await client.generate_all(records), server.max_in_flight
+
+    results, max_in_flight = run_against(MockOllamaServer(first_token_delay=0.02, token_delay=0.001), scenario)
+
+    assert max_in_flight == 3
+    assert [result["prompt"] for result in results] == [record["prompt"] for record in records]
+    assert all(result["error"] is None for result in results)
+
+
+def test_errors_are_returned_instead_of_raised():
+    async def scenario(server):
+        async with OllamaClient(server.url) as client:
+            return await client.generate_all([{"prompt": "a"}, {"prompt": "b"}])
+
+    results = run_against(MockOllamaServer(error_rate=1.0), scenario)
+
+    assert all(result["error"].startswith("RuntimeError: HTTP 500") for result in results)
+
+
+def test_final_chunk_without_eval_count_falls_back_to_the_streamed_chunks():
+    async def generate(request):
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        for token in ("a ", "b "):
+            await response.write((json.dumps({"response": token, "done": False}) + "\n").encode())
+        await response.write((json.dumps({"response": "", "done": True, "eval_duration": int(1e9)}) + "\n").encode())
+        await response.write_eof()
+        return response
+
+    async def run():
+        app = web.Application()
+        app.router.add_post("/api/generate", generate)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        try:
+            url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+            async with OllamaClient(url) as client:
+                return await client.generate({"prompt": "x"})
+        finally:
+            await runner.cleanup()
+
+    result = asyncio.run(run())
+
+    assert result["error"] is None
+    assert result["eval_count"] == 2
+    assert result["eval_tokens_per_sec"] == 2.0
+
+
+def test_run_prompts_writes_one_result_per_prompt(tmp_path):
+    prompts_path = tmp_path / "prompts.jsonl"
+    prompts_path.write_text("".join(json.dumps({"prompt": f"prompt {i}"}) + "\n" for i in range(5)) + "\n")
+    output_path = tmp_path / "results.jsonl"
+
+    async def scenario(server):
+        return await run_prompts(str(prompts_path), str(output_path), server.url, max_concurrency=2)
+
+    run_against(MockOllamaServer(first_token_delay=0.001, token_delay=0.001), scenario)
+
+    written = [json.loads(line) for line in output_path.read_text().splitlines()]
+    assert sorted(result["prompt"] for result in written) == [f"prompt {i}" for i in range(5)]
+    assert all("context" not in result for result in written)
+    assert len(read_prompts(str(prompts_path), limit=3)) == 3
+
+
+def test_read_prompts_rejects_records_without_a_prompt(tmp_path):
+    prompts_path = tmp_path / "prompts.jsonl"
+    prompts_path.write_text(json.dumps({"completion": "no prompt"}) + "\n")
+
+    with pytest.raises(ValueError):
+        read_prompts(str(prompts_path))
+
+
+def test_percentile_interpolates_between_ranks():
+    assert percentile([], 50) is None
+    assert percentile([3, 1, 2], 50) == 2
+    assert percentile([0, 10], 95) == pytest.approx(9.5)
+
+
+def test_load_test_reports_every_concurrency_level():
+    records = [{"prompt": "one two three"}]
+
+    async def scenario(server):
+        return await run_load_test(records, concurrency_levels=(1, 4), requests_per_level=8, base_url=server.url)
+
+    report = run_against(MockOllamaServer(first_token_delay=0.02, token_delay=0.001, num_tokens=5), scenario)
+
+    assert set(report["levels"]) == {"1", "4"}
+    for summary in report["levels"].values():
+        assert summary["requests"] == 8
+        assert summary["errors"] == 0
+        assert summary["ttft_p50_sec"] >= 0.02
+        assert summary["ttft_p50_sec"] <= summary["ttft_p95_sec"] <= summary["ttft_p99_sec"]
+        assert summary["tokens_per_sec"] > 0
+    # Four requests in flight finish the same batch faster than one at a time
+    assert report["levels"]["4"]["requests_per_sec"] > report["levels"]["1"]["requests_per_sec"]
+
+
+def test_load_test_counts_server_errors():
+    async def scenario(server):
+        return await run_load_test([{"prompt": "hi"}], concurrency_levels=(2,), requests_per_level=20,
+                                   base_url=server.url, warmup_requests=0)
+
+    report = run_against(MockOllamaServer(first_token_delay=0.001, token_delay=0.001, error_rate=0.5, seed=1),
+                         scenario)
+
+    summary = report["levels"]["2"]
+    assert 0 < summary["errors"] < 20
+    assert summary["error_rate"] == summary["errors"] / 20
+    assert summary["error_samples"] and summary["error_samples"][0].startswith("RuntimeError: HTTP 500")
@@ -0,0 +1,73 @@
+import json
+import threading
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from transformers import AutoTokenizer
+
+from com.mhire.fine_tuning.fine_tuning import FineTuneModel
+from com.mhire.fine_tuning.parallel_tokenizer import ParallelTokenizer, split_jsonl
+
+
+@pytest.fixture(scope="module")
+def tokenizer(tiny_model_dir):
+    return AutoTokenizer.from_pretrained(tiny_model_dir)
+
+
+@pytest.fixture
+def uneven_jsonl(tmp_path):
+    """Records of very different sizes, with blank lines, so chunks split unevenly."""
+    path = tmp_path / "uneven.jsonl"
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(101):
+            record = {"prompt": f"Question {i}: " + "what is this? " * (i % 7 + 1), "completion": f"Answer {i}" * (i % 3 + 1)}
+            f.write(json.dumps(record) + "\n")
+            if i % 25 == 0:
+                f.write("\n")
+    return str(path)
+
+
+def as_lists(examples):
+    return [{field: list(values) for field, values in example.items()} for example in examples]
+
+
+@pytest.mark.parametrize("padding", [False, "max_length"])
+def test_parallel_output_matches_serial_tokenization(tokenizer, uneven_jsonl, padding):
+    chunks = split_jsonl(uneven_jsonl, 1000)
+    assert len(chunks) > 4 and len({end - start for start, end in chunks}) > 1
+
+    serial = FineTuneModel().tokenize_dataset(tokenizer, uneven_jsonl, padding=padding)
+    with ParallelTokenizer(tokenizer, num_proc=3, chunk_size=1000, batch_size=7, padding=padding) as parallel_tokenizer:
+        parallel = list(parallel_tokenizer.iter_tokenized(uneven_jsonl))
+
+    assert len(serial) == 101
+    assert as_lists(parallel) == as_lists(serial)
+
+
+def test_started_pool_is_reused_from_another_thread(tokenizer, uneven_jsonl):
+    serial = FineTuneModel().tokenize_dataset(tokenizer, uneven_jsonl, padding=False)
+    parallel_tokenizer = ParallelTokenizer(tokenizer, num_proc=2, chunk_size=1000, padding=False).start()
+    processes = set(parallel_tokenizer.executor._processes)
+    results = []
+
+    # Like a background cache build: the pool was forked up front, the thread only submits
+    thread = threading.Thread(target=lambda: results.append(parallel_tokenizer.tokenize(uneven_jsonl)))
+    thread.start()
+    thread.join()
+
+    assert set(parallel_tokenizer.executor._processes) == processes
+    assert as_lists(results[0]) == as_lists(serial)
+    parallel_tokenizer.close()
+    assert parallel_tokenizer.executor is None
+
+
+def test_tokenize_dataset_uses_a_started_pool(tokenizer, uneven_jsonl):
+    serial = FineTuneModel().tokenize_dataset(tokenizer, uneven_jsonl, padding=False)
+    with ParallelTokenizer(tokenizer, num_proc=2, chunk_size=1000, padding=False) as parallel_tokenizer:
+        parallel = FineTuneModel().tokenize_dataset(tokenizer, uneven_jsonl, padding=False, num_proc=2,
+                                                    parallel_tokenizer=parallel_tokenizer)
+
+    assert as_lists(parallel) == as_lists(serial)
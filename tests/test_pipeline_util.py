@@ -0,0 +1,183 @@
+import json
+import threading
+
+import pytest
+
+from com.mhire.utility import pipeline_util
+from com.mhire.utility.pipeline_util import Pipeline, Stage
+
+
+@pytest.fixture
+def state_path(tmp_path):
+    return str(tmp_path / "pipeline" / "job.json")
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(pipeline_util.time, "sleep", delays.append)
+    return delays
+
+
+def read_state(state_path):
+    with open(state_path, "r", encoding="utf-8") as f:
+        return json.load(f)["stages"]
+
+
+def test_stages_start_once_their_dependencies_finish(state_path):
+    events, lock = [], threading.Lock()
+    # Both downloads must be in flight at once to get past the barrier
+    barrier = threading.Barrier(2, timeout=10)
+
+    def stage(name, result):
+        def run(results):
+            with lock:
+                events.append(("start", name, sorted(results)))
+            if name.startswith("download"):
+                barrier.wait()
+            with lock:
+                events.append(("end", name))
+            return result
+        return run
+
+    pipeline = Pipeline(state_path)
+    pipeline.add(Stage("download_model", stage("download_model", "model")))
+    pipeline.add(Stage("download_dataset", stage("download_dataset", "dataset")))
+    pipeline.add(Stage("fine_tune", stage("fine_tune", "tuned"), deps=["download_model", "download_dataset"]))
+    pipeline.add(Stage("quantize", stage("quantize", "gguf"), deps=["fine_tune"]))
+
+    results = pipeline.run()
+
+    assert results == {"download_model": "model", "download_dataset": "dataset", "fine_tune": "tuned",
+                       "quantize": "gguf"}
+    position = {event[:2]: index for index, event in enumerate(events)}
+    assert position[("start", "fine_tune")] > max(position[("end", "download_model")],
+                                                  position[("end", "download_dataset")])
+    assert position[("start", "quantize")] > position[("end", "fine_tune")]
+    # Each stage sees the results of every stage finished before it started
+    assert ("start", "quantize", ["download_dataset", "download_model", "fine_tune"]) in events
+    assert all(record["status"] == "done" for record in read_state(state_path).values())
+
+
+def test_unknown_dependency_is_rejected(state_path):
+    with pytest.raises(ValueError):
+        Pipeline(state_path).add(Stage("quantize", lambda results: None, deps=["fine_tune"]))
+
+
+def test_failed_attempts_are_retried_with_growing_backoff(state_path, sleeps):
+    attempts = []
+
+    def flaky(results):
+        attempts.append(len(attempts) + 1)
+        if len(attempts) < 3:
+            raise ConnectionError("connection reset")
+        return "pushed"
+
+    pipeline = Pipeline(state_path)
+    pipeline.add(Stage("push_image", flaky, retries=2, retry_delay=30))
+
+    assert pipeline.run() == {"push_image": "pushed"}
+    assert attempts == [1, 2, 3]
+    assert sleeps == [30, 60]
+    record = read_state(state_path)["push_image"]
+    assert record["status"] == "done"
+    assert record["attempt"] == 3
+
+
+def test_retries_give_up_after_the_last_attempt(state_path, sleeps):
+    attempts = []
+
+    def broken(results):
+        attempts.append(1)
+        raise ConnectionError("registry unavailable")
+
+    pipeline = Pipeline(state_path)
+    pipeline.add(Stage("push_image", broken, retries=1, retry_delay=5))
+
+    with pytest.raises(ConnectionError):
+        pipeline.run()
+    assert len(attempts) == 2
+    assert sleeps == [5]
+    record = read_state(state_path)["push_image"]
+    assert record["status"] == "failed"
+    assert record["error"] == "registry unavailable"
+
+
+def test_failing_stage_stops_its_dependents_and_keeps_finished_stages(state_path, tmp_path):
+    ran = []
+    model_path = tmp_path / "model"
+
+    def download(results):
+        ran.append("download_model")
+        model_path.mkdir()
+        return str(model_path)
+
+    def fine_tune(results):
+        ran.append("fine_tune")
+        raise RuntimeError("CUDA out of memory")
+
+    pipeline = Pipeline(state_path)
+    pipeline.add(Stage("download_model", download))
+    pipeline.add(Stage("fine_tune", fine_tune, deps=["download_model"]))
+    pipeline.add(Stage("quantize", lambda results: ran.append("quantize"), deps=["fine_tune"]))
+
+    with pytest.raises(RuntimeError, match="out of memory"):
+        pipeline.run()
+
+    assert ran == ["download_model", "fine_tune"]
+    stages = read_state(state_path)
+    assert stages["download_model"]["status"] == "done"
+    assert stages["download_model"]["result"] == str(model_path)
+    assert stages["fine_tune"]["status"] == "failed"
+    assert "quantize" not in stages
+
+
+def test_resumed_run_skips_stages_whose_outputs_survived(state_path, tmp_path):
+    calls = []
+    dataset_path = tmp_path / "dataset.jsonl"
+    tuned_dir = tmp_path / "finetuned"
+
+    def build(resumed):
+        def download_dataset(results):
+            calls.append("download_dataset")
+            dataset_path.write_text("{}\n")
+
+        def fine_tune(results):
+            calls.append("fine_tune")
+            tuned_dir.mkdir(exist_ok=True)
+            # A timestamped output dir is returned rather than declared up front
+            return str(tuned_dir)
+
+        def quantize(results):
+            calls.append("quantize")
+            if not resumed:
+                raise RuntimeError("preempted")
+            return results["fine_tune"]
+
+        pipeline = Pipeline(state_path)
+        pipeline.add(Stage("download_dataset", download_dataset, outputs=[str(dataset_path)]))
+        pipeline.add(Stage("fine_tune", fine_tune, deps=["download_dataset"]))
+        # Nothing on disk proves this stage finished, so it always reruns
+        pipeline.add(Stage("pull_base_image", lambda results: calls.append("pull_base_image")))
+        pipeline.add(Stage("quantize", quantize, deps=["fine_tune"]))
+        return pipeline
+
+    first = build(resumed=False)
+    assert not first.has_progress()
+    with pytest.raises(RuntimeError):
+        first.run()
+
+    calls.clear()
+    resumed = build(resumed=True)
+    assert resumed.has_progress()
+    results = resumed.run()
+
+    assert sorted(calls) == ["pull_base_image", "quantize"]
+    # Skipped stages still hand their recorded results to their dependents
+    assert results["fine_tune"] == results["quantize"] == str(tuned_dir)
+
+    # A declared output that went missing makes the stage run again
+    calls.clear()
+    dataset_path.unlink()
+    build(resumed=True).run()
+    assert "download_dataset" in calls
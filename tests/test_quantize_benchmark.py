@@ -0,0 +1,138 @@
+import json
+import os
+import sys
+
+import pytest
+
+from com.mhire.fine_tuning import quantize_benchmark
+from com.mhire.fine_tuning.quantize import llama_cpp_dir, write_calibration_text
+from com.mhire.fine_tuning.quantize_benchmark import (benchmark_model, bin_dir, compare_reports, parse_json_array,
+                                                      run_benchmark, run_measured)
+
+# Trimmed llama-perplexity output, the per-chunk "[1]..." estimates also look like arrays
+perplexity_output = """llama_model_loader: loaded meta data with 29 key-value pairs and 12 tensors from model_Q4_K_M.gguf
+system_info: n_threads = 2 (n_threads_batch = 2) / 8 | AVX = 1 | AVX2 = 1 |
+perplexity: tokenizing the input ..
+perplexity: calculating perplexity over 2 chunks, n_ctx=32, batch_size=32, n_seq=1
+[1]14.2011,[2]12.8765,
+Final estimate: PPL = 12.8765 +/- 1.93811
+
+llama_perf_context_print:        load time =      45.67 ms
+llama_perf_context_print: prompt eval time =      12.34 ms /    64 tokens
+"""
+
+# Trimmed llama-bench -o json output with the log lines it interleaves on stderr
+bench_output = """ggml_backend_load_best: failed to load [cpu-haswell]
+[
+  {
+    "build_commit": "3f1ae2e3",
+    "model_filename": "model_Q4_K_M.gguf",
+    "n_threads": 2,
+    "n_prompt": 64,
+    "n_gen": 0,
+    "avg_ts": 412.35,
+    "samples_ts": [410.1, 414.6]
+  },
+  {
+    "build_commit": "3f1ae2e3",
+    "model_filename": "model_Q4_K_M.gguf",
+    "n_threads": 2,
+    "n_prompt": 0,
+    "n_gen": 32,
+    "avg_ts": 88.12,
+    "samples_ts": [87.9, 88.3]
+  }
+]
+"""
+
+
+def test_run_measured_returns_output_and_peak_rss():
+    output, elapsed, rss = run_measured([sys.executable, "-c", "print('hello')"])
+    assert output.strip() == "hello"
+    assert elapsed > 0
+    assert rss > 0
+
+
+def test_run_measured_raises_on_failure():
+    with pytest.raises(RuntimeError, match="exited with code 3"):
+        run_measured([sys.executable, "-c", "import sys; sys.exit(3)"])
+
+
+def test_parse_json_array_skips_bracketed_log_fragments():
+    entries = parse_json_array(bench_output)
+    assert [entry["avg_ts"] for entry in entries] == [412.35, 88.12]
+
+    assert parse_json_array("[1]14.2011,[2]12.8765,\n" + json.dumps([{"n_gen": 1}])) == [{"n_gen": 1}]
+    with pytest.raises(ValueError):
+        parse_json_array(perplexity_output)
+
+
+def test_benchmark_model_reads_perplexity_and_throughput(tmp_path, monkeypatch):
+    gguf_path = tmp_path / "model_Q4_K_M.gguf"
+    gguf_path.write_bytes(b"\0" * 1024)
+    outputs = {"llama-perplexity": (perplexity_output, 0.5, 300 * 1024 * 1024),
+               "llama-bench": (bench_output, 2.0, 200 * 1024 * 1024)}
+    monkeypatch.setattr(quantize_benchmark, "run_measured", lambda command: outputs[os.path.basename(command[0])])
+
+    result = benchmark_model(str(gguf_path), str(tmp_path / "heldout.txt"), threads=2)
+
+    assert result == {"path": str(gguf_path), "size_bytes": 1024, "perplexity": 12.8765, "load_time_sec": 0.04567,
+                      "peak_rss_bytes": 300 * 1024 * 1024, "prompt_tokens_per_sec": 412.35,
+                      "gen_tokens_per_sec": 88.12}
+
+
+def test_compare_reports_flags_perplexity_and_speed_regressions():
+    baseline = {"results": {
+        "Q4_K_M": {"perplexity": 10.0, "prompt_tokens_per_sec": 400.0, "gen_tokens_per_sec": 90.0},
+        "Q8_0": {"perplexity": 9.0, "prompt_tokens_per_sec": 300.0, "gen_tokens_per_sec": 60.0},
+    }}
+    report = {"results": {
+        # Within both tolerances
+        "Q4_K_M": {"perplexity": 10.1, "prompt_tokens_per_sec": 370.0, "gen_tokens_per_sec": 95.0},
+        # Perplexity up 5% and generation down 20%
+        "Q8_0": {"perplexity": 9.45, "prompt_tokens_per_sec": 300.0, "gen_tokens_per_sec": 48.0},
+        # Not in the baseline, so nothing to compare against
+        "Q5_K_M": {"perplexity": 50.0},
+    }}
+
+    assert compare_reports(report, baseline) == ["Q8_0: perplexity 9.0 -> 9.45", "Q8_0: gen_tokens_per_sec 60.0 -> 48.0"]
+    assert compare_reports(report, baseline, max_perplexity_increase=0.1, max_speed_drop=0.25) == []
+    # A missing measurement is not a regression
+    assert compare_reports({"results": {"Q8_0": {"perplexity": None}}}, baseline) == []
+
+
+def test_calibration_text_skips_heldout_records(tmp_path):
+    train_path, eval_path = tmp_path / "train.jsonl", tmp_path / "eval.jsonl"
+    records = [{"prompt": f"prompt {i}", "completion": f"completion {i}"} for i in range(6)]
+    train_path.write_text("".join(json.dumps(record) + "\n" for record in records))
+    # Same records, formatted differently, must still be recognised
+    eval_path.write_text("".join(json.dumps(record, indent=None, separators=(",", ":")) + "\n\n"
+                                 for record in records[4:]))
+
+    count = write_calibration_text(str(train_path), str(tmp_path / "calibration.txt"), exclude_jsonl=str(eval_path))
+
+    assert count == 4
+    text = (tmp_path / "calibration.txt").read_text()
+    assert "prompt 3" in text
+    assert "prompt 4" not in text and "prompt 5" not in text
+
+
+@pytest.mark.skipif(not os.path.isfile(os.path.join(bin_dir, "llama-perplexity")),
+                    reason=f"llama.cpp is not built under {llama_cpp_dir}")
+def test_benchmark_tiny_model_on_cpu(tiny_model_dir, dataset_jsonl, tmp_path):
+    levels = ("Q8_0", "Q4_K_M")
+    # Hold the tail out of the training file, as a real run would before fine-tuning
+    with open(dataset_jsonl, "r", encoding="utf-8") as f:
+        lines = f.readlines()
+    train_path, eval_path = tmp_path / "train.jsonl", tmp_path / "eval.jsonl"
+    train_path.write_text("".join(lines[:-32]))
+    eval_path.write_text("".join(lines[-32:]))
+    report = run_benchmark(tiny_model_dir, str(train_path), str(eval_path), str(tmp_path / "benchmark"), levels=levels,
+                           heldout_records=32, threads=2, context_size=32)
+    assert set(report["results"]) == {*levels, "F16"}
+    for result in report["results"].values():
+        assert result["size_bytes"] > 0
+        assert result["perplexity"] is not None
+        assert result["gen_tokens_per_sec"] > 0
+        assert result["peak_rss_bytes"] > 0
+    assert report["results"]["Q4_K_M"]["size_bytes"] <= report["results"]["F16"]["size_bytes"]
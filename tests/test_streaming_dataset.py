@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+pytest.importorskip("torch")
+
+from com.mhire.fine_tuning import streaming_dataset
+from com.mhire.fine_tuning.streaming_dataset import StreamingJsonlDataset, iter_jsonl
+
+
+def test_shards_are_disjoint_and_only_parse_their_own_lines(dataset_jsonl, monkeypatch):
+    parsed, loads = [], json.loads
+
+    def counting_loads(line):
+        parsed.append(line)
+        return loads(line)
+
+    monkeypatch.setattr(streaming_dataset.json, "loads", counting_loads)
+    everything = list(iter_jsonl(dataset_jsonl))
+    parsed.clear()
+
+    shards = [list(iter_jsonl(dataset_jsonl, shard, 4)) for shard in range(4)]
+    assert len(parsed) == len(everything)
+    assert sorted(record["prompt"] for shard in shards for record in shard) == sorted(
+        record["prompt"] for record in everything)
+    assert shards[1][0] == everything[1]
+
+
+def test_every_tokenization_mode_skips_blank_lines(tiny_model_dir, dataset_jsonl, tmp_path):
+    pytest.importorskip("transformers")
+    from transformers import AutoTokenizer
+
+    from com.mhire.fine_tuning.fine_tuning import FineTuneModel
+
+    with open(dataset_jsonl, "r", encoding="utf-8") as f:
+        lines = f.readlines()
+    blank_path = tmp_path / "blank.jsonl"
+    blank_path.write_text("\n".join(line.rstrip("\n") for line in lines[:4]) + "\n\n   \n" + "".join(lines[4:8]))
+
+    tokenizer = AutoTokenizer.from_pretrained(tiny_model_dir)
+    serial = FineTuneModel().tokenize_dataset(tokenizer, str(blank_path), padding=False)
+    streamed = list(StreamingJsonlDataset(tokenizer, str(blank_path), padding=False))
+
+    assert len(serial) == 8
+    assert [dict(example) for example in serial] == streamed
+
+
+def test_streaming_dataset_has_no_length_but_counts_its_steps(dataset_jsonl):
+    dataset = StreamingJsonlDataset(None, dataset_jsonl)
+
+    assert not hasattr(dataset, "__len__")
+    assert dataset.num_records() == 64
+    assert dataset.num_steps(8) == 8
+    assert dataset.num_steps(10, num_epochs=2) == 14
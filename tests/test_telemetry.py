@@ -0,0 +1,172 @@
+import json
+import re
+import socket
+import urllib.error
+import urllib.request
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from transformers import Trainer, TrainerState
+
+from com.mhire.fine_tuning import fine_tuning, telemetry
+from com.mhire.fine_tuning.fine_tuning import FineTuneModel
+from com.mhire.fine_tuning.telemetry import MetricsServer, TrainingTelemetry
+
+sample_pattern = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*) (-?[0-9]+(\.[0-9]+)?([eE][-+]?[0-9]+)?)$")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def perf_counter(self):
+        return self.now
+
+    def time(self):
+        return 1700000000.0 + self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(telemetry, "time", fake)
+    return fake
+
+
+def read_metrics(telemetry_dir):
+    with open(telemetry_dir / "metrics.jsonl", "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_step_time_is_split_into_data_wait_and_compute(clock, tmp_path):
+    telemetry_dir = tmp_path / "telemetry"
+    training_telemetry = TrainingTelemetry(str(telemetry_dir))
+    state = TrainerState()
+    training_telemetry.on_train_begin(None, state, None)
+
+    # Two micro-batches: 0.5s + 0.25s fetching input, 1.5s + 0.75s of compute
+    for wait_until, tokens, compute_until in ((0.5, 100, 2.0), (2.25, 50, 3.0)):
+        clock.now = wait_until
+        training_telemetry.micro_step_begin(tokens)
+        clock.now = compute_until
+        training_telemetry.micro_step_end()
+    state.global_step = 1
+    training_telemetry.on_step_end(None, state, None)
+
+    # Logging between steps is not counted as waiting for data
+    clock.now = 3.5
+    training_telemetry.on_log(None, state, None, logs={"loss": 1.0})
+    clock.now = 4.0
+    training_telemetry.micro_step_begin(10)
+    clock.now = 5.0
+    training_telemetry.micro_step_end()
+    state.global_step = 2
+    training_telemetry.on_step_end(None, state, None)
+    training_telemetry.on_train_end(None, state, None)
+
+    first, second = read_metrics(telemetry_dir)
+    assert first["step"] == 1
+    assert (first["step_seconds"], first["data_wait_seconds"], first["compute_seconds"]) == (3.0, 0.75, 2.25)
+    assert (first["tokens"], first["tokens_per_sec"]) == (150, 50.0)
+    assert first["host_rss_bytes"] > 0 and first["host_peak_rss_bytes"] > 0
+    assert second["step"] == 2
+    assert (second["step_seconds"], second["data_wait_seconds"], second["compute_seconds"]) == (2.0, 0.5, 1.5)
+
+    with open(telemetry_dir / "summary.json", "r", encoding="utf-8") as f:
+        summary = json.load(f)
+    assert (summary["steps"], summary["tokens"]) == (2, 160)
+    assert summary["data_wait_seconds"] == pytest.approx(1.25)
+    assert summary["data_wait_ratio"] == 0.25
+    assert summary["tokens_per_sec"] == 32.0
+
+
+def test_metrics_endpoint_serves_prometheus_text(clock, tmp_path):
+    training_telemetry = TrainingTelemetry(str(tmp_path / "telemetry"))
+    training_telemetry.on_train_begin(None, TrainerState(), None)
+    clock.now = 1.0
+    training_telemetry.micro_step_begin(64)
+    clock.now = 2.0
+    training_telemetry.on_step_end(None, TrainerState(global_step=1), None)
+
+    server = MetricsServer(training_telemetry, port=0, host="127.0.0.1")
+    server.start()
+    url = f"http://127.0.0.1:{server.httpd.server_address[1]}"
+    try:
+        with urllib.request.urlopen(f"{url}/metrics") as response:
+            content_type = response.headers["Content-Type"]
+            body = response.read().decode("utf-8")
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f"{url}/")
+        assert error.value.code == 404
+    finally:
+        server.stop()
+        training_telemetry.close()
+
+    assert content_type.startswith("text/plain; version=0.0.4")
+    assert body.endswith("\n")
+    # Every sample is preceded by its HELP and TYPE lines and carries a numeric value
+    samples, declared = {}, {}
+    for line in body.splitlines():
+        if line.startswith("# HELP "):
+            declared.setdefault(line.split()[2], set()).add("HELP")
+        elif line.startswith("# TYPE "):
+            _, _, name, metric_type = line.split()
+            assert metric_type in ("counter", "gauge")
+            declared.setdefault(name, set()).add("TYPE")
+        else:
+            match = sample_pattern.match(line)
+            assert match, line
+            assert declared.get(match.group(1)) == {"HELP", "TYPE"}
+            samples[match.group(1)] = float(match.group(2))
+    assert samples["llm_train_steps_total"] == 1
+    assert samples["llm_train_tokens_total"] == 64
+    assert samples["llm_train_data_wait_seconds_total"] == 1.0
+    assert samples["llm_train_host_rss_bytes"] > 0
+
+
+def test_close_is_idempotent_when_training_raises(tiny_model_dir, dataset_jsonl, tmp_path, monkeypatch):
+    created = []
+
+    class RecordingTelemetry(TrainingTelemetry):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            created.append(self)
+
+    original_training_step = Trainer.training_step
+
+    def failing_training_step(self, *args, **kwargs):
+        if self.state.global_step >= 2:
+            raise RuntimeError("CUDA out of memory")
+        return original_training_step(self, *args, **kwargs)
+
+    monkeypatch.setattr(fine_tuning, "TrainingTelemetry", RecordingTelemetry)
+    monkeypatch.setattr(Trainer, "training_step", failing_training_step)
+    telemetry_dir = tmp_path / "telemetry"
+    port = free_port()
+
+    with pytest.raises(RuntimeError, match="out of memory"):
+        FineTuneModel().fine_tune_model(tiny_model_dir, dataset_jsonl, dynamic_padding=True,
+                                        telemetry_dir=str(telemetry_dir), metrics_port=port,
+                                        output_dir=str(tmp_path / "finetuned"))
+
+    # fine_tune_model closed it already: the summary is written and the port is free again
+    training_telemetry, = created
+    assert training_telemetry.server is None and training_telemetry.metrics_file is None
+    assert len(read_metrics(telemetry_dir)) == 2
+    with open(telemetry_dir / "summary.json", "r", encoding="utf-8") as f:
+        assert json.load(f)["steps"] == 2
+    with socket.socket() as s:
+        s.bind(("0.0.0.0", port))
+
+    (telemetry_dir / "summary.json").unlink()
+    training_telemetry.close()
+    assert not (telemetry_dir / "summary.json").exists()
@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from transformers import AutoTokenizer
+
+from com.mhire.fine_tuning import tokenization_cache
+from com.mhire.fine_tuning.fine_tuning import FineTuneModel
+from com.mhire.fine_tuning.streaming_dataset import StreamingJsonlDataset
+from com.mhire.fine_tuning.tokenization_cache import CachedTokenizedDataset, TokenizationCache
+
+
+@pytest.fixture(scope="module")
+def tokenizer(tiny_model_dir):
+    return AutoTokenizer.from_pretrained(tiny_model_dir)
+
+
+def as_lists(example):
+    return {field: list(map(int, values)) for field, values in example.items()}
+
+
+def test_build_then_load_matches_serial_tokenization(tokenizer, dataset_jsonl, tmp_path):
+    cache = TokenizationCache(str(tmp_path / "cache"))
+    key = cache.cache_key(tokenizer, dataset_jsonl, padding=False)
+    assert cache.load(key) is None
+
+    built = cache.build(key, tokenizer, dataset_jsonl, padding=False)
+    loaded = cache.load(key)
+    serial = FineTuneModel().tokenize_dataset(tokenizer, dataset_jsonl, padding=False)
+
+    assert len(built) == len(loaded) == len(serial) == 64
+    assert [as_lists(loaded[i]) for i in range(len(loaded))] == [as_lists(example) for example in serial]
+    assert loaded.lengths() == [max(len(values) for values in example.values()) for example in serial]
+    # Using the tokenizer does not change its key, the padding mode does
+    assert cache.cache_key(tokenizer, dataset_jsonl, padding=False) == key
+    assert cache.cache_key(tokenizer, dataset_jsonl, padding="max_length") != key
+
+
+def test_build_evicts_older_entries_over_budget(tokenizer, dataset_jsonl, tmp_path):
+    cache = TokenizationCache(str(tmp_path / "cache"), max_size_bytes=1)
+    first = cache.cache_key(tokenizer, dataset_jsonl, padding=False)
+    cache.build(first, tokenizer, dataset_jsonl, padding=False)
+    second = cache.cache_key(tokenizer, dataset_jsonl, padding="max_length")
+    cache.build(second, tokenizer, dataset_jsonl, padding="max_length")
+
+    # The entry just built is kept even though it alone exceeds the budget
+    assert cache.load(first) is None
+    assert cache.load(second) is not None
+
+
+def test_stale_staging_dirs_are_removed_on_open(tmp_path):
+    cache_dir = tmp_path / "cache"
+    stale = cache_dir / ".deadbeef.abc123"
+    fresh = cache_dir / ".cafe.def456"
+    for staging_dir in (stale, fresh):
+        staging_dir.mkdir(parents=True)
+        (staging_dir / "input_ids.bin").write_bytes(b"\0" * 16)
+    old = time.time() - 2 * 24 * 3600
+    for path in (stale / "input_ids.bin", stale):
+        os.utime(path, (old, old))
+
+    TokenizationCache(str(cache_dir))
+
+    assert sorted(os.listdir(cache_dir)) == [".cafe.def456"]
+
+
+def test_tokenize_dataset_builds_on_a_miss_and_reads_the_cache_on_a_hit(tokenizer, dataset_jsonl, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    fine_tune_model = FineTuneModel()
+
+    miss = fine_tune_model.tokenize_dataset(tokenizer, dataset_jsonl, cache_dir=cache_dir, padding=False)
+    hit = fine_tune_model.tokenize_dataset(tokenizer, dataset_jsonl, streaming=True, cache_dir=cache_dir,
+                                           padding=False)
+
+    assert isinstance(miss, CachedTokenizedDataset)
+    # A hit wins over streaming
+    assert isinstance(hit, CachedTokenizedDataset)
+    assert fine_tune_model.background_cache is None
+
+
+def test_streaming_miss_builds_the_cache_in_the_background(tokenizer, dataset_jsonl, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    fine_tune_model = FineTuneModel()
+
+    dataset = fine_tune_model.tokenize_dataset(tokenizer, dataset_jsonl, streaming=True, cache_dir=cache_dir,
+                                               padding=False)
+    assert isinstance(dataset, StreamingJsonlDataset)
+    fine_tune_model.background_cache.finish_background_build()
+
+    cache = TokenizationCache(cache_dir)
+    assert cache.load(cache.cache_key(tokenizer, dataset_jsonl, padding=False)) is not None
+
+
+def test_cancelled_background_build_leaves_nothing_behind(tokenizer, dataset_jsonl, tmp_path, monkeypatch):
+    started, gate = threading.Event(), threading.Event()
+
+    class SlowTokenizer(tokenization_cache.ParallelTokenizer):
+        def iter_tokenized(self, jsonl_file_path):
+            for index, example in enumerate(super().iter_tokenized(jsonl_file_path)):
+                if index == 1:
+                    started.set()
+                    gate.wait()
+                yield example
+
+    monkeypatch.setattr(tokenization_cache, "ParallelTokenizer", SlowTokenizer)
+    cache_dir = tmp_path / "cache"
+    cache = TokenizationCache(str(cache_dir))
+    key = cache.cache_key(tokenizer, dataset_jsonl, padding=False)
+    cache.build_in_background(key, tokenizer, dataset_jsonl, padding=False)
+    assert started.wait(30)
+
+    threading.Timer(0.1, gate.set).start()
+    cache.finish_background_build(cancel=True)
+
+    assert cache.load(key) is None
+    assert os.listdir(cache_dir) == []
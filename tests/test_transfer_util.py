@@ -0,0 +1,134 @@
+import os
+
+import pytest
+
+pytest.importorskip("google.cloud.storage")
+pytest.importorskip("google_crc32c")
+
+from google.auth.credentials import AnonymousCredentials
+
+from com.mhire.utility.fake_gcs_server import FakeGcsServer
+from com.mhire.utility.transfer_util import TransferUtil, pooled_storage_client
+
+chunk_size = 64 * 1024
+
+
+@pytest.fixture
+def gcs(monkeypatch):
+    with FakeGcsServer() as server:
+        monkeypatch.setenv("STORAGE_EMULATOR_HOST", server.url)
+        yield server
+
+
+@pytest.fixture
+def storage_client(gcs):
+    return pooled_storage_client(AnonymousCredentials(), project="fake-project", max_workers=8)
+
+
+def test_pooled_client_sizes_its_connection_pool_at_construction(storage_client):
+    for prefix in ("http://", "https://"):
+        assert storage_client._http.get_adapter(prefix).poolmanager.connection_pool_kw["maxsize"] == 8
+
+
+def write_file(path, size):
+    data = os.urandom(size)
+    with open(path, "wb") as f:
+        f.write(data)
+    return data
+
+
+def test_download_fetches_every_range_and_verifies(gcs, storage_client, tmp_path):
+    data = os.urandom(5 * chunk_size + 123)
+    gcs.put_object("bucket", "models/model.zip", data)
+
+    local_path = str(tmp_path / "model.zip")
+    TransferUtil(storage_client, max_workers=4, chunk_size=chunk_size).download("bucket", "models/model.zip", local_path)
+
+    assert open(local_path, "rb").read() == data
+    assert gcs.request_counts["GET media"] == 6
+    assert not os.path.exists(f"{local_path}.part")
+    assert not os.path.exists(f"{local_path}.manifest.json")
+
+
+def test_interrupted_download_resumes_from_the_manifest(gcs, storage_client, tmp_path):
+    data = os.urandom(6 * chunk_size)
+    gcs.put_object("bucket", "model.zip", data)
+    local_path = str(tmp_path / "model.zip")
+    transfer = TransferUtil(storage_client, max_workers=1, chunk_size=chunk_size)
+
+    gcs.download_budget = 2
+    with pytest.raises(Exception):
+        transfer.download("bucket", "model.zip", local_path)
+    assert os.path.exists(f"{local_path}.manifest.json")
+
+    gcs.download_budget = None
+    gcs.request_counts.clear()
+    transfer.download("bucket", "model.zip", local_path)
+
+    assert open(local_path, "rb").read() == data
+    # Only the four chunks the first attempt did not finish are fetched again
+    assert gcs.request_counts["GET media"] == 4
+
+
+def test_download_rejects_a_checksum_mismatch(gcs, storage_client, tmp_path):
+    gcs.put_object("bucket", "model.zip", os.urandom(2 * chunk_size))
+    # Corrupt the stored bytes behind the recorded checksums
+    gcs.objects[("bucket", "model.zip")]["data"] = os.urandom(2 * chunk_size)
+
+    local_path = str(tmp_path / "model.zip")
+    with pytest.raises(IOError):
+        TransferUtil(storage_client, chunk_size=chunk_size).download("bucket", "model.zip", local_path)
+    assert not os.path.exists(local_path)
+    assert not os.path.exists(f"{local_path}.part")
+
+
+def test_small_upload_goes_up_in_one_request(gcs, storage_client, tmp_path):
+    local_path = str(tmp_path / "small.bin")
+    data = write_file(local_path, chunk_size // 2)
+
+    TransferUtil(storage_client, chunk_size=chunk_size).upload(local_path, "bucket", "small.bin")
+
+    assert gcs.get_object("bucket", "small.bin") == data
+    assert gcs.request_counts["POST upload"] == 1
+    assert gcs.request_counts["POST compose"] == 0
+
+
+def test_large_upload_is_composed_from_parts_and_cleaned_up(gcs, storage_client, tmp_path):
+    local_path = str(tmp_path / "model.zip")
+    data = write_file(local_path, 5 * chunk_size + 7)
+
+    TransferUtil(storage_client, max_workers=4, chunk_size=chunk_size).upload(local_path, "bucket", "models/model.zip")
+
+    assert gcs.get_object("bucket", "models/model.zip") == data
+    assert gcs.request_counts["POST upload"] == 6
+    assert gcs.object_names("bucket") == ["models/model.zip"]
+    assert not os.path.exists(f"{local_path}.manifest.json")
+
+
+def test_upload_of_more_than_32_parts_composes_in_rounds(gcs, storage_client, tmp_path):
+    local_path = str(tmp_path / "model.zip")
+    data = write_file(local_path, 40 * 1024)
+
+    TransferUtil(storage_client, max_workers=8, chunk_size=1024).upload(local_path, "bucket", "model.zip")
+
+    assert gcs.get_object("bucket", "model.zip") == data
+    # Two intermediates of up to 32 parts, then the final compose of those two
+    assert gcs.request_counts["POST compose"] == 3
+    assert gcs.object_names("bucket") == ["model.zip"]
+
+
+def test_interrupted_upload_only_sends_the_missing_parts(gcs, storage_client, tmp_path):
+    local_path = str(tmp_path / "model.zip")
+    data = write_file(local_path, 6 * chunk_size)
+    transfer = TransferUtil(storage_client, max_workers=1, chunk_size=chunk_size)
+
+    gcs.upload_budget = 2
+    with pytest.raises(Exception):
+        transfer.upload(local_path, "bucket", "model.zip")
+
+    gcs.upload_budget = None
+    gcs.request_counts.clear()
+    transfer.upload(local_path, "bucket", "model.zip")
+
+    assert gcs.get_object("bucket", "model.zip") == data
+    assert gcs.request_counts["POST upload"] == 4
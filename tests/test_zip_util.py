@@ -0,0 +1,195 @@
+import functools
+import hashlib
+import io
+import json
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from com.mhire.utility import zip_util
+from com.mhire.utility.zip_util import RangeReader, ZipUtil, manifest_name
+
+
+@pytest.fixture
+def model_dir(tmp_path):
+    """A fine-tuned model dir: dense weights plus small, very compressible config files."""
+    output_dir = tmp_path / "model"
+    (output_dir / "nested").mkdir(parents=True)
+    files = {
+        "model.safetensors": os.urandom(64 * 1024),
+        "adapter_model.bin": os.urandom(16 * 1024),
+        "config.json": json.dumps({"hidden_size": 64, "layers": list(range(500))}).encode(),
+        "nested/tokenizer.json": b'{"vocab": "' + b"a" * 32 * 1024 + b'"}',
+    }
+    for name, data in files.items():
+        (output_dir / name).write_bytes(data)
+    return str(output_dir), files
+
+
+def test_zip_stores_weights_and_deflates_the_rest(model_dir):
+    output_dir, files = model_dir
+    zip_file_path = ZipUtil(max_workers=2).zip_model_files(output_dir, "model")
+
+    with zipfile.ZipFile(zip_file_path) as zipf:
+        infos = {info.filename: info for info in zipf.infolist()}
+        assert set(infos) == set(files) | {manifest_name}
+        assert infos["model.safetensors"].compress_type == zipfile.ZIP_STORED
+        assert infos["adapter_model.bin"].compress_type == zipfile.ZIP_STORED
+        assert infos["config.json"].compress_type == zipfile.ZIP_DEFLATED
+        assert infos["nested/tokenizer.json"].compress_size < len(files["nested/tokenizer.json"]) // 10
+        assert zipf.testzip() is None
+        manifest = json.loads(zipf.read(manifest_name))
+
+    assert sorted(entry["path"] for entry in manifest["files"]) == sorted(files)
+    for entry in manifest["files"]:
+        assert entry["size"] == len(files[entry["path"]])
+        assert entry["sha256"] == hashlib.sha256(files[entry["path"]]).hexdigest()
+
+
+def test_zip_skips_its_own_and_earlier_archives(model_dir):
+    output_dir, files = model_dir
+    zip_util = ZipUtil()
+    first = zip_util.zip_model_files(output_dir, "model")
+    os.rename(first, os.path.join(output_dir, "model_20000101_000000.zip"))
+
+    with zipfile.ZipFile(zip_util.zip_model_files(output_dir, "model")) as zipf:
+        assert set(zipf.namelist()) == set(files) | {manifest_name}
+
+
+def test_zip_round_trips_through_unzip(model_dir, tmp_path):
+    output_dir, files = model_dir
+    zip_util = ZipUtil()
+    extract_to_path = tmp_path / "extracted"
+
+    zip_util.unzip_file(zip_util.zip_model_files(output_dir, "model"), str(extract_to_path))
+
+    for name, data in files.items():
+        assert (extract_to_path / name).read_bytes() == data
+
+
+def test_tar_zst_streams_into_a_fileobj_and_round_trips(model_dir):
+    zstandard = pytest.importorskip("zstandard")
+    output_dir, files = model_dir
+    upload = io.BytesIO()
+
+    archive_path, manifest = ZipUtil().tar_zst_model_files(output_dir, "model", fileobj=upload)
+
+    assert archive_path is None
+    assert not upload.closed
+    with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(upload.getvalue())) as reader:
+        with tarfile.open(fileobj=reader, mode="r|") as tar:
+            members = {member.name: tar.extractfile(member).read() for member in tar}
+
+    # The manifest leads so a reader can check files as they arrive
+    assert next(iter(members)) == manifest_name
+    assert json.loads(members.pop(manifest_name)) == manifest
+    assert members == files
+
+
+def test_tar_zst_writes_next_to_the_output_dir(model_dir):
+    pytest.importorskip("zstandard")
+    output_dir, files = model_dir
+
+    archive_path, manifest = ZipUtil().tar_zst_model_files(output_dir, "model")
+
+    assert os.path.dirname(archive_path) == os.path.dirname(output_dir)
+    assert archive_path.endswith(".tar.zst")
+    assert len(manifest["files"]) == len(files)
+
+
+class RecordingFetcher:
+    def __init__(self, data):
+        self.data = data
+        self.ranges = []
+
+    def __call__(self, start, end):
+        self.ranges.append((start, end))
+        return self.data[start:end + 1]
+
+
+def test_range_reader_reads_across_buffer_boundaries():
+    data = os.urandom(1000)
+    fetch_range = RecordingFetcher(data)
+    reader = RangeReader(fetch_range, len(data), buffer_size=64)
+
+    assert reader.read(10) == data[:10]
+    assert reader.read(60) == data[10:70]
+    # The second read ran past the first buffer, so it fetched from where it started
+    assert fetch_range.ranges == [(0, 63), (10, 73)]
+    assert reader.read(4) == data[70:74]
+    assert len(fetch_range.ranges) == 2
+
+    # A read larger than the buffer is fetched in one range
+    reader.seek(100)
+    assert reader.read(300) == data[100:400]
+    assert fetch_range.ranges[-1] == (100, 399)
+
+    assert reader.seek(-5, io.SEEK_END) == 995
+    assert reader.read() == data[995:]
+    assert reader.read(1) == b""
+    assert reader.seek(10, io.SEEK_CUR) == 1000
+
+    buffer = bytearray(8)
+    reader.seek(2)
+    assert reader.readinto(buffer) == 8
+    assert bytes(buffer) == data[2:10]
+
+
+def build_zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zipf:
+        for name, data in members.items():
+            compress_type = zipfile.ZIP_STORED if name.endswith(".safetensors") else zipfile.ZIP_DEFLATED
+            zipf.writestr(name, data, compress_type=compress_type)
+    return buffer.getvalue()
+
+
+def test_extract_remote_reads_a_zip_through_small_buffers(tmp_path, monkeypatch):
+    members = {"model.safetensors": os.urandom(20000), "nested/config.json": b'{"a": 1}' * 500}
+    data = build_zip(members)
+    extracted = []
+
+    # Shrink the buffer so every member spans several range requests
+    monkeypatch.setattr(zip_util, "RangeReader", functools.partial(RangeReader, buffer_size=4096))
+    paths = ZipUtil().extract_remote(RecordingFetcher(data), len(data), str(tmp_path), max_workers=2,
+                                     on_extracted=extracted.append)
+
+    assert sorted(paths) == sorted(extracted)
+    for name, member_data in members.items():
+        assert (tmp_path / name).read_bytes() == member_data
+    assert not list(tmp_path.rglob("*.partial"))
+
+
+def test_extract_remote_refuses_paths_outside_the_target(tmp_path):
+    data = build_zip({"../escape.txt": b"nope"})
+
+    with pytest.raises(ValueError):
+        ZipUtil().extract_remote(RecordingFetcher(data), len(data), str(tmp_path / "out"))
+    assert not (tmp_path / "escape.txt").exists()
+
+
+def test_extract_remote_streams_members_from_gcs(tmp_path, monkeypatch):
+    pytest.importorskip("google.cloud.storage")
+    from google.auth.credentials import AnonymousCredentials
+
+    from com.mhire.utility.fake_gcs_server import FakeGcsServer
+    from com.mhire.utility.transfer_util import TransferUtil, pooled_storage_client
+
+    members = {"model-00001.safetensors": os.urandom(300 * 1024), "model-00002.safetensors": os.urandom(200 * 1024),
+               "tokenizer.json": b'{"vocab": []}' * 1000}
+    data = build_zip(members)
+
+    with FakeGcsServer() as gcs:
+        monkeypatch.setenv("STORAGE_EMULATOR_HOST", gcs.url)
+        gcs.put_object("bucket", "models/model.zip", data)
+        storage_client = pooled_storage_client(AnonymousCredentials(), project="fake-project")
+        fetch_range, size = TransferUtil(storage_client).range_fetcher("bucket", "models/model.zip")
+        ZipUtil().extract_remote(fetch_range, size, str(tmp_path), max_workers=3)
+
+    for name, member_data in members.items():
+        assert (tmp_path / name).read_bytes() == member_data
+    # Only the members land on disk, never the archive or a half-written file
+    assert sorted(os.listdir(tmp_path)) == sorted(members)
+    assert gcs.request_counts["GET media"] > 0